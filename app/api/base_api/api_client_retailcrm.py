@@ -1,42 +1,278 @@
 from typing import List
-import json
+import asyncio
+import math
+
+import httpx
+
+from api.base_api import json_codec
+from api.base_api.batching import BatchLoader
+from api.base_api.cache import ResponseCache
 from api.base_api.client_base import BaseClient
+from api.base_api.exceptions import UpstreamUnavailableError
+from api.base_api.rate_limiter import RateLimiter
+from api.base_api.resilience import RetryPolicy, circuit_breaker_for
+from api.base_api.response import Response
 import logging
 
+# RetailCRM accepts at most 50 entities per /orders/upload and /customers/upload call
+UPLOAD_LIMIT = 50
+
+# answers RetailCRM gives without processing the write: it was rate limited
+UNSENT_STATUSES = (429, 503)
+# failures that happen before the request reaches RetailCRM
+UNSENT_ERRORS = (UpstreamUnavailableError, httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# order list filter matching any of several customer ids
+CUSTOMER_IDS_FILTER = 'customerIds'
+# a batched order lookup spanning more pages than this falls back to one call per customer
+ORDERS_BATCH_MAX_PAGES = 5
+
+
+def split_upload_result(response, items: list[dict], entity: str) -> list[dict]:
+    """
+    Per-item outcome of an /orders/upload or /customers/upload call.
+    A partial failure (HTTP 460) lists the uploaded entities by externalId.
+    Failures worth retrying later are marked ``retryable``, and also
+    ``unsent`` when RetailCRM did not process the call, so resending
+    cannot create duplicates.
+
+    :param response: Response
+    :param items: the uploaded entities, in request order
+    :param entity: 'Orders' or 'Customers'
+    :return: list of dict
+    """
+    body = response.get_response() or {}
+    uploaded = body.get(f'uploaded{entity}') or []
+
+    if response.is_successful():
+        return [
+            {'success': True, **(uploaded[i] if i < len(uploaded) else {})}
+            for i in range(len(items))
+        ]
+
+    uploaded_by_external_id = {
+        entry.get('externalId'): entry for entry in uploaded if entry.get('externalId')
+    }
+    errors = body.get('errors')
+    error_msg = body.get('errorMsg', 'Upload failed')
+    # the whole call failed on RetailCRM's side, the same items may succeed later
+    retryable = response.get_status_code() == 429 or response.get_status_code() >= 500
+    unsent = response.get_status_code() in UNSENT_STATUSES
+
+    results = []
+    for i, item in enumerate(items):
+        entry = uploaded_by_external_id.get(item.get('externalId'))
+        if entry is not None:
+            results.append({'success': True, **entry})
+            continue
+        if isinstance(errors, dict) and str(i) in errors:
+            error = errors[str(i)]
+        elif isinstance(errors, dict) and item.get('externalId') in errors:
+            error = errors[item['externalId']]
+        else:
+            error = error_msg
+        result = {'success': False, 'error': error, 'errors': errors}
+        if retryable:
+            result['retryable'] = True
+        if unsent:
+            result['unsent'] = True
+        results.append(result)
+    return results
+
+
+def _filter_params(filters: dict | None) -> dict:
+    params = {}
+    for k, v in (filters or {}).items():
+        if isinstance(v, (list, tuple)):
+            params[f"filter[{k}][]"] = list(v)
+        else:
+            params[f"filter[{k}]"] = v
+    return params
+
 
 class ApiClientRetailCRM(BaseClient):
 
-    def __init__(self, crm_base_url, crm_api_key):
-        BaseClient.__init__(self, crm_base_url=crm_base_url, crm_api_key=crm_api_key)
+    def __init__(self,
+                 crm_base_url,
+                 crm_api_key,
+                 cache: ResponseCache | None = None,
+                 orders_batch_window: float = 0.0,
+                 orders_batch_size: int = 50,
+                 **client_options):
+        BaseClient.__init__(self, crm_base_url=crm_base_url, crm_api_key=crm_api_key, **client_options)
+        self.cache = cache
         self.logger = logging.getLogger(__name__)
+        if cache is not None:
+            self.fallback = self._stale_fallback
+        # first-page order lookups of different customers share one /orders call
+        self.orders_loader = None
+        if orders_batch_window > 0:
+            self.orders_loader = BatchLoader(
+                self._orders_for_customers, 'orders_by_customer',
+                window=orders_batch_window, max_batch=orders_batch_size,
+            )
+
+    @classmethod
+    def from_settings(cls, settings, **client_options):
+        """
+        Build the shared, pooled client from application settings
+        :param settings: config.Settings
+        :return: ApiClientRetailCRM
+        """
+        limits = httpx.Limits(
+            max_connections=settings.crm_max_connections,
+            max_keepalive_connections=settings.crm_max_keepalive_connections,
+            keepalive_expiry=settings.crm_keepalive_expiry,
+        )
+        timeout = httpx.Timeout(
+            connect=settings.crm_connect_timeout,
+            read=settings.crm_read_timeout,
+            write=settings.crm_write_timeout,
+            pool=settings.crm_pool_timeout,
+        )
+        return cls(
+            crm_base_url=settings.base_url,
+            crm_api_key=settings.api_key,
+            limits=limits,
+            timeout=timeout,
+            http2=settings.crm_http2,
+            coalesce_gets=settings.crm_coalesce_gets,
+            rate_limiter=RateLimiter.from_settings(settings),
+            retry_policy=RetryPolicy(
+                max_attempts=settings.crm_retry_attempts,
+                base_delay=settings.crm_retry_base_delay,
+                max_delay=settings.crm_retry_max_delay,
+                max_retry_after=settings.crm_retry_max_retry_after,
+            ),
+            circuit_breaker=circuit_breaker_for(
+                httpx.URL(settings.base_url).host,
+                failure_threshold=settings.crm_breaker_failure_threshold,
+                reset_timeout=settings.crm_breaker_reset_timeout,
+            ),
+            orders_batch_window=settings.crm_orders_batch_window,
+            orders_batch_size=settings.crm_orders_batch_size,
+            **client_options
+        )
+
+    def batching_stats(self) -> dict:
+        """
+        First-page order lookups batched into one /orders call;
+        ``fill_ratio`` shows how full the batches were on average.
+
+        :return: dict
+        """
+        if self.orders_loader is None:
+            return {'enabled': False}
+        return {'enabled': True, **self.orders_loader.stats()}
+
+    async def close_client(self):
+        if self.orders_loader is not None:
+            await self.orders_loader.close()
+        await BaseClient.close_client(self)
+
+    async def _cached_get(self, endpoint, params, use_cache: bool = True):
+        if self.cache is None or not use_cache:
+            return await self.get(endpoint=endpoint, params=params)
+
+        cached = await self.cache.get(endpoint, params)
+        if cached is not None:
+            return cached
+
+        response = await self.get(endpoint=endpoint, params=params)
+        if response.cache_status == ResponseCache.STALE:
+            return response
+        if response.is_successful():
+            await self.cache.set(endpoint, params, response)
+        response.cache_status = ResponseCache.MISS
+        return response
+
+    async def _stale_fallback(self, method, endpoint, params):
+        response = await self.cache.get_stale(endpoint, params)
+        if response is not None:
+            self.logger.warning("Serving stale %s %s, RetailCRM is unavailable", method, endpoint)
+        return response
+
+    async def _invalidate(self, *prefixes):
+        if self.cache is not None:
+            await self.cache.invalidate(*prefixes)
+
+    def _customer_orders_prefixes(self, customer_id: int) -> list[str]:
+        return [
+            self.cache.make_prefix('/orders', **{'filter[customerId]': customer_id}),
+            # lists keyed by externalId can not be told apart by the customer id
+            self.cache.make_key('/orders') + 'filter[customerExternalId]=',
+        ]
+
+    async def _invalidate_for_order(self, order: dict):
+        customer = order.get('customer') or {}
+        prefixes = [self.cache.make_prefix('/customers')]
+        if customer.get('id') is not None:
+            prefixes.append(self.cache.make_prefix(f"/customers/{customer['id']}", by='id'))
+            prefixes.extend(self._customer_orders_prefixes(customer['id']))
+        else:
+            if customer.get('externalId'):
+                prefixes.append(self.cache.make_prefix(f"/customers/{customer['externalId']}", by='externalId'))
+            prefixes.append(self.cache.make_prefix('/orders'))
+        await self._invalidate(*prefixes)
+
+    async def invalidate_customer(self, customer_id: int | None = None, external_id: str | None = None):
+        """
+        Drop cached lookups of a customer changed outside this service.
+
+        :param customer_id: integer
+        :param external_id: string
+        """
+        if self.cache is None:
+            return
+        prefixes = [self.cache.make_prefix('/customers')]
+        if customer_id is not None:
+            prefixes.append(self.cache.make_prefix(f"/customers/{customer_id}", by='id'))
+        if external_id:
+            prefixes.append(self.cache.make_prefix(f"/customers/{external_id}", by='externalId'))
+        await self._invalidate(*prefixes)
+
+    async def invalidate_customer_orders(self, customer_id: int | None = None):
+        """
+        Drop cached order lists of a customer, or every order list when
+        the customer is not known.
+
+        :param customer_id: integer
+        """
+        if self.cache is None:
+            return
+        if customer_id is None:
+            await self._invalidate(self.cache.make_prefix('/orders'))
+        else:
+            await self._invalidate(*self._customer_orders_prefixes(customer_id))
 
     async def get_customers(self,
                             limit: int = 100,
                             page: int = 1,
-                            filters: dict = None):
+                            filters: dict = None,
+                            use_cache: bool = True):
         """
         :param limit: integer
         :param page: integer
         :param filters: dict
+        :param use_cache: boolean, False for one-off reads such as exports
         :return: Response
         """
         try:
             params = {
                 'limit': limit,
                 'page': page,
+                **_filter_params(filters),
             }
 
-            if filters:
-                for k, v in filters.items():
-                    params[f"filter[{k}]"] = v
-
-            return await self.get(
+            return await self._cached_get(
                 endpoint=f"/customers",
-                params=params
+                params=params,
+                use_cache=use_cache
             )
 
         except Exception as e:
             self.logger.error(e)
+            raise
 
     async def create_customer(self,
                               customer: dict,
@@ -50,18 +286,22 @@ class ApiClientRetailCRM(BaseClient):
 
             data = {
                 'site': site,
-                'customer': json.dumps(
+                'customer': json_codec.dumps_str(
                     customer
                 ),
             }
 
-            return await self.post(
+            response = await self.post(
                 endpoint='/customers/create',
-                json=data
+                data=data
             )
+            if response.is_successful() and self.cache is not None:
+                await self._invalidate(self.cache.make_prefix('/customers'))
+            return response
 
         except Exception as e:
             self.logger.error(e)
+            raise
 
     async def get_customer(self,
                            customer_id: str | int,
@@ -79,13 +319,14 @@ class ApiClientRetailCRM(BaseClient):
                 'by': id_type
             }
 
-            return await self.get(
+            return await self._cached_get(
                 endpoint=f'/customers/{customer_id}',
                 params=params
             )
 
         except Exception as e:
             self.logger.error(e)
+            raise
 
     async def order_create(self, order: dict, site: str | None = None):
         """
@@ -95,38 +336,75 @@ class ApiClientRetailCRM(BaseClient):
         """
         try:
             data = {
-                'order': json.dumps(order)
+                'order': json_codec.dumps_str(order)
             }
 
             if site is not None:
                 data['site'] = site
 
-            return await self.post(
+            response = await self.post(
                 endpoint='/orders/create',
-                json=data
+                data=data
             )
+            if response.is_successful() and self.cache is not None:
+                await self._invalidate_for_order(order)
+            return response
         except Exception as e:
             self.logger.error(f"Ошибка при создании заказа: {e}")
             raise
 
+    async def get_orders(self,
+                         filters: dict = None,
+                         limit: int = 100,
+                         page: int = 1,
+                         use_cache: bool = True):
+        """
+        :param filters: dict, list values become ``filter[key][]``
+        :param limit: integer
+        :param page: integer
+        :param use_cache: boolean
+        :return: Response
+        """
+        try:
+            params = {
+                'limit': limit,
+                'page': page,
+                **_filter_params(filters),
+            }
+
+            return await self._cached_get(
+                endpoint='/orders',
+                params=params,
+                use_cache=use_cache
+            )
+        except Exception as e:
+            self.logger.error(f"Error fetching orders: {e}")
+            raise
+
     async def get_orders_by_customer(
             self,
-            customer_id: int,
+            customer_id: int | str,
             site: str | None = None,
             limit: int = 20,
-            page: int = 1
+            page: int = 1,
+            id_type: str = 'id'
     ):
-
+        """
+        :param customer_id: customer id, or externalId with ``id_type='externalId'``
+        :return: Response
+        """
         try:
             params = {
                 'limit': limit,
                 'page': page,
-                'filter[customerId]': customer_id,
+                'filter[customerExternalId]' if id_type == 'externalId' else 'filter[customerId]': customer_id,
             }
             if site:
                 params['site'] = site
 
-            return await self.get(
+            if self.orders_loader is not None and id_type == 'id' and page == 1 and str(customer_id).isdigit():
+                return await self._batched_orders_by_customer(customer_id, site, limit, params)
+            return await self._cached_get(
                 endpoint='/orders',
                 params=params
             )
@@ -134,6 +412,76 @@ class ApiClientRetailCRM(BaseClient):
             self.logger.error(f"Error fetching orders by customer: {e}")
             raise
 
+    async def _batched_orders_by_customer(self, customer_id: int, site: str | None, limit: int, params: dict):
+        if self.cache is not None:
+            cached = await self.cache.get('/orders', params)
+            if cached is not None:
+                return cached
+
+        try:
+            response = await self.orders_loader.load((site, limit), int(customer_id))
+        except UpstreamUnavailableError:
+            stale = await self._stale_fallback('GET', '/orders', params) if self.cache is not None else None
+            if stale is None:
+                raise
+            return stale
+        if response is None:
+            # the batch had too many orders to split reliably
+            return await self._cached_get(endpoint='/orders', params=params)
+
+        if self.cache is not None and response.is_successful():
+            await self.cache.set('/orders', params, response)
+            response.cache_status = ResponseCache.MISS
+        return response
+
+    async def _orders_for_customers(self, group: tuple, customer_ids: list[int]) -> dict:
+        """
+        One /orders call for the first page of orders of several customers,
+        split into a response per customer shaped like a single-customer
+        lookup.
+
+        :return: dict customer id -> Response, or None when the combined
+            list spans more than ORDERS_BATCH_MAX_PAGES pages
+        """
+        site, limit = group
+        params = {'limit': 100, **_filter_params({CUSTOMER_IDS_FILTER: customer_ids})}
+        if site:
+            params['site'] = site
+
+        first = await self.get(endpoint='/orders', params={**params, 'page': 1})
+        if not first.is_successful():
+            return {customer_id: first for customer_id in customer_ids}
+        total_pages = (first.get_value('pagination') or {}).get('totalPageCount', 1)
+        if total_pages > ORDERS_BATCH_MAX_PAGES:
+            return {customer_id: None for customer_id in customer_ids}
+
+        responses = [first, *await asyncio.gather(*(
+            self.get(endpoint='/orders', params={**params, 'page': page}) for page in range(2, total_pages + 1)
+        ))]
+        for response in responses:
+            if not response.is_successful():
+                return {customer_id: response for customer_id in customer_ids}
+
+        by_customer = {customer_id: [] for customer_id in customer_ids}
+        for response in responses:
+            for order in response.get_value('orders') or []:
+                orders = by_customer.get((order.get('customer') or {}).get('id'))
+                if orders is not None:
+                    orders.append(order)
+        return {
+            customer_id: Response(200, {
+                'success': True,
+                'pagination': {
+                    'limit': limit,
+                    'totalCount': len(orders),
+                    'currentPage': 1,
+                    'totalPageCount': max(1, math.ceil(len(orders) / limit)),
+                },
+                'orders': orders[:limit],
+            })
+            for customer_id, orders in by_customer.items()
+        }
+
     async def order_payment_create(self,
                                    payment: dict,
                                    site: str):
@@ -145,14 +493,163 @@ class ApiClientRetailCRM(BaseClient):
         try:
             data = {
                 'site': site,
-                'payment': json.dumps(
+                'payment': json_codec.dumps_str(
                     payment
                 ),
             }
 
-            return await self.post(
+            response = await self.post(
                 endpoint='/orders/payments/create',
-                json=data
+                data=data
             )
+            if response.is_successful() and self.cache is not None:
+                await self._invalidate(self.cache.make_prefix('/orders'))
+            return response
         except Exception as e:
             self.logger.error(e)
+            raise
+
+    async def orders_upload(self, orders: list[dict], site: str | None = None):
+        """
+        :param orders: list of dict, at most UPLOAD_LIMIT
+        :param site: str | None
+        :return: Response
+        """
+        data = {
+            'orders': json_codec.dumps_str(orders)
+        }
+        if site is not None:
+            data['site'] = site
+
+        return await self.post(
+            endpoint='/orders/upload',
+            data=data
+        )
+
+    async def _upload_in_chunks(self, upload, items: list[dict], site, entity, chunk_size, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def upload_chunk(chunk):
+            async with semaphore:
+                try:
+                    response = await upload(chunk, site)
+                except (UpstreamUnavailableError, httpx.HTTPError) as e:
+                    self.logger.error(f"Upload of {len(chunk)} {entity.lower()} failed: {e}")
+                    failure = {'success': False, 'error': str(e), 'retryable': True}
+                    if isinstance(e, UNSENT_ERRORS):
+                        failure['unsent'] = True
+                    return [dict(failure) for _ in chunk]
+            return split_upload_result(response, chunk, entity)
+
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        chunk_results = await asyncio.gather(*(upload_chunk(chunk) for chunk in chunks))
+        return [result for results in chunk_results for result in results]
+
+    async def upload_orders(self,
+                            orders: list[dict],
+                            site: str | None = None,
+                            chunk_size: int = UPLOAD_LIMIT,
+                            concurrency: int = 4) -> list[dict]:
+        """
+        Upload any number of orders through /orders/upload, ``chunk_size`` per call
+        and at most ``concurrency`` calls at a time. One failing chunk or order
+        does not fail the others.
+
+        :return: per-order results, in input order
+        """
+        results = await self._upload_in_chunks(
+            self.orders_upload, orders, site, 'Orders', min(chunk_size, UPLOAD_LIMIT), concurrency
+        )
+        if self.cache is not None and any(result['success'] for result in results):
+            await self._invalidate(self.cache.path_prefix('/orders'), self.cache.path_prefix('/customers'))
+        return results
+
+    async def customers_upload(self, customers: list[dict], site: str | None = None):
+        """
+        :param customers: list of dict, at most UPLOAD_LIMIT
+        :param site: str | None
+        :return: Response
+        """
+        data = {
+            'customers': json_codec.dumps_str(customers)
+        }
+        if site is not None:
+            data['site'] = site
+
+        return await self.post(
+            endpoint='/customers/upload',
+            data=data
+        )
+
+    async def upload_customers(self,
+                               customers: list[dict],
+                               site: str | None = None,
+                               chunk_size: int = UPLOAD_LIMIT,
+                               concurrency: int = 4) -> list[dict]:
+        """
+        Upload any number of customers through /customers/upload,
+        see upload_orders().
+
+        :return: per-customer results, in input order
+        """
+        results = await self._upload_in_chunks(
+            self.customers_upload, customers, site, 'Customers', min(chunk_size, UPLOAD_LIMIT), concurrency
+        )
+        if self.cache is not None and any(result['success'] for result in results):
+            await self._invalidate(self.cache.make_prefix('/customers'))
+        return results
+
+    async def get_history(self, entity: str, since_id: int | None = None, limit: int = 100):
+        """
+        :param entity: 'customers' or 'orders'
+        :param since_id: integer, id of the last history record already seen
+        :param limit: integer
+        :return: Response
+        """
+        try:
+            params = {'limit': limit}
+            if since_id is not None:
+                params['filter[sinceId]'] = since_id
+
+            return await self.get(
+                endpoint=f'/{entity}/history',
+                params=params
+            )
+        except Exception as e:
+            self.logger.error(f"Error fetching {entity} history: {e}")
+            raise
+
+    async def get_offers(self, limit: int = 100, page: int = 1, filters: dict = None):
+        """
+        :param limit: integer
+        :param page: integer
+        :param filters: dict
+        :return: Response with the ``offers`` of the store catalog
+        """
+        try:
+            params = {
+                'limit': limit,
+                'page': page,
+                **_filter_params(filters),
+            }
+
+            return await self.get(
+                endpoint='/store/offers',
+                params=params
+            )
+        except Exception as e:
+            self.logger.error(f"Error fetching offers: {e}")
+            raise
+
+    async def get_reference(self, dictionary: str):
+        """
+        :param dictionary: 'sites', 'payment-types', 'payment-statuses', 'statuses', 'order-types', ...
+        :return: Response
+        """
+        try:
+            return await self.get(
+                endpoint=f'/reference/{dictionary}'
+            )
+        except Exception as e:
+            self.logger.error(f"Error fetching reference {dictionary}: {e}")
+            raise
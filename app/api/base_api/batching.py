@@ -0,0 +1,109 @@
+"""
+Micro-batching of lookups that arrive close together
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+from observability import metrics
+
+
+class BatchLoader:
+    """
+    Collects ``load(group, key)`` calls made within ``window`` seconds of
+    the first one and resolves them with a single ``batch_fn(group, keys)``
+    call per group. A batch is sent early once it holds ``max_batch``
+    distinct keys; callers asking for the same key share one slot.
+
+    ``batch_fn`` returns a dict with a result for every key, or raises,
+    in which case every caller of the batch gets the exception.
+    """
+
+    def __init__(self,
+                 batch_fn: Callable[[Hashable, list], Awaitable[dict]],
+                 name: str,
+                 window: float = 0.005,
+                 max_batch: int = 50):
+        self.batch_fn = batch_fn
+        self.name = name
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: dict[Hashable, dict[Hashable, list[asyncio.Future]]] = {}
+        self._timers: dict[Hashable, asyncio.TimerHandle] = {}
+        self._running: dict[asyncio.Task, dict[Hashable, list[asyncio.Future]]] = {}
+
+        self.loads_total = 0
+        self.keys_total = 0
+        self.batches_total = 0
+        self.failed_total = 0
+
+    async def load(self, group: Hashable, key: Hashable) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(group, {})
+        batch.setdefault(key, []).append(future)
+        self.loads_total += 1
+
+        if len(batch) >= self.max_batch:
+            self._dispatch(group)
+        elif group not in self._timers:
+            self._timers[group] = loop.call_later(self.window, self._dispatch, group)
+        return await future
+
+    def _dispatch(self, group: Hashable) -> None:
+        timer = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(group, None)
+        if not batch:
+            return
+        task = asyncio.create_task(self._run(group, batch))
+        self._running[task] = batch
+        task.add_done_callback(lambda done: self._running.pop(done, None))
+
+    async def _run(self, group: Hashable, batch: dict[Hashable, list[asyncio.Future]]) -> None:
+        self.batches_total += 1
+        self.keys_total += len(batch)
+        metrics.observe_batch(self.name, len(batch), self.max_batch)
+        try:
+            results = await self.batch_fn(group, list(batch))
+        except BaseException as e:
+            self.failed_total += 1
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return
+        for key, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(results[key])
+
+    def stats(self) -> dict:
+        return {
+            'window': self.window,
+            'max_batch': self.max_batch,
+            'pending': sum(len(batch) for batch in self._pending.values()),
+            'loads_total': self.loads_total,
+            'keys_total': self.keys_total,
+            'batches_total': self.batches_total,
+            'failed_total': self.failed_total,
+            # share of the batch capacity that was used, 1.0 means every batch was full
+            'fill_ratio': self.keys_total / (self.batches_total * self.max_batch) if self.batches_total else 0.0,
+        }
+
+    async def close(self) -> None:
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        batches = list(self._pending.values()) + list(self._running.values())
+        self._pending.clear()
+        tasks = list(self._running)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for batch in batches:
+            for futures in batch.values():
+                for future in futures:
+                    future.cancel()
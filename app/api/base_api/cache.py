@@ -0,0 +1,208 @@
+"""
+Response cache for RetailCRM lookups
+"""
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from api.base_api import json_codec
+from api.base_api.response import Response
+
+
+class CacheBackend:
+    """
+    Storage interface used by ResponseCache. Values are opaque bytes.
+    """
+
+    async def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def delete_prefix(self, prefix: str) -> int:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    In-process LRU cache with per-entry TTL. Not shared between workers.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key: str) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete_prefix(self, prefix: str) -> int:
+        keys = [key for key in self._entries if key.startswith(prefix)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Cache shared by all uvicorn workers, stored in Redis.
+    Any client with the ``redis.asyncio.Redis`` interface can be passed in.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    @classmethod
+    def from_url(cls, url: str):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("cache_backend=redis requires the 'redis' package") from e
+        return cls(aioredis.from_url(url))
+
+    async def get(self, key: str) -> bytes | None:
+        return await self.redis.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.redis.set(key, value, px=max(int(ttl * 1000), 1))
+
+    async def delete_prefix(self, prefix: str) -> int:
+        pattern = ''.join('\\' + ch if ch in '[]?*\\' else ch for ch in prefix) + '*'
+        keys = [key async for key in self.redis.scan_iter(match=pattern)]
+        if not keys:
+            return 0
+        return await self.redis.delete(*keys)
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+class ResponseCache:
+    """
+    Read-through cache of successful GET responses.
+
+    Keys are built from namespace + endpoint + sorted params, so
+    ``/orders?filter[customerId]=5&...`` can be invalidated by prefix.
+    """
+
+    HIT = 'HIT'
+    MISS = 'MISS'
+    STALE = 'STALE'
+
+    def __init__(self,
+                 backend: CacheBackend,
+                 ttl: float = 30.0,
+                 namespace: str = 'retailcrm',
+                 stale_ttl: float = 0.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.namespace = namespace
+        # expired entries are kept this long to be served while RetailCRM is down
+        self.stale_ttl = stale_ttl
+
+    @classmethod
+    def from_settings(cls, settings, namespace: str = 'retailcrm'):
+        """
+        :param settings: config.Settings
+        :return: ResponseCache or None when caching is disabled
+        """
+        if settings.cache_backend == 'none':
+            return None
+        if settings.cache_backend == 'memory':
+            backend = MemoryCacheBackend(max_entries=settings.cache_max_entries)
+        elif settings.cache_backend == 'redis':
+            backend = RedisCacheBackend.from_url(settings.cache_redis_url)
+        else:
+            raise ValueError(f"Unknown cache backend: {settings.cache_backend}")
+        return cls(backend, ttl=settings.cache_ttl, namespace=namespace, stale_ttl=settings.cache_stale_ttl)
+
+    def make_key(self, endpoint: str, params: dict | None = None) -> str:
+        query = urlencode(sorted((params or {}).items()), safe='[]')
+        return f"{self.namespace}:{endpoint}?{query}"
+
+    def make_prefix(self, endpoint: str, **params) -> str:
+        """
+        Prefix matching every cached call of ``endpoint`` whose leading
+        sorted params equal ``params``.
+        """
+        prefix = self.make_key(endpoint, params)
+        return prefix + '&' if params else prefix
+
+    def path_prefix(self, path: str) -> str:
+        """
+        Prefix matching every cached call of ``path`` and of the endpoints below it.
+        """
+        return f"{self.namespace}:{path}"
+
+    async def _load(self, endpoint: str, params: dict | None, allow_stale: bool) -> Response | None:
+        stored = await self.backend.get(self.make_key(endpoint, params))
+        if stored is None:
+            return None
+        header, _, raw = stored.partition(b'\n')
+        entry = json_codec.loads(header)
+        fresh = entry['expires'] > time.time()
+        if not fresh and not allow_stale:
+            return None
+        response = Response(entry['status'], raw=raw)
+        response.cache_status = self.HIT if fresh else self.STALE
+        return response
+
+    async def get(self, endpoint: str, params: dict | None = None) -> Response | None:
+        return await self._load(endpoint, params, allow_stale=False)
+
+    async def get_stale(self, endpoint: str, params: dict | None = None) -> Response | None:
+        """
+        Like get(), but also returns entries past their TTL within ``stale_ttl``
+        """
+        return await self._load(endpoint, params, allow_stale=True)
+
+    async def set(self, endpoint: str, params: dict | None, response: Response) -> None:
+        # "<header json>\n<body bytes as received>", so hits skip re-encoding the body
+        header = json_codec.dumps({
+            'status': response.get_status_code(),
+            'expires': time.time() + self.ttl,
+        })
+        stored = header + b'\n' + response.get_raw()
+        await self.backend.set(self.make_key(endpoint, params), stored, self.ttl + self.stale_ttl)
+
+    def _encoded_key(self, digest: str, encoding: str) -> str:
+        # keyed by body digest, so entries never need invalidating
+        return f"{self.namespace}:#{encoding}:{digest}"
+
+    async def get_encoded(self, digest: str, encoding: str) -> bytes | None:
+        """
+        :param digest: digest of the uncompressed body
+        :param encoding: content coding, e.g. 'gzip'
+        :return: compressed body stored by set_encoded(), or None
+        """
+        return await self.backend.get(self._encoded_key(digest, encoding))
+
+    async def set_encoded(self, digest: str, encoding: str, body: bytes) -> None:
+        await self.backend.set(self._encoded_key(digest, encoding), body, self.ttl + self.stale_ttl)
+
+    async def invalidate(self, *prefixes: str) -> None:
+        for prefix in prefixes:
+            await self.backend.delete_prefix(prefix)
+
+    async def close(self) -> None:
+        await self.backend.close()
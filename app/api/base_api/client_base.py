@@ -1,15 +1,46 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+from urllib.parse import urlencode
+
 import httpx
 
+from api.base_api.exceptions import UpstreamUnavailableError
+from api.base_api.rate_limiter import RateLimiter
+from api.base_api.resilience import CircuitBreaker, RetryPolicy
 from api.base_api.response import Response
+from api.base_api.single_flight import SingleFlight
+from observability import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+Fallback = Callable[[str, str, dict | None], Awaitable[Response | None]]
 
 
 class BaseClient:
     """
     Client base class of RetailCRM
+
+    One instance owns one pooled ``httpx.AsyncClient`` and is meant to be
+    shared by the whole application (see ``server.server.lifespan``).
     """
 
-    def __init__(self, crm_base_url, crm_api_key):
+    def __init__(self,
+                 crm_base_url,
+                 crm_api_key,
+                 limits: httpx.Limits | None = None,
+                 timeout: httpx.Timeout | None = None,
+                 http2: bool = False,
+                 coalesce_gets: bool = True,
+                 rate_limiter: RateLimiter | None = None,
+                 retry_policy: RetryPolicy | None = None,
+                 circuit_breaker: CircuitBreaker | None = None,
+                 transport: httpx.AsyncBaseTransport | None = None,
+                 name: str = metrics.DEFAULT_TENANT):
         self.crm_base_url = crm_base_url
+        # tenant the client belongs to, used as a metric label
+        self.name = name
         self.crm_api_key = crm_api_key
 
         if self.crm_api_key:
@@ -19,38 +50,228 @@ class BaseClient:
         else:
             raise ValueError("ApiKey is None")
 
+        self.limits = limits or httpx.Limits()
+        self.timeout = timeout or httpx.Timeout(30.0)
+
         if self.crm_base_url:
-            self.client = httpx.AsyncClient(base_url=str(self.crm_base_url) + '/api/v5')
+            self.client = httpx.AsyncClient(
+                base_url=str(self.crm_base_url) + '/api/v5',
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=http2,
+                transport=transport,
+            )
         else:
             raise ValueError("ApiUrl is None")
 
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._requests_total = 0
+
+        self.coalescer = SingleFlight() if coalesce_gets else None
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=1)
+        self.circuit_breaker = circuit_breaker
+
+        # called for GETs RetailCRM could not answer, e.g. to serve stale cache
+        self.fallback: Fallback | None = None
+
+        self.retries_total = 0
+        self.retries_exhausted_total = 0
+        self.fallbacks_total = 0
+
     async def close_client(self):
         if self.client:
             await self.client.aclose()
 
-    async def post(self, endpoint, params=None, json=None, timeout=None) -> Response:
+    def pool_stats(self) -> dict:
+        """
+        Connection pool usage, used to size ``crm_max_connections``
+        and ``crm_max_keepalive_connections``.
+
+        :return: dict
+        """
+        stats = {
+            'max_connections': self.limits.max_connections,
+            'max_keepalive_connections': self.limits.max_keepalive_connections,
+            'keepalive_expiry': self.limits.keepalive_expiry,
+            'in_flight': self._in_flight,
+            'peak_in_flight': self._peak_in_flight,
+            'requests_total': self._requests_total,
+            'connections': None,
+            'active_connections': None,
+            'idle_connections': None,
+            'queued_requests': None,
+        }
+
+        # httpcore does not publish pool counters, so peek at the pool
+        # only when the default transport is in use.
+        pool = getattr(self.client._transport, '_pool', None)
+        if pool is not None:
+            connections = list(pool.connections)
+            idle = sum(1 for conn in connections if conn.is_idle())
+            stats['connections'] = len(connections)
+            stats['idle_connections'] = idle
+            stats['active_connections'] = len(connections) - idle
+            stats['queued_requests'] = len(getattr(pool, '_requests', ()))
+
+        return stats
+
+    def coalescing_stats(self) -> dict:
+        """
+        Identical concurrent GETs share one upstream call;
+        ``coalesced_total`` counts the calls that were saved.
+
+        :return: dict
+        """
+        if self.coalescer is None:
+            return {'enabled': False}
+        return {'enabled': True, **self.coalescer.stats()}
+
+    def rate_limit_stats(self) -> dict:
+        """
+        :return: dict
+        """
+        if self.rate_limiter is None:
+            return {'enabled': False}
+        return {'enabled': True, **self.rate_limiter.stats()}
+
+    def resilience_stats(self) -> dict:
+        """
+        :return: dict
+        """
+        return {
+            'circuit_breaker': self.circuit_breaker.stats() if self.circuit_breaker else None,
+            'retries_total': self.retries_total,
+            'retries_exhausted_total': self.retries_exhausted_total,
+            'fallbacks_total': self.fallbacks_total,
+        }
+
+    async def _fallback(self, method, endpoint, params) -> Response | None:
+        if self.fallback is None or method != 'GET':
+            return None
+        response = await self.fallback(method, endpoint, params)
+        if response is not None:
+            self.fallbacks_total += 1
+        return response
+
+    def _record_outcome(self, failed: bool) -> None:
+        if self.circuit_breaker is None:
+            return
+        if failed:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
+    async def _send(self, method, endpoint, params=None, json=None, data=None, timeout=None) -> Response:
+        if not tracing.enabled():
+            return await self._send_with_retries(method, endpoint, params=params, json=json, data=data, timeout=timeout)
+
+        with tracing.span(
+            f"{method} {metrics.endpoint_label(endpoint)}",
+            kind=tracing.SpanKind.CLIENT,
+            **{
+                'http.request.method': method,
+                'url.path': endpoint,
+                'server.address': self.client.base_url.host,
+                'retailcrm.tenant': self.name,
+            },
+        ) as span:
+            retries_before = self.retries_total
+            response = await self._send_with_retries(method, endpoint, params=params, json=json, data=data, timeout=timeout)
+            span.set_attribute('http.response.status_code', response.get_status_code())
+            span.set_attribute('http.response.body.size', len(response.get_raw()))
+            span.set_attribute('http.request.resend_count', self.retries_total - retries_before)
+            if response.cache_status:
+                span.set_attribute('retailcrm.cache', response.cache_status)
+            return response
+
+    async def _send_with_retries(self, method, endpoint, params=None, json=None, data=None, timeout=None) -> Response:
+        attempts = self.retry_policy.attempts_for(method)
+
+        for attempt in range(attempts):
+            is_last = attempt == attempts - 1
+            try:
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.before_call()
+                response = await self._attempt(method, endpoint, params=params, json=json, data=data, timeout=timeout)
+            except UpstreamUnavailableError:
+                fallback = await self._fallback(method, endpoint, params)
+                if fallback is not None:
+                    return fallback
+                raise
+            except httpx.TransportError as e:
+                self._record_outcome(failed=True)
+                logger.warning("[%s ERROR] %s: %s", method, endpoint, e)
+                delay = None if is_last else self.retry_policy.delay(attempt)
+                if delay is None:
+                    if attempts > 1:
+                        self.retries_exhausted_total += 1
+                    fallback = await self._fallback(method, endpoint, params)
+                    if fallback is not None:
+                        return fallback
+                    raise
+            else:
+                status_code = response.get_status_code()
+                self._record_outcome(failed=status_code >= 500)
+                if status_code not in self.retry_policy.retry_statuses:
+                    return response
+
+                delay = None if is_last else self.retry_policy.delay(attempt, response.retry_after)
+                if delay is None:
+                    if attempts > 1:
+                        self.retries_exhausted_total += 1
+                    fallback = await self._fallback(method, endpoint, params)
+                    return fallback if fallback is not None else response
+
+            self.retries_total += 1
+            await asyncio.sleep(delay)
+
+    async def _attempt(self, method, endpoint, params=None, json=None, data=None, timeout=None) -> Response:
+        if self.rate_limiter is None:
+            return await self._dispatch(method, endpoint, params=params, json=json, data=data, timeout=timeout)
+
+        async with self.rate_limiter.acquire(method, endpoint) as permit:
+            response = await self._dispatch(method, endpoint, params=params, json=json, data=data, timeout=timeout)
+            permit.status_code = response.get_status_code()
+            return response
+
+    async def _dispatch(self, method, endpoint, params=None, json=None, data=None, timeout=None) -> Response:
+        self._in_flight += 1
+        self._requests_total += 1
+        self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        metrics.UPSTREAM_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        status_code = None
         try:
-            response = await self.client.post(
-                endpoint,
-                params=params,
-                json=json,
-                timeout=timeout,
-                headers=self.headers
-            )
+            kwargs = {
+                'params': params,
+                'headers': tracing.inject(self.headers),
+            }
+            if json is not None:
+                kwargs['json'] = json
+            if data is not None:
+                kwargs['data'] = data
+            if timeout is not None:
+                kwargs['timeout'] = timeout
+
+            response = await self.client.request(method, endpoint, **kwargs)
+            status_code = response.status_code
             return Response.from_httpx(response)
-        except httpx.HTTPError as e:
-            print(f"[POST ERROR] {e}")
-            raise
+        finally:
+            self._in_flight -= 1
+            metrics.UPSTREAM_IN_FLIGHT.dec()
+            metrics.observe_upstream(self.name, method, endpoint, status_code, time.perf_counter() - started)
+
+    async def post(self, endpoint, params=None, json=None, data=None, timeout=None) -> Response:
+        return await self._send('POST', endpoint, params=params, json=json, data=data, timeout=timeout)
 
     async def get(self, endpoint, params=None, timeout=None) -> Response:
-        try:
-            response = await self.client.get(
-                endpoint,
-                params=params,
-                timeout=timeout,
-                headers=self.headers
-            )
-            return Response.from_httpx(response)
-        except httpx.HTTPError as e:
-            print(f"[GET ERROR] {e}")
-            raise
+        if self.coalescer is None:
+            return await self._send('GET', endpoint, params=params, timeout=timeout)
+
+        key = f"{endpoint}?{urlencode(sorted((params or {}).items()), doseq=True)}"
+        return await self.coalescer.do(
+            key,
+            lambda: self._send('GET', endpoint, params=params, timeout=timeout)
+        )
@@ -0,0 +1,25 @@
+"""
+Errors raised by the RetailCRM client layer
+"""
+
+
+class UpstreamUnavailableError(Exception):
+    """
+    RetailCRM can not be called right now; routes answer 503.
+    """
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamBusyError(UpstreamUnavailableError):
+    """
+    The client-side rate limiter could not admit the call in time.
+    """
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """
+    The circuit breaker for the RetailCRM host is open.
+    """
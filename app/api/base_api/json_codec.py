@@ -0,0 +1,77 @@
+"""
+JSON encoding used on every request and response path
+
+orjson is used when installed; the stdlib json module is the fallback.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+class StdlibBackend:
+    name = 'stdlib'
+
+    @staticmethod
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+    @staticmethod
+    def loads(data: bytes | str):
+        return json.loads(data)
+
+
+class OrjsonBackend:
+    name = 'orjson'
+
+    @staticmethod
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    @staticmethod
+    def loads(data: bytes | str):
+        return orjson.loads(data)
+
+
+_backend = OrjsonBackend if orjson is not None else StdlibBackend
+
+
+def use_backend(name: str) -> None:
+    """
+    :param name: 'orjson', 'stdlib' or 'auto'
+    """
+    global _backend
+    if name == 'auto':
+        _backend = OrjsonBackend if orjson is not None else StdlibBackend
+    elif name == 'orjson':
+        if orjson is None:
+            raise RuntimeError("json_backend=orjson requires the 'orjson' package")
+        _backend = OrjsonBackend
+    elif name == 'stdlib':
+        _backend = StdlibBackend
+    else:
+        raise ValueError(f"Unknown JSON backend: {name}")
+
+
+def backend_name() -> str:
+    return _backend.name
+
+
+def dumps(obj) -> bytes:
+    """
+    :return: compact UTF-8 encoded JSON
+    """
+    return _backend.dumps(obj)
+
+
+def dumps_str(obj) -> str:
+    """
+    JSON text, for RetailCRM form fields such as ``order=<json>``
+    """
+    return _backend.dumps(obj).decode()
+
+
+def loads(data: bytes | str):
+    return _backend.loads(data)
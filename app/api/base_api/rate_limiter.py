@@ -0,0 +1,236 @@
+"""
+Client-side rate limiting and adaptive concurrency for RetailCRM calls
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from api.base_api.exceptions import UpstreamBusyError
+
+LIST = 'list'
+LOOKUP = 'lookup'
+WRITE = 'write'
+
+# collection endpoints that are listed or paged through rather than looked up
+_LIST_ENDPOINTS = ('/customers', '/orders', '/store/offers')
+
+
+def classify_endpoint(method: str, endpoint: str) -> str:
+    """
+    :return: budget class of the call, one of LIST, LOOKUP, WRITE
+    """
+    if method != 'GET':
+        return WRITE
+    path = endpoint.rstrip('/')
+    if path in _LIST_ENDPOINTS or path.endswith('/history') or path.startswith('/reference'):
+        return LIST
+    return LOOKUP
+
+
+class TokenBucket:
+    """
+    Classic token bucket; ``rate`` tokens per second up to ``burst``.
+    Reservations may drive the balance negative so waiters are served in order.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """
+        :return: seconds until one more token would be available
+        """
+        self._refill()
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill()
+        self._tokens -= 1
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD limit on concurrent upstream calls. The limit grows by one per
+    window of successful calls and is cut when RetailCRM answers 429/503,
+    fails, or responds slower than ``latency_target``.
+    """
+
+    def __init__(self,
+                 initial: int = 20,
+                 minimum: int = 1,
+                 maximum: int = 100,
+                 latency_target: float = 1.0,
+                 backoff_ratio: float = 0.7):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.limit = float(initial)
+        self.in_use = 0
+        self.backoffs_total = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    async def acquire(self, timeout: float) -> None:
+        if self.in_use < int(self.limit) and not self._waiters:
+            self.in_use += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise UpstreamBusyError("RetailCRM concurrency limit reached", retry_after=1.0)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release_slot()
+            raise
+        finally:
+            if future in self._waiters:
+                self._waiters.remove(future)
+
+    def release(self, status_code: int | None, latency: float) -> None:
+        overloaded = status_code is None or status_code in (429, 503) or latency > self.latency_target
+        if overloaded:
+            self.limit = max(self.minimum, self.limit * self.backoff_ratio)
+            self.backoffs_total += 1
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        self.in_use -= 1
+        while self._waiters and self.in_use < int(self.limit):
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_use += 1
+                future.set_result(None)
+
+
+class Permit:
+    """
+    Handed to the caller for one upstream call; the caller records the status.
+    """
+    __slots__ = ('budget', 'status_code')
+
+    def __init__(self, budget: str):
+        self.budget = budget
+        self.status_code = None
+
+
+class RateLimiter:
+    """
+    Admission for every upstream call of one client: a token bucket for the
+    API key, one per endpoint class and the adaptive concurrency cap.
+    Waiting is bounded by ``max_queue`` callers and ``max_wait`` seconds,
+    after which UpstreamBusyError is raised.
+    """
+
+    def __init__(self,
+                 rate: float,
+                 burst: float,
+                 class_rates: dict[str, float] | None = None,
+                 concurrency: AdaptiveConcurrencyLimiter | None = None,
+                 max_queue: int = 1000,
+                 max_wait: float = 5.0):
+        self.bucket = TokenBucket(rate, burst)
+        self.class_buckets = {
+            budget: TokenBucket(class_rate, max(1.0, min(burst, class_rate)))
+            for budget, class_rate in (class_rates or {}).items()
+        }
+        self.concurrency = concurrency or AdaptiveConcurrencyLimiter()
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.queued = 0
+        self.rejected_total = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        :param settings: config.Settings
+        :return: RateLimiter or None when rate limiting is disabled
+        """
+        if settings.crm_rate_limit <= 0:
+            return None
+        concurrency = AdaptiveConcurrencyLimiter(
+            initial=settings.crm_concurrency_initial,
+            minimum=settings.crm_concurrency_min,
+            maximum=settings.crm_concurrency_max,
+            latency_target=settings.crm_latency_target,
+        )
+        return cls(
+            rate=settings.crm_rate_limit,
+            burst=settings.crm_rate_burst,
+            class_rates=settings.crm_rate_limits,
+            concurrency=concurrency,
+            max_queue=settings.crm_queue_max,
+            max_wait=settings.crm_queue_max_wait,
+        )
+
+    def _reject(self, message: str, retry_after: float) -> UpstreamBusyError:
+        self.rejected_total += 1
+        return UpstreamBusyError(message, retry_after=retry_after)
+
+    async def _wait_for_tokens(self, budget: str, deadline: float) -> None:
+        buckets = [self.bucket]
+        if budget in self.class_buckets:
+            buckets.append(self.class_buckets[budget])
+
+        delay = max(bucket.delay() for bucket in buckets)
+        if delay and time.monotonic() + delay > deadline:
+            raise self._reject(f"RetailCRM rate limit for '{budget}' calls exceeded", retry_after=delay)
+        for bucket in buckets:
+            bucket.take()
+        if delay:
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def acquire(self, method: str, endpoint: str):
+        if self.queued >= self.max_queue:
+            raise self._reject("RetailCRM request queue is full", retry_after=1.0)
+
+        permit = Permit(classify_endpoint(method, endpoint))
+        deadline = time.monotonic() + self.max_wait
+        self.queued += 1
+        try:
+            await self._wait_for_tokens(permit.budget, deadline)
+            try:
+                await self.concurrency.acquire(max(deadline - time.monotonic(), 0))
+            except UpstreamBusyError:
+                self.rejected_total += 1
+                raise
+        finally:
+            self.queued -= 1
+
+        started = time.monotonic()
+        try:
+            yield permit
+        finally:
+            self.concurrency.release(permit.status_code, time.monotonic() - started)
+
+    def stats(self) -> dict:
+        return {
+            'tokens': round(self.bucket.tokens, 2),
+            'class_tokens': {budget: round(bucket.tokens, 2) for budget, bucket in self.class_buckets.items()},
+            'concurrency_limit': int(self.concurrency.limit),
+            'in_flight': self.concurrency.in_use,
+            'queued': self.queued,
+            'rejected_total': self.rejected_total,
+            'backoffs_total': self.concurrency.backoffs_total,
+        }
@@ -0,0 +1,134 @@
+"""
+Retries and circuit breaking for RetailCRM calls
+"""
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+from api.base_api.exceptions import CircuitOpenError
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    :param value: Retry-After header, seconds or HTTP date
+    :return: seconds to wait or None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter. Only idempotent calls are retried.
+    """
+
+    def __init__(self,
+                 max_attempts: int = 3,
+                 base_delay: float = 0.2,
+                 max_delay: float = 5.0,
+                 max_retry_after: float = 10.0,
+                 retry_statuses: tuple[int, ...] = (429, 502, 503, 504)):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = retry_statuses
+
+    def attempts_for(self, method: str) -> int:
+        # a call is always made at least once
+        return max(1, self.max_attempts) if method in ('GET', 'HEAD') else 1
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float | None:
+        """
+        :param attempt: zero-based number of the failed attempt
+        :param retry_after: delay requested by the upstream
+        :return: seconds to sleep, or None when the call should not be retried
+        """
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Per-host breaker: opens after ``failure_threshold`` consecutive failures,
+    rejects calls for ``reset_timeout`` seconds, then lets a single probe
+    through (half-open) and closes again when it succeeds.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started = None
+        self.opened_total = 0
+        self.short_circuited_total = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probe_started = None
+        return self._state
+
+    def before_call(self) -> None:
+        state = self.state
+        if state == CLOSED:
+            return
+        now = time.monotonic()
+        # a probe that never reported back (cancelled, rejected locally) expires
+        if state == HALF_OPEN and (self._probe_started is None or now - self._probe_started >= self.reset_timeout):
+            self._probe_started = now
+            return
+        self.short_circuited_total += 1
+        retry_after = max(self.reset_timeout - (now - self._opened_at), 1.0)
+        raise CircuitOpenError("RetailCRM is unavailable, circuit breaker is open", retry_after=retry_after)
+
+    def record_success(self) -> None:
+        self._state = CLOSED
+        self._failures = 0
+        self._probe_started = None
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+            self._state = OPEN
+            self._opened_at = time.monotonic()
+            self._probe_started = None
+            self.opened_total += 1
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'consecutive_failures': self._failures,
+            'opened_total': self.opened_total,
+            'short_circuited_total': self.short_circuited_total,
+        }
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def circuit_breaker_for(host: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> CircuitBreaker:
+    """
+    :return: the breaker shared by every client talking to ``host``
+    """
+    if host not in _breakers:
+        _breakers[host] = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+    return _breakers[host]
@@ -1,55 +1,186 @@
 """
 Response class
 """
+import json
+import re
+from typing import Any, Iterator
+
 import httpx
 
+from api.base_api import json_codec
+from api.base_api.resilience import parse_retry_after
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_STRUCTURAL = re.compile(r'[{}\[\]"]')
+_SCALAR_END = re.compile(r'[,}\]\s]')
+_decoder = json.JSONDecoder()
+
+# marks a body that has not been parsed from the raw bytes yet
+_UNPARSED = object()
+
+
+def _skip_ws(text: str, i: int) -> int:
+    return _WHITESPACE.match(text, i).end()
+
+
+def _skip_value(text: str, i: int) -> int:
+    """
+    :return: index right after the JSON value starting at ``i``, without building it
+    """
+    ch = text[i]
+    if ch == '"':
+        return _STRING.match(text, i).end()
+    if ch not in '{[':
+        match = _SCALAR_END.search(text, i)
+        return match.start() if match else len(text)
+
+    depth = 0
+    while True:
+        match = _STRUCTURAL.search(text, i)
+        ch = match.group()
+        if ch == '"':
+            i = _STRING.match(text, match.start()).end()
+            continue
+        depth += 1 if ch in '{[' else -1
+        i = match.end()
+        if depth == 0:
+            return i
+
+
+def _locate(text: str, key: str) -> int | None:
+    """
+    :return: index of the value of top-level ``key``, or None
+    """
+    i = _skip_ws(text, 0)
+    if text[i:i + 1] != '{':
+        return None
+    i = _skip_ws(text, i + 1)
+    while i < len(text) and text[i] == '"':
+        end = _STRING.match(text, i).end()
+        name = json.loads(text[i:end])
+        i = _skip_ws(text, end)
+        i = _skip_ws(text, i + 1)  # ':'
+        if name == key:
+            return i
+        i = _skip_ws(text, _skip_value(text, i))
+        if text[i:i + 1] == ',':
+            i = _skip_ws(text, i + 1)
+    return None
+
 
 class Response:
     """
     API response class
+
+    Keeps the raw body and parses it on first access; the parsed body is
+    cached. iter_items() walks a large top-level array one element at a
+    time without building the whole document.
     """
 
-    def __init__(self, code, body):
-        self.__status_code = code
-        self.__response_body = body
+    __slots__ = ('_status_code', '_raw', '_body', 'retry_after', 'cache_status')
+
+    def __init__(self, code, body=_UNPARSED, retry_after: float | None = None, raw: bytes | None = None):
+        self._status_code = code
+        self._body = body
+        self._raw = raw
+        self.retry_after = retry_after
+        self.cache_status = None
 
     def get_status_code(self):
         """
         :return: integer
         """
-        return self.__status_code
+        return self._status_code
 
     def get_response(self):
         """
-        :return: string
+        :return: parsed body
+        """
+        if self._body is _UNPARSED:
+            try:
+                self._body = json_codec.loads(self._raw)
+            except Exception:
+                self._body = {"errorMsg": f"Invalid JSON response: {self._raw.decode(errors='replace')}"}
+                self._raw = None
+        return self._body
+
+    def get_raw(self):
+        """
+        Body as JSON bytes, exactly as RetailCRM sent it when available
+        :return: bytes
         """
-        return self.__response_body
+        if self._raw is None:
+            self._raw = json_codec.dumps(self.get_response())
+        return self._raw
+
+    def get_value(self, key: str, default: Any = None) -> Any:
+        """
+        Top-level ``key`` of the body; only that value is parsed
+        """
+        if self._body is not _UNPARSED:
+            return self._body.get(key, default)
+        try:
+            # UnicodeDecodeError is a ValueError, invalid bodies take the full parse path
+            text = self._raw.decode()
+            start = _locate(text, key)
+            if start is None:
+                return default
+            return _decoder.raw_decode(text, start)[0]
+        except (ValueError, AttributeError, IndexError):
+            return self.get_response().get(key, default)
+
+    def iter_items(self, key: str) -> Iterator[Any]:
+        """
+        Elements of the top-level array ``key`` (e.g. 'customers', 'orders'),
+        parsed one at a time
+        """
+        if self._body is _UNPARSED:
+            try:
+                text = self._raw.decode()
+                start = _locate(text, key)
+            except (ValueError, AttributeError, IndexError):
+                self.get_response()
+        if self._body is not _UNPARSED:
+            items = self._body.get(key)
+            if isinstance(items, list):
+                yield from items
+            return
+        if start is None or text[start] != '[':
+            return
+
+        i = _skip_ws(text, start + 1)
+        if text[i] == ']':
+            return
+        while True:
+            item, i = _decoder.raw_decode(text, i)
+            yield item
+            i = _skip_ws(text, i)
+            if text[i] == ']':
+                return
+            i = _skip_ws(text, i + 1)  # ','
 
     def is_successful(self):
         """
         :return: boolean
         """
-        return int(self.__status_code) < 400
+        return int(self._status_code) < 400
 
     def get_error_msg(self):
         """
         :return: string
         """
-        return self.__response_body['errorMsg']
+        return self.get_response()['errorMsg']
 
     def get_errors(self):
         """
         :return: collection
         """
 
-        errors = self.__response_body.get('errors', {})
+        errors = self.get_response().get('errors', {})
 
         return errors
 
     @classmethod
     def from_httpx(cls, resp: httpx.Response):
-        try:
-            body = resp.json()
-        except Exception as e:
-            body = {"errorMsg": f"Invalid JSON response: {resp.text}"}
-        return cls(resp.status_code, body)
+        return cls(resp.status_code, raw=resp.content, retry_after=parse_retry_after(resp.headers.get('Retry-After')))
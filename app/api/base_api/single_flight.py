@@ -0,0 +1,78 @@
+"""
+Coalescing of identical concurrent calls
+"""
+import asyncio
+import hashlib
+import os
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class _Call:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 1
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers arriving while a call
+    for the same key is in flight await its result instead of starting
+    their own. Cancelling one caller does not cancel the shared call.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, _Call] = {}
+        # keys the digests of stats(), so they cannot be matched against guessed values
+        self._salt = os.urandom(16)
+        self.calls_total = 0
+        self.coalesced_total = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            self.calls_total += 1
+            call.task.add_done_callback(lambda task: self._forget(key, call))
+        else:
+            call.waiters += 1
+            self.coalesced_total += 1
+
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.task.cancelled():
+            # mark the exception as retrieved when every waiter has gone
+            call.task.exception()
+
+    def waiters(self) -> dict[Hashable, int]:
+        """
+        :return: number of callers waiting on each in-flight key
+        """
+        return {key: call.waiters for key, call in self._calls.items()}
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._calls),
+            'calls_total': self.calls_total,
+            'coalesced_total': self.coalesced_total,
+            'waiters': {self._label(key): count for key, count in self.waiters().items()},
+        }
+
+    def _label(self, key: Hashable) -> str:
+        """
+        Opaque name of a key for stats, e.g. ``customers#1f3a9c0e52d4``: keys
+        hold query values such as e-mail filters, only the first path segment
+        of an endpoint is kept readable.
+        """
+        text = str(key)
+        resource = text.split('?', 1)[0].split('/')[1] if text.startswith('/') else ''
+        digest = hashlib.blake2b(text.encode(), digest_size=6, key=self._salt).hexdigest()
+        return f"{resource}#{digest}"
@@ -0,0 +1,212 @@
+"""
+Persistent queue of RetailCRM writes accepted for background submission
+"""
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from api.base_api import json_codec
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            TEXT PRIMARY KEY,
+    kind          TEXT NOT NULL,
+    tenant        TEXT,
+    site          TEXT,
+    payload       TEXT NOT NULL,
+    status        TEXT NOT NULL,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    available_at  REAL NOT NULL,
+    lease_owner   TEXT,
+    lease_expires REAL,
+    result        TEXT,
+    error         TEXT,
+    created_at    REAL NOT NULL,
+    updated_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (kind, status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (status, updated_at);
+"""
+
+ORDER = 'order'
+PAYMENT = 'payment'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+# the write may or may not have reached RetailCRM; left for an operator to check
+UNKNOWN = 'unknown'
+
+
+class JobQueue:
+    """
+    Jobs survive restarts: they are committed to SQLite before the request
+    is acknowledged. Several workers and processes may claim from the same
+    file; a claimed job is leased, and a lease that expires (the worker
+    died) makes the job claimable again, flagged ``lease_expired``.
+
+    Writes may wait up to ``busy_timeout`` for another process holding the
+    file, so JobRunner calls them from worker threads; each thread gets its
+    own connection.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self.conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(jobs)')}
+        if 'tenant' not in columns:
+            # queue files written before tenants existed
+            self.conn.execute('ALTER TABLE jobs ADD COLUMN tenant TEXT')
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """
+        Connection of the calling thread
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=5000')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    @contextmanager
+    def transaction(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def enqueue(self, kind: str, payload: dict, site: str | None = None, tenant: str | None = None) -> str:
+        """
+        :param tenant: RetailCRM account of the job, None for the default one
+        :return: job id
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.conn.execute(
+            'INSERT INTO jobs (id, kind, tenant, site, payload, status, available_at, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, kind, tenant, site, json_codec.dumps_str(payload), QUEUED, now, now, now),
+        )
+        return job_id
+
+    def claim(self, kind: str, owner: str, limit: int, lease: float) -> list[dict]:
+        """
+        Lease up to ``limit`` due jobs of ``kind``, oldest first, all for the
+        same tenant and site so they can go into one upload call.
+
+        :return: list of job dicts with the decoded payload; ``lease_expired``
+            is True for a job whose previous worker may have sent it already
+        """
+        now = time.time()
+        with self.transaction():
+            first = self.conn.execute(
+                'SELECT tenant, site FROM jobs WHERE kind = ? AND '
+                '((status = ? AND available_at <= ?) OR (status = ? AND lease_expires <= ?)) '
+                'ORDER BY available_at LIMIT 1',
+                (kind, QUEUED, now, RUNNING, now),
+            ).fetchone()
+            if first is None:
+                return []
+            rows = self.conn.execute(
+                'SELECT id, site, payload, attempts, status FROM jobs WHERE kind = ? AND tenant IS ? AND site IS ? AND '
+                '((status = ? AND available_at <= ?) OR (status = ? AND lease_expires <= ?)) '
+                'ORDER BY available_at LIMIT ?',
+                (kind, first[0], first[1], QUEUED, now, RUNNING, now, limit),
+            ).fetchall()
+            self.conn.executemany(
+                'UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, '
+                'lease_expires = ?, updated_at = ? WHERE id = ?',
+                [(RUNNING, owner, now + lease, now, row[0]) for row in rows],
+            )
+        return [
+            {
+                'id': row[0], 'kind': kind, 'tenant': first[0], 'site': row[1],
+                'payload': json_codec.loads(row[2]), 'attempts': row[3] + 1, 'lease_expired': row[4] == RUNNING,
+            }
+            for row in rows
+        ]
+
+    def _finish(self, job_id: str, status: str, result=None, error=None, available_at: float | None = None) -> None:
+        now = time.time()
+        self.conn.execute(
+            'UPDATE jobs SET status = ?, result = ?, error = ?, available_at = COALESCE(?, available_at), '
+            'lease_owner = NULL, lease_expires = NULL, updated_at = ? WHERE id = ?',
+            (
+                status,
+                json_codec.dumps_str(result) if result is not None else None,
+                json_codec.dumps_str(error) if error is not None else None,
+                available_at, now, job_id,
+            ),
+        )
+
+    def succeed(self, job_id: str, result) -> None:
+        self._finish(job_id, SUCCEEDED, result=result)
+
+    def fail(self, job_id: str, error) -> None:
+        self._finish(job_id, FAILED, error=error)
+
+    def mark_unknown(self, job_id: str, error) -> None:
+        self._finish(job_id, UNKNOWN, error=error)
+
+    def retry(self, job_id: str, error, delay: float) -> None:
+        """
+        Put the job back in the queue, due in ``delay`` seconds.
+        """
+        self._finish(job_id, QUEUED, error=error, available_at=time.time() + delay)
+
+    def get(self, job_id: str) -> dict | None:
+        row = self.conn.execute(
+            'SELECT id, kind, site, status, attempts, result, error, created_at, updated_at, tenant '
+            'FROM jobs WHERE id = ?',
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'kind': row[1],
+            'site': row[2],
+            'status': row[3],
+            'attempts': row[4],
+            'result': json_codec.loads(row[5]) if row[5] is not None else None,
+            'error': json_codec.loads(row[6]) if row[6] is not None else None,
+            'createdAt': row[7],
+            'updatedAt': row[8],
+            'tenant': row[9],
+        }
+
+    def prune(self, older_than: float) -> int:
+        """
+        Delete finished jobs last updated more than ``older_than`` seconds ago.
+        """
+        cursor = self.conn.execute(
+            'DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?',
+            (SUCCEEDED, FAILED, UNKNOWN, time.time() - older_than),
+        )
+        return cursor.rowcount
+
+    def counts(self) -> dict[str, int]:
+        rows = self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0, UNKNOWN: 0, **dict(rows)}
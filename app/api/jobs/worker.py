@@ -0,0 +1,332 @@
+"""
+Background submission of queued orders and payments to RetailCRM
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+
+import httpx
+
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM, UNSENT_ERRORS, UNSENT_STATUSES, UPLOAD_LIMIT
+from api.base_api.exceptions import UpstreamUnavailableError
+from api.base_api.resilience import RetryPolicy
+from api.jobs.queue import FAILED, ORDER, PAYMENT, QUEUED, SUCCEEDED, UNKNOWN, JobQueue
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner:
+    """
+    Accepts writes into the JobQueue and drains it with ``workers``
+    concurrent loops. Queued orders of one tenant and site go to RetailCRM
+    as a single /orders/upload call; a lone order and every payment use the regular
+    create endpoints. RetailCRM validation errors fail the job right away.
+
+    Writes are not idempotent, so only failures known to leave RetailCRM
+    untouched (no connection, local limits, a rate-limit answer) are
+    retried with backoff until ``max_attempts``. After a timeout or a 5xx
+    the write may have been saved: an order is looked up by its
+    ``externalId`` and only resent when it is not there; a payment, or an
+    order that cannot be looked up, is marked ``unknown`` instead. A job
+    whose lease expired is treated the same way, since its worker may have
+    died after sending it.
+
+    Queue writes run in worker threads, so a queue file locked by another
+    process does not stall the event loop.
+    """
+
+    def __init__(self,
+                 client: ApiClientRetailCRM,
+                 queue: JobQueue,
+                 workers: int = 2,
+                 batch_size: int = UPLOAD_LIMIT,
+                 poll_interval: float = 0.5,
+                 max_attempts: int = 5,
+                 retry_policy: RetryPolicy | None = None,
+                 lease_timeout: float = 60.0,
+                 retention: float = 7 * 86400.0,
+                 tenant_clients: dict[str, ApiClientRetailCRM] | None = None):
+        # client of the default tenant, whose jobs have no tenant
+        self.client = client
+        self.tenant_clients = tenant_clients or {}
+        self.queue = queue
+        self.workers = workers
+        self.batch_size = min(batch_size, UPLOAD_LIMIT)
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_policy = retry_policy or RetryPolicy(base_delay=1.0, max_delay=60.0)
+        self.lease_timeout = lease_timeout
+        self.retention = retention
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = asyncio.Event()
+        self._pruned_at = 0.0
+
+        self.submitted_total = 0
+        self.succeeded_total = 0
+        self.retried_total = 0
+        self.failed_total = 0
+        self.unknown_total = 0
+        self.reconciled_total = 0
+        self.batches_total = 0
+
+    @classmethod
+    def from_settings(cls, client: ApiClientRetailCRM, settings,
+                      tenant_clients: dict[str, ApiClientRetailCRM] | None = None):
+        """
+        :param client: ApiClientRetailCRM of the default tenant
+        :param settings: config.Settings
+        :param tenant_clients: clients of the other tenants by name
+        :return: JobRunner or None when the queue is disabled
+        """
+        if not settings.jobs_enabled:
+            return None
+        return cls(
+            client,
+            JobQueue(settings.jobs_path),
+            workers=settings.jobs_workers,
+            batch_size=settings.jobs_batch_size,
+            poll_interval=settings.jobs_poll_interval,
+            max_attempts=settings.jobs_max_attempts,
+            retry_policy=RetryPolicy(
+                base_delay=settings.jobs_retry_base_delay,
+                max_delay=settings.jobs_retry_max_delay,
+            ),
+            lease_timeout=settings.jobs_lease_timeout,
+            tenant_clients=tenant_clients,
+        )
+
+    async def submit(self, kind: str, payload: dict, site: str | None = None, tenant: str | None = None) -> str:
+        """
+        Durably enqueue a write and wake a worker.
+
+        :param tenant: tenant name, None for the default tenant
+        :return: job id
+        """
+        job_id = await asyncio.to_thread(self.queue.enqueue, kind, payload, site, tenant)
+        self.submitted_total += 1
+        self._wakeup.set()
+        return job_id
+
+    def start(self) -> list[asyncio.Task]:
+        return [asyncio.create_task(self.run()) for _ in range(self.workers)]
+
+    async def run(self) -> None:
+        """
+        Worker loop for the application lifespan; errors are logged and retried.
+        """
+        while True:
+            self._wakeup.clear()
+            try:
+                processed = await self.process_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job processing failed: {e}")
+                processed = 0
+            if processed:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def process_once(self) -> int:
+        """
+        :return: number of jobs handled
+        """
+        if time.monotonic() - self._pruned_at > 3600:
+            self._pruned_at = time.monotonic()
+            await asyncio.to_thread(self.queue.prune, self.retention)
+
+        orders = await asyncio.to_thread(self.queue.claim, ORDER, self.owner, self.batch_size, self.lease_timeout)
+        client = await self._client_for(orders)
+        if client is not None:
+            expired = [job for job in orders if job['lease_expired']]
+            if expired:
+                await self._reconcile_orders(client, expired, "Lease expired, the order may have been sent")
+            fresh = [job for job in orders if not job['lease_expired']]
+            if fresh:
+                await self._submit_orders(client, fresh)
+        payments = await asyncio.to_thread(self.queue.claim, PAYMENT, self.owner, self.batch_size, self.lease_timeout)
+        client = await self._client_for(payments)
+        if client is not None:
+            await self._record([
+                self._unknown(job, "Lease expired, the payment may have been sent")
+                for job in payments if job['lease_expired']
+            ])
+            await asyncio.gather(*(
+                self._submit_one(
+                    job,
+                    lambda job=job: client.order_payment_create(payment=job['payload'], site=job['site']),
+                    self._unknown_all,
+                )
+                for job in payments if not job['lease_expired']
+            ))
+        return len(orders) + len(payments)
+
+    async def _client_for(self, jobs: list[dict]) -> ApiClientRetailCRM | None:
+        """
+        :return: client of the tenant the claimed jobs belong to, None when
+            there are no jobs or the tenant is no longer configured
+        """
+        if not jobs:
+            return None
+        tenant = jobs[0]['tenant']
+        if tenant is None:
+            return self.client
+        client = self.tenant_clients.get(tenant)
+        if client is None:
+            await self._record([(FAILED, job, f"Unknown tenant {tenant!r}", None) for job in jobs])
+        return client
+
+    async def _submit_orders(self, client: ApiClientRetailCRM, jobs: list[dict]) -> None:
+        site = jobs[0]['site']
+
+        async def reconcile(ambiguous: list[dict], error) -> None:
+            await self._reconcile_orders(client, ambiguous, error)
+
+        if len(jobs) == 1:
+            job = jobs[0]
+            await self._submit_one(job, lambda: client.order_create(order=job['payload'], site=site), reconcile)
+            return
+
+        self.batches_total += 1
+        results = await client.upload_orders(
+            [job['payload'] for job in jobs], site=site, chunk_size=len(jobs), concurrency=1
+        )
+        outcomes, ambiguous, ambiguous_error = [], [], None
+        for job, result in zip(jobs, results):
+            if result['success']:
+                saved = {key: value for key, value in result.items() if key != 'success'}
+                outcomes.append((SUCCEEDED, job, saved, None))
+            elif result.get('unsent'):
+                outcomes.append(self._retry_or_fail(job, result['error']))
+            elif result.get('retryable'):
+                ambiguous.append(job)
+                ambiguous_error = result['error']
+            else:
+                outcomes.append((FAILED, job, result.get('errors') or result['error'], None))
+        await self._record(outcomes)
+        if ambiguous:
+            await reconcile(ambiguous, ambiguous_error)
+
+    async def _submit_one(self, job: dict, call, on_ambiguous) -> None:
+        """
+        :param on_ambiguous: coroutine function called with ([job], error) when
+            the write may have been saved despite the failure
+        """
+        try:
+            resp = await call()
+        except UNSENT_ERRORS as e:
+            await self._record([self._retry_or_fail(job, str(e), getattr(e, 'retry_after', None))])
+            return
+        except httpx.HTTPError as e:
+            await on_ambiguous([job], str(e))
+            return
+
+        if resp.is_successful():
+            await self._record([(SUCCEEDED, job, resp.get_response(), None)])
+        elif resp.get_status_code() in UNSENT_STATUSES:
+            await self._record([self._retry_or_fail(job, resp.get_response(), resp.retry_after)])
+        elif resp.get_status_code() >= 500:
+            await on_ambiguous([job], resp.get_response())
+        else:
+            await self._record([(FAILED, job, resp.get_response(), None)])
+
+    async def _reconcile_orders(self, client: ApiClientRetailCRM, jobs: list[dict], error) -> None:
+        """
+        Look up orders whose submission failed ambiguously by ``externalId``:
+        a saved order completes its job, a missing one is resent later.
+        """
+        by_external_id = {job['payload']['externalId']: job for job in jobs if job['payload'].get('externalId')}
+        if len(by_external_id) < len(jobs):
+            await self._unknown_all([job for job in jobs if job not in by_external_id.values()], error)
+        if not by_external_id:
+            return
+
+        filters = {'externalIds': list(by_external_id)}
+        if jobs[0]['site'] is not None:
+            filters['sites'] = [jobs[0]['site']]
+        try:
+            resp = await client.get_orders(filters=filters, limit=100, use_cache=False)
+        except (UpstreamUnavailableError, httpx.HTTPError) as e:
+            logger.warning("Looking up orders %s failed: %s", list(by_external_id), e)
+            resp = None
+        if resp is None or not resp.is_successful():
+            await self._unknown_all(list(by_external_id.values()), error)
+            return
+
+        saved = {order.get('externalId'): order for order in resp.get_value('orders') or []}
+        outcomes = []
+        for external_id, job in by_external_id.items():
+            order = saved.get(external_id)
+            if order is not None:
+                self.reconciled_total += 1
+                outcomes.append((SUCCEEDED, job, {'id': order.get('id'), 'order': order}, None))
+            else:
+                outcomes.append(self._retry_or_fail(job, error))
+        await self._record(outcomes)
+
+    async def _unknown_all(self, jobs: list[dict], error) -> None:
+        await self._record([self._unknown(job, error) for job in jobs])
+
+    @staticmethod
+    def _unknown(job: dict, error) -> tuple:
+        return UNKNOWN, job, error, None
+
+    def _retry_or_fail(self, job: dict, error, retry_after: float | None = None) -> tuple:
+        if job['attempts'] >= self.max_attempts:
+            return FAILED, job, error, None
+        delay = retry_after if retry_after is not None else self.retry_policy.delay(job['attempts'] - 1)
+        return QUEUED, job, error, delay
+
+    def _write(self, outcomes: list[tuple]) -> None:
+        with self.queue.transaction():
+            for status, job, value, delay in outcomes:
+                if status == SUCCEEDED:
+                    self.queue.succeed(job['id'], value)
+                elif status == FAILED:
+                    self.queue.fail(job['id'], value)
+                elif status == UNKNOWN:
+                    self.queue.mark_unknown(job['id'], value)
+                else:
+                    self.queue.retry(job['id'], value, delay)
+
+    async def _record(self, outcomes: list[tuple]) -> None:
+        """
+        Store job outcomes in one transaction.
+
+        :param outcomes: (status, job, result or error, retry delay) tuples
+        """
+        if not outcomes:
+            return
+        await asyncio.to_thread(self._write, outcomes)
+        for status, job, value, _ in outcomes:
+            if status == SUCCEEDED:
+                self.succeeded_total += 1
+            elif status == FAILED:
+                self.failed_total += 1
+                logger.warning("Job %s (%s) failed: %s", job['id'], job['kind'], value)
+            elif status == UNKNOWN:
+                self.unknown_total += 1
+                logger.warning("Job %s (%s) has an unknown outcome: %s", job['id'], job['kind'], value)
+            else:
+                self.retried_total += 1
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'jobs': self.queue.counts(),
+            'submitted_total': self.submitted_total,
+            'succeeded_total': self.succeeded_total,
+            'retried_total': self.retried_total,
+            'failed_total': self.failed_total,
+            'unknown_total': self.unknown_total,
+            'reconciled_total': self.reconciled_total,
+            'batches_total': self.batches_total,
+        }
+
+    def close(self) -> None:
+        self.queue.close()
@@ -0,0 +1,324 @@
+"""
+Local SQLite replica of RetailCRM customers and orders
+"""
+import json
+import math
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from api.base_api import json_codec
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    id          INTEGER PRIMARY KEY,
+    external_id TEXT,
+    site        TEXT,
+    first_name  TEXT,
+    last_name   TEXT,
+    email       TEXT,
+    email_norm  TEXT,
+    created_at  TEXT,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS customers_created_at ON customers (created_at);
+
+CREATE TABLE IF NOT EXISTS customer_phones (
+    customer_id INTEGER NOT NULL,
+    phone       TEXT NOT NULL,
+    PRIMARY KEY (phone, customer_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS customer_phones_customer ON customer_phones (customer_id);
+
+CREATE TABLE IF NOT EXISTS orders (
+    id          INTEGER PRIMARY KEY,
+    customer_id INTEGER,
+    site        TEXT,
+    created_at  TEXT,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_customer ON orders (customer_id, id);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# on columns added after the first release of the schema, see ReplicaStore._migrate()
+_CUSTOMER_INDEXES = """
+CREATE INDEX IF NOT EXISTS customers_email ON customers (email_norm);
+CREATE INDEX IF NOT EXISTS customers_external_id ON customers (external_id, site);
+"""
+
+CUSTOMERS = 'customers'
+ORDERS = 'orders'
+
+_EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+def normalize_email(email: str | None) -> str | None:
+    if not email:
+        return None
+    return email.strip().lower()
+
+
+def is_full_email(value: str) -> bool:
+    return bool(_EMAIL.match(value.strip()))
+
+
+def normalize_phone(number: str | None, country_code: str = '7') -> str | None:
+    """
+    Best-effort E.164: ``8 (912) 345-67-89`` -> ``+79123456789``.
+    National numbers get ``country_code``; a leading 8 is the Russian trunk prefix.
+    """
+    if not number:
+        return None
+    digits = re.sub(r'\D', '', number)
+    if not digits:
+        return None
+    if number.strip().startswith('+') or digits.startswith('00'):
+        return '+' + digits.removeprefix('00')
+    if country_code == '7' and len(digits) == 11 and digits[0] in '78':
+        return '+7' + digits[1:]
+    if len(digits) <= 10:
+        return '+' + country_code + digits
+    return '+' + digits
+
+
+def _page(total: int, limit: int, page: int) -> dict:
+    return {
+        'limit': limit,
+        'totalCount': total,
+        'currentPage': page,
+        'totalPageCount': max(1, math.ceil(total / limit)),
+    }
+
+
+class ReplicaStore:
+    """
+    Customers and orders as last seen in the history feed, plus the feed
+    cursors. Several workers may open the same file; writes are serialized
+    by SQLite and the sync itself by a lease (see try_acquire_lease()).
+    """
+
+    def __init__(self, path: str, phone_country_code: str = '7'):
+        self.path = path
+        self.phone_country_code = phone_country_code
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(customers)')}
+        if 'email_norm' not in columns:
+            with self.transaction():
+                self.conn.execute('ALTER TABLE customers ADD COLUMN email_norm TEXT')
+                rows = self.conn.execute('SELECT data FROM customers').fetchall()
+                self.upsert_customers([json_codec.loads(row[0]) for row in rows])
+        self.conn.executescript(_CUSTOMER_INDEXES)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    # meta
+
+    def get_meta(self, key: str) -> str | None:
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value) -> None:
+        self.conn.execute(
+            'INSERT INTO meta (key, value) VALUES (?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+            (key, str(value)),
+        )
+
+    def since_id(self, entity: str) -> int | None:
+        value = self.get_meta(f'{entity}_since_id')
+        return int(value) if value is not None else None
+
+    def is_fresh(self, entity: str, max_age: float) -> bool:
+        """
+        :return: True when ``entity`` was synced less than ``max_age`` seconds ago
+        """
+        synced_at = self.get_meta(f'{entity}_synced_at')
+        return synced_at is not None and time.time() - float(synced_at) <= max_age
+
+    def try_acquire_lease(self, owner: str, ttl: float) -> bool:
+        """
+        Only the worker holding the lease follows the history feed.
+        """
+        with self.transaction():
+            return self.renew_lease(owner, ttl)
+
+    def renew_lease(self, owner: str, ttl: float) -> bool:
+        """
+        try_acquire_lease() inside the caller's transaction, so data is
+        only written while the lease is held.
+
+        :return: False when another worker holds the lease
+        """
+        current = self.get_meta('sync_lease')
+        if current is not None:
+            lease = json.loads(current)
+            if lease['owner'] != owner and lease['expires'] > time.time():
+                return False
+        self.set_meta('sync_lease', json.dumps({'owner': owner, 'expires': time.time() + ttl}))
+        return True
+
+    # writes
+
+    def upsert_customers(self, customers: list[dict]) -> None:
+        """
+        Also maintains the email, phone and externalId indexes.
+        """
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO customers '
+            '(id, external_id, site, first_name, last_name, email, email_norm, created_at, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [
+                (
+                    c['id'], c.get('externalId'), c.get('site'), c.get('firstName'),
+                    c.get('lastName'), c.get('email'), normalize_email(c.get('email')), c.get('createdAt'),
+                    json_codec.dumps_str(c),
+                )
+                for c in customers
+            ],
+        )
+        self.conn.executemany(
+            'DELETE FROM customer_phones WHERE customer_id = ?',
+            [(c['id'],) for c in customers],
+        )
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO customer_phones (customer_id, phone) VALUES (?, ?)',
+            [
+                (c['id'], phone)
+                for c in customers
+                for phone in {
+                    normalize_phone(entry.get('number'), self.phone_country_code)
+                    for entry in c.get('phones') or []
+                } - {None}
+            ],
+        )
+
+    def upsert_orders(self, orders: list[dict]) -> None:
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO orders (id, customer_id, site, created_at, data) VALUES (?, ?, ?, ?, ?)',
+            [
+                (
+                    o['id'], (o.get('customer') or {}).get('id'), o.get('site'), o.get('createdAt'),
+                    json_codec.dumps_str(o),
+                )
+                for o in orders
+            ],
+        )
+
+    def delete(self, entity: str, ids: list[int]) -> None:
+        table = {CUSTOMERS: 'customers', ORDERS: 'orders'}[entity]
+        self.conn.executemany(f'DELETE FROM {table} WHERE id = ?', [(i,) for i in ids])
+        if entity == CUSTOMERS:
+            self.conn.executemany('DELETE FROM customer_phones WHERE customer_id = ?', [(i,) for i in ids])
+
+    # reads, shaped like the RetailCRM responses
+
+    def get_customer(self, customer_id: str | int, site: str | None, id_type: str = 'externalId') -> dict | None:
+        if id_type == 'id':
+            row = self.conn.execute('SELECT data FROM customers WHERE id = ?', (customer_id,)).fetchone()
+        elif site is not None:
+            row = self.conn.execute(
+                'SELECT data FROM customers WHERE external_id = ? AND site = ?',
+                (str(customer_id), site),
+            ).fetchone()
+        else:
+            row = self.conn.execute(
+                'SELECT data FROM customers WHERE external_id = ?', (str(customer_id),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'success': True, 'customer': json_codec.loads(row[0])}
+
+    def _customer_filter(self, filters: dict) -> tuple[list[str], list]:
+        where, args = [], []
+        if filters.get('name'):
+            where.append("(COALESCE(first_name, '') || ' ' || COALESCE(last_name, '')) LIKE ?")
+            args.append(f"%{filters['name']}%")
+        if filters.get('email') and is_full_email(filters['email']):
+            where.append('email_norm = ?')
+            args.append(normalize_email(filters['email']))
+        elif filters.get('email'):
+            where.append('email LIKE ?')
+            args.append(f"%{filters['email']}%")
+        if filters.get('phone'):
+            where.append('id IN (SELECT customer_id FROM customer_phones WHERE phone = ?)')
+            args.append(normalize_phone(filters['phone'], self.phone_country_code))
+        if filters.get('dateFrom'):
+            where.append('created_at >= ?')
+            args.append(filters['dateFrom'])
+        if filters.get('dateTo'):
+            where.append("created_at < date(?, '+1 day')")
+            args.append(filters['dateTo'])
+        return where, args
+
+    def count_customers(self, filters: dict) -> int:
+        where, args = self._customer_filter(filters)
+        clause = f"WHERE {' AND '.join(where)}" if where else ''
+        return self.conn.execute(f'SELECT COUNT(*) FROM customers {clause}', args).fetchone()[0]
+
+    def list_customers(self, filters: dict, limit: int, page: int) -> dict:
+        where, args = self._customer_filter(filters)
+        clause = f"WHERE {' AND '.join(where)}" if where else ''
+
+        total = self.count_customers(filters)
+        rows = self.conn.execute(
+            f'SELECT data FROM customers {clause} ORDER BY id DESC LIMIT ? OFFSET ?',
+            [*args, limit, (page - 1) * limit],
+        ).fetchall()
+        return {
+            'success': True,
+            'pagination': _page(total, limit, page),
+            'customers': [json_codec.loads(row[0]) for row in rows],
+        }
+
+    def customers_before(self, filters: dict, before_id: int | None, limit: int) -> list[dict]:
+        """
+        Keyset read for cursors: the next ``limit`` customers, newest first,
+        with an id below ``before_id``. Costs the same on any page.
+        """
+        where, args = self._customer_filter(filters)
+        if before_id is not None:
+            where.append('id < ?')
+            args.append(before_id)
+        clause = f"WHERE {' AND '.join(where)}" if where else ''
+        rows = self.conn.execute(
+            f'SELECT data FROM customers {clause} ORDER BY id DESC LIMIT ?',
+            [*args, limit],
+        ).fetchall()
+        return [json_codec.loads(row[0]) for row in rows]
+
+    def orders_by_customer(self, customer_id: int, site: str | None, limit: int, page: int) -> dict:
+        args = (customer_id, site, site)
+        clause = 'WHERE customer_id = ? AND (? IS NULL OR site = ?)'
+        total = self.conn.execute(f'SELECT COUNT(*) FROM orders {clause}', args).fetchone()[0]
+        rows = self.conn.execute(
+            f'SELECT data FROM orders {clause} ORDER BY id DESC LIMIT ? OFFSET ?',
+            [*args, limit, (page - 1) * limit],
+        ).fetchall()
+        return {
+            'success': True,
+            'pagination': _page(total, limit, page),
+            'orders': [json_codec.loads(row[0]) for row in rows],
+        }
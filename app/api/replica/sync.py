@@ -0,0 +1,131 @@
+"""
+Follows the RetailCRM history feeds into the local replica
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+from api.replica.store import CUSTOMERS, ORDERS, ReplicaStore
+
+logger = logging.getLogger(__name__)
+
+# RetailCRM serves at most 100 history records or entities per call
+PAGE_LIMIT = 100
+
+
+class LeaseLost(RuntimeError):
+    """
+    Another worker took over the sync lease.
+    """
+
+
+class HistorySync:
+    """
+    Reads /customers/history and /orders/history from the persisted
+    ``sinceId`` cursor, refetches the changed entities in pages of 100
+    and applies them to the replica together with the new cursor.
+
+    The sync lease is renewed in the transaction of every page, so a long
+    replay keeps it, and a worker whose lease was taken over stops before
+    writing anything.
+    """
+
+    def __init__(self, client: ApiClientRetailCRM, store: ReplicaStore, interval: float = 10.0):
+        self.client = client
+        self.store = store
+        self.interval = interval
+        self.lease_ttl = interval * 3
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def sync_once(self) -> dict:
+        """
+        :return: number of changed entities per feed
+        """
+        return {
+            CUSTOMERS: await self._sync_entity(CUSTOMERS, 'customer'),
+            ORDERS: await self._sync_entity(ORDERS, 'order'),
+        }
+
+    async def _sync_entity(self, entity: str, record_key: str) -> int:
+        """
+        Applies the feed page by page, so the cursor advances together
+        with the data and memory stays bounded on the first full replay.
+
+        :raise LeaseLost: another worker holds the lease, nothing of the page was written
+        """
+        since_id = self.store.since_id(entity)
+        applied = 0
+
+        while True:
+            resp = await self.client.get_history(entity, since_id=since_id, limit=PAGE_LIMIT)
+            if not resp.is_successful():
+                raise RuntimeError(f"{entity} history failed: {resp.get_response()}")
+            history = resp.get_response().get('history') or []
+
+            changed: dict[int, None] = {}
+            deleted: set[int] = set()
+            for record in history:
+                entity_id = (record.get(record_key) or {}).get('id')
+                if entity_id is None:
+                    continue
+                if record.get('deleted'):
+                    deleted.add(entity_id)
+                    changed.pop(entity_id, None)
+                else:
+                    changed[entity_id] = None
+                    deleted.discard(entity_id)
+
+            entities = await self._fetch(entity, list(changed))
+            with self.store.transaction():
+                if not self.store.renew_lease(self.owner, self.lease_ttl):
+                    raise LeaseLost(f"Sync lease of {self.owner} was taken over")
+                if entity == CUSTOMERS:
+                    self.store.upsert_customers(entities)
+                else:
+                    self.store.upsert_orders(entities)
+                self.store.delete(entity, list(deleted))
+                if history:
+                    since_id = history[-1]['id']
+                    self.store.set_meta(f'{entity}_since_id', since_id)
+                if len(history) < PAGE_LIMIT:
+                    self.store.set_meta(f'{entity}_synced_at', time.time())
+            applied += len(changed) + len(deleted)
+
+            if len(history) < PAGE_LIMIT:
+                return applied
+
+    async def _fetch(self, entity: str, ids: list[int]) -> list[dict]:
+        chunks = [ids[i:i + PAGE_LIMIT] for i in range(0, len(ids), PAGE_LIMIT)]
+
+        async def fetch_chunk(chunk):
+            filters = {'ids': chunk}
+            if entity == CUSTOMERS:
+                resp = await self.client.get_customers(limit=PAGE_LIMIT, filters=filters, use_cache=False)
+            else:
+                resp = await self.client.get_orders(filters=filters, limit=PAGE_LIMIT, use_cache=False)
+            if not resp.is_successful():
+                raise RuntimeError(f"Fetching changed {entity} failed: {resp.get_response()}")
+            return resp.get_response().get(entity) or []
+
+        results = await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks))
+        return [item for items in results for item in items]
+
+    async def run(self) -> None:
+        """
+        Sync loop for the application lifespan; errors are logged and retried.
+        """
+        while True:
+            try:
+                if self.store.try_acquire_lease(self.owner, ttl=self.lease_ttl):
+                    changes = await self.sync_once()
+                    logger.debug("Replica synced: %s", changes)
+            except asyncio.CancelledError:
+                raise
+            except LeaseLost as e:
+                logger.warning(f"Replica sync stopped: {e}")
+            except Exception as e:
+                logger.error(f"Replica sync failed: {e}")
+            await asyncio.sleep(self.interval)
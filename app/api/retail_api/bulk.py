@@ -0,0 +1,181 @@
+"""
+Streaming helpers for bulk imports
+"""
+import asyncio
+import csv
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from api.base_api import json_codec
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+# a row is (row number, parsed row or None, error or None)
+Row = tuple[int, dict | None, Any]
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose body is produced while the request body is still
+    being read. The stock response listens for client disconnects on
+    ``receive``, which would swallow the request body chunks; here a
+    disconnect surfaces as a failed ``send`` instead.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+
+        if self.background is not None:
+            await self.background()
+
+
+# yielded by iter_lines() in place of a line longer than its limit
+LINE_TOO_LONG = None
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_length: int = 1024 * 1024) -> AsyncIterator[bytes | None]:
+    """
+    Split a byte stream into lines without reading it whole. Lines are
+    left undecoded, so one bad line fails its own row only. A line longer
+    than ``max_length`` bytes is not buffered: LINE_TOO_LONG is yielded
+    once for it and the rest of it is skipped.
+    """
+    buffer = bytearray()
+    skipping = False
+    async for chunk in chunks:
+        start = 0
+        while (end := chunk.find(b'\n', start)) >= 0:
+            if not skipping:
+                buffer += chunk[start:end]
+                yield bytes(buffer).rstrip(b'\r') if len(buffer) <= max_length else LINE_TOO_LONG
+            buffer.clear()
+            skipping = False
+            start = end + 1
+        if not skipping:
+            buffer += chunk[start:]
+            if len(buffer) > max_length:
+                yield LINE_TOO_LONG
+                buffer.clear()
+                skipping = True
+    if buffer:
+        yield bytes(buffer).rstrip(b'\r')
+
+
+def _decode_line(line: bytes | None) -> tuple[str | None, str | None]:
+    """
+    :return: (text, None), or (None, error) when the line is too long or not UTF-8
+    """
+    if line is LINE_TOO_LONG:
+        return None, "Line too long"
+    try:
+        return line.decode('utf-8'), None
+    except UnicodeDecodeError as e:
+        return None, f"Invalid UTF-8: {e}"
+
+
+async def iter_ndjson_rows(lines: AsyncIterator[bytes | None]) -> AsyncIterator[Row]:
+    row = 0
+    async for raw in lines:
+        if raw is not LINE_TOO_LONG and not raw.strip():
+            continue
+        row += 1
+        line, error = _decode_line(raw)
+        if error is not None:
+            yield row, None, error
+            continue
+        try:
+            value = json_codec.loads(line)
+        except ValueError as e:
+            yield row, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(value, dict):
+            yield row, None, "Row must be a JSON object"
+            continue
+        yield row, value, None
+
+
+async def iter_csv_rows(lines: AsyncIterator[bytes | None]) -> AsyncIterator[Row]:
+    """
+    The first line is the header. Quoted values may not span lines.
+    Empty cells are left out of the row.
+    """
+    header = None
+    row = 0
+    async for raw in lines:
+        if raw is not LINE_TOO_LONG and not raw.strip():
+            continue
+        line, error = _decode_line(raw)
+        if error is not None and header is None:
+            # without a header no row can be read
+            yield row, None, f"Header: {error}"
+            return
+        if error is not None:
+            row += 1
+            yield row, None, error
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        row += 1
+        if len(values) > len(header):
+            yield row, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield row, {name: value for name, value in zip(header, values) if value != ''}, None
+
+
+async def stream_batches(rows: AsyncIterator[tuple[int, str | None, dict | None, Any]],
+                         upload: Callable[[str, list[dict]], Awaitable[list[dict]]],
+                         batch_size: int,
+                         concurrency: int) -> AsyncIterator[dict]:
+    """
+    Group ``(row, group, payload, error)`` items into batches per group, run
+    ``upload(group, payloads)`` for at most ``concurrency`` batches at a time
+    and yield ``{'row': row, **result}`` as batches finish. Rows with an
+    error are reported right away. Input is only read while a batch slot
+    is free, so memory stays bounded.
+    """
+    batches: dict[str, list[tuple[int, dict]]] = {}
+    pending: set[asyncio.Task] = set()
+
+    async def run(group: str, batch: list[tuple[int, dict]]) -> list[dict]:
+        results = await upload(group, [payload for _, payload in batch])
+        return [{'row': row, **result} for (row, _), result in zip(batch, results)]
+
+    async def drain(wait_for_one: bool):
+        nonlocal pending
+        if wait_for_one:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        else:
+            done = {task for task in pending if task.done()}
+            pending -= done
+        for task in done:
+            for result in task.result():
+                yield result
+
+    try:
+        async for row, group, payload, error in rows:
+            if error is not None:
+                yield {'row': row, 'success': False, 'error': error}
+                continue
+            batch = batches.setdefault(group, [])
+            batch.append((row, payload))
+            if len(batch) >= batch_size:
+                while len(pending) >= concurrency:
+                    async for result in drain(wait_for_one=True):
+                        yield result
+                pending.add(asyncio.create_task(run(group, batches.pop(group))))
+            async for result in drain(wait_for_one=False):
+                yield result
+
+        for group, batch in batches.items():
+            pending.add(asyncio.create_task(run(group, batch)))
+        while pending:
+            async for result in drain(wait_for_one=True):
+                yield result
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,342 @@
+"""
+Local index of store offers and reference dictionaries for checking
+order and payment payloads before they are sent to RetailCRM
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Any
+
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+from api.retail_api.pagination import UPSTREAM_PAGE_SIZE, fetch_window
+
+logger = logging.getLogger(__name__)
+
+# /reference/{dictionary} and the response key holding its entries by code
+DICTIONARIES = {
+    'sites': 'sites',
+    'payment-types': 'paymentTypes',
+    'payment-statuses': 'paymentStatuses',
+    'statuses': 'statuses',
+    'order-types': 'orderTypes',
+}
+
+# keys an order item may reference its offer by, and the /store/offers filter for each
+_OFFER_KEYS = ('id', 'externalId', 'xmlId')
+_OFFER_FILTERS = {'id': 'ids', 'externalId': 'externalId', 'xmlId': 'xmlId'}
+
+# refreshes are spread by up to this share of the interval, so workers and tenants drift apart
+_REFRESH_JITTER = 0.2
+
+# values confirmed missing are remembered, at most this many
+_MISSING_MAX_ENTRIES = 10000
+
+
+def _error(loc: list, msg: str, value) -> dict:
+    # same shape as the pydantic errors of a 422 response
+    return {'loc': loc, 'msg': msg, 'input': value}
+
+
+class CatalogIndex:
+    """
+    One consistent snapshot of the catalog; a refresh builds a new one
+    and swaps it in, so readers never see a half-loaded catalog.
+    """
+
+    def __init__(self, offers: list[dict], references: dict[str, dict]):
+        self.offers = {key: {o[key] for o in offers if o.get(key) is not None} for key in _OFFER_KEYS}
+        self.references = references
+        self.offer_count = len(offers)
+        self.loaded_at = time.time()
+
+    def has_offer(self, key: str, value) -> bool:
+        return value in self.offers[key]
+
+    def add_offers(self, offers: list[dict]) -> None:
+        # offers created since the snapshot, found by a lookup
+        for key in _OFFER_KEYS:
+            self.offers[key].update(o[key] for o in offers if o.get(key) is not None)
+
+    def has_code(self, dictionary: str, code) -> bool:
+        return code in self.references.get(dictionary, {})
+
+
+class Catalog:
+    """
+    Offers from /store/offers and the reference dictionaries, loaded at
+    startup and refreshed every ``interval`` seconds, give or take 20%.
+    Checks are set lookups, O(1) per item. Until the first load succeeds
+    every payload passes, so a RetailCRM outage at startup does not block
+    writes; a failed refresh keeps the previous snapshot.
+
+    The snapshot may miss offers and codes created since the last refresh,
+    so values it does not know are looked up in RetailCRM before a payload
+    is rejected: offers by id, externalId or xmlId, codes by reloading
+    their dictionary. At most ``lookup_limit`` lookup calls are made per
+    payload and ``concurrency`` at once; values RetailCRM does not know
+    either are remembered for ``missing_ttl`` seconds, so a resent bad
+    payload is rejected without a call. Values over the limit, and values
+    whose lookup fails, are passed on for RetailCRM to decide.
+
+    A refresh costs one call per dictionary plus one per 100 offers, from
+    the ``list`` rate budget, in every worker and for every tenant.
+    """
+
+    def __init__(self,
+                 client: ApiClientRetailCRM,
+                 interval: float = 600.0,
+                 concurrency: int = 4,
+                 lookup_limit: int = 10,
+                 missing_ttl: float = 60.0):
+        self.client = client
+        self.interval = interval
+        self.concurrency = concurrency
+        self.lookup_limit = lookup_limit
+        self.missing_ttl = missing_ttl
+        self._index: CatalogIndex | None = None
+        self._lookup_slots = asyncio.Semaphore(concurrency)
+        # (offer key or dictionary, value) -> monotonic expiry
+        self._missing: dict[tuple[str, Any], float] = {}
+
+        self.refreshes_total = 0
+        self.refresh_failures_total = 0
+        self.rejected_total = 0
+        self.lookups_total = 0
+        self.lookups_skipped_total = 0
+        self.missing_hits_total = 0
+
+    @classmethod
+    def from_settings(cls, client: ApiClientRetailCRM, settings):
+        """
+        :param client: ApiClientRetailCRM
+        :param settings: config.Settings
+        :return: Catalog or None when disabled
+        """
+        if not settings.catalog_enabled:
+            return None
+        return cls(
+            client,
+            interval=settings.catalog_refresh_interval,
+            concurrency=settings.pagination_concurrency,
+            lookup_limit=settings.catalog_lookup_limit,
+            missing_ttl=settings.catalog_missing_ttl,
+        )
+
+    @property
+    def loaded(self) -> bool:
+        return self._index is not None
+
+    async def _reference(self, dictionary: str) -> dict:
+        resp = await self.client.get_reference(dictionary)
+        if not resp.is_successful():
+            raise RuntimeError(f"Reference {dictionary} failed: {resp.get_response()}")
+        return resp.get_value(DICTIONARIES[dictionary]) or {}
+
+    async def _offers(self) -> list[dict]:
+        async def fetch_page(page: int):
+            return await self.client.get_offers(limit=UPSTREAM_PAGE_SIZE, page=page)
+
+        first, total = await fetch_window(fetch_page, 'offers', 0, UPSTREAM_PAGE_SIZE)
+        if total is None or total <= len(first):
+            return first
+        rest, _ = await fetch_window(
+            fetch_page, 'offers', len(first), total - len(first), total=total, concurrency=self.concurrency,
+        )
+        return first + rest
+
+    async def refresh(self) -> CatalogIndex:
+        """
+        :raise RuntimeError, PageFetchError: a dictionary or an offer page could not be read
+        """
+        names = list(DICTIONARIES)
+        *dictionaries, offers = await asyncio.gather(*(self._reference(name) for name in names), self._offers())
+        self._index = CatalogIndex(offers, dict(zip(names, dictionaries)))
+        self.refreshes_total += 1
+        return self._index
+
+    async def run(self) -> None:
+        """
+        Refresh loop for the application lifespan; errors are logged and retried.
+        """
+        while True:
+            try:
+                index = await self.refresh()
+                logger.debug("Catalog refreshed: %d offers", index.offer_count)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.refresh_failures_total += 1
+                logger.error(f"Catalog refresh failed: {e}")
+            await asyncio.sleep(self.interval * random.uniform(1 - _REFRESH_JITTER, 1 + _REFRESH_JITTER))
+
+    def reference(self, dictionary: str) -> dict | None:
+        """
+        :return: entries of the dictionary by code, None before the first load
+        """
+        if self._index is None:
+            return None
+        return self._index.references.get(dictionary)
+
+    def _is_missing(self, key: str, value) -> bool:
+        expires = self._missing.get((key, value))
+        if expires is None:
+            return False
+        if expires <= time.monotonic():
+            del self._missing[(key, value)]
+            return False
+        self.missing_hits_total += 1
+        return True
+
+    def _remember_missing(self, key: str, values) -> None:
+        now = time.monotonic()
+        if len(self._missing) >= _MISSING_MAX_ENTRIES:
+            self._missing = {entry: expires for entry, expires in self._missing.items() if expires > now}
+            if len(self._missing) >= _MISSING_MAX_ENTRIES:
+                self._missing.clear()
+        for value in values:
+            self._missing[(key, value)] = now + self.missing_ttl
+
+    async def _lookup(self, call):
+        self.lookups_total += 1
+        async with self._lookup_slots:
+            return await call()
+
+    async def _find_offers(self, filters: dict) -> list[dict]:
+        resp = await self._lookup(lambda: self.client.get_offers(limit=UPSTREAM_PAGE_SIZE, filters=filters))
+        if not resp.is_successful():
+            raise RuntimeError(f"Offer lookup failed: {resp.get_response()}")
+        return resp.get_value('offers') or []
+
+    async def _unknown_offers(self, index: CatalogIndex, unknown: dict[str, set]) -> dict[str, set]:
+        """
+        Look up the offers missing from the snapshot.
+
+        :return: the offers RetailCRM does not know either, by key
+        """
+        missing = {key: {value for value in values if self._is_missing(key, value)} for key, values in unknown.items()}
+        # (key, filters, values asked for)
+        calls = []
+        for key in _OFFER_KEYS:
+            values = [value for value in unknown[key] if value not in missing[key]]
+            if key == 'id':
+                calls += [(key, {'ids': values[i:i + UPSTREAM_PAGE_SIZE]}, values[i:i + UPSTREAM_PAGE_SIZE])
+                          for i in range(0, len(values), UPSTREAM_PAGE_SIZE)]
+            else:
+                # externalId and xmlId filters take a single value
+                calls += [(key, {_OFFER_FILTERS[key]: value}, [value]) for value in values]
+        if len(calls) > self.lookup_limit:
+            self.lookups_skipped_total += len(calls) - self.lookup_limit
+            calls = calls[:self.lookup_limit]
+        if not calls:
+            return missing
+
+        try:
+            found = await asyncio.gather(*(self._find_offers(filters) for _, filters, _ in calls))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # not a definitive answer, let RetailCRM decide
+            logger.warning(f"Offer lookup failed, offers are not checked: {e}")
+            return missing
+        for offers in found:
+            index.add_offers(offers)
+        for key, _, values in calls:
+            gone = [value for value in values if not index.has_offer(key, value)]
+            self._remember_missing(key, gone)
+            missing[key].update(gone)
+        return missing
+
+    async def _has_code(self, index: CatalogIndex, dictionary: str, code) -> bool:
+        """
+        :return: False only when RetailCRM does not know the code either
+        """
+        if index.has_code(dictionary, code):
+            return True
+        if self._is_missing(dictionary, code):
+            return False
+        try:
+            entries = await self._lookup(lambda: self._reference(dictionary))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Reference lookup failed, {dictionary} is not checked: {e}")
+            return True
+        index.references[dictionary] = entries
+        if code in entries:
+            return True
+        self._remember_missing(dictionary, [code])
+        return False
+
+    async def _check_codes(self, index: CatalogIndex, checks: list[tuple[list, str, str, Any]], errors: list) -> None:
+        """
+        :param checks: (error loc, dictionary, error message, code), codes that are None are skipped
+        """
+        checks = [check for check in checks if check[3] is not None]
+        known = await asyncio.gather(*(self._has_code(index, dictionary, code) for _, dictionary, _, code in checks))
+        for (loc, _, msg, code), ok in zip(checks, known):
+            if not ok:
+                errors.append(_error(loc, msg, code))
+
+    async def validate_order(self, order: dict, site: str | None = None) -> list[dict]:
+        """
+        :param order: order payload as sent to /orders/create
+        :return: errors, empty when the order may be sent
+        """
+        index = self._index
+        if index is None:
+            return []
+        errors = []
+        await self._check_codes(index, [(['site'], 'sites', "Unknown site", site)], errors)
+        offers = [(i, key, value)
+                  for i, item in enumerate(order.get('items') or [])
+                  for key, value in (item.get('offer') or {}).items() if key in _OFFER_KEYS]
+        unknown = {key: set() for key in _OFFER_KEYS}
+        for _, key, value in offers:
+            if not index.has_offer(key, value):
+                unknown[key].add(value)
+        if any(unknown.values()):
+            unknown = await self._unknown_offers(index, unknown)
+        for i, key, value in offers:
+            if value in unknown[key]:
+                errors.append(_error(['items', i, 'offer', key], "Unknown offer", value))
+        await self._check_codes(index, [
+            (['status'], 'statuses', "Unknown order status", order.get('status')),
+            (['orderType'], 'order-types', "Unknown order type", order.get('orderType')),
+        ], errors)
+        if errors:
+            self.rejected_total += 1
+        return errors
+
+    async def validate_payment(self, payment: dict, site: str | None = None) -> list[dict]:
+        """
+        :param payment: payment payload as sent to /orders/payments/create
+        :return: errors, empty when the payment may be sent
+        """
+        index = self._index
+        if index is None:
+            return []
+        errors = []
+        await self._check_codes(index, [
+            (['site'], 'sites', "Unknown site", site),
+            (['payment', 'type'], 'payment-types', "Unknown payment type", payment.get('type')),
+            (['payment', 'status'], 'payment-statuses', "Unknown payment status", payment.get('status')),
+        ], errors)
+        if errors:
+            self.rejected_total += 1
+        return errors
+
+    def stats(self) -> dict:
+        index = self._index
+        return {
+            'loaded': index is not None,
+            'loaded_at': index.loaded_at if index is not None else None,
+            'offers': index.offer_count if index is not None else 0,
+            'references': {name: len(entries) for name, entries in index.references.items()} if index else {},
+            'refreshes_total': self.refreshes_total,
+            'refresh_failures_total': self.refresh_failures_total,
+            'rejected_total': self.rejected_total,
+            'lookups_total': self.lookups_total,
+            'lookups_skipped_total': self.lookups_skipped_total,
+            'missing_hits_total': self.missing_hits_total,
+        }
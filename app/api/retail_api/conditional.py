@@ -0,0 +1,178 @@
+"""
+ETags, If-None-Match and negotiated compression for large JSON responses
+
+brotli is used when installed; without it only gzip is offered.
+"""
+import asyncio
+import gzip
+import hashlib
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from api.base_api.cache import ResponseCache
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+BROTLI = 'br'
+GZIP = 'gzip'
+
+# bodies this large are compressed in a worker thread, not on the event loop
+_THREAD_MIN_SIZE = 256 * 1024
+
+
+def _compress(body: bytes, encoding: str, level: int) -> bytes:
+    if encoding == BROTLI:
+        return brotli.compress(body, quality=min(level, 11))
+    return gzip.compress(body, compresslevel=min(level, 9), mtime=0)
+
+
+def parse_accept_encoding(header: str) -> dict[str, float]:
+    """
+    :return: q-value per content coding, e.g. {'gzip': 1.0, 'br': 0.5}
+    """
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def matches(if_none_match: str, digest: str) -> bool:
+    """
+    Weak comparison as RFC 9110 prescribes for If-None-Match; the
+    ``-gzip``/``-br`` suffix of an encoded representation is ignored.
+    """
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag.strip('"').split('-', 1)[0] == digest:
+            return True
+    return False
+
+
+class ResponseEncoder:
+    """
+    Answers a GET with its body, or with ``304 Not Modified`` when the
+    client's If-None-Match already names it. The strong ETag is a digest
+    of the JSON body, suffixed with the content coding for compressed
+    representations. Bodies of at least ``min_size`` bytes are compressed
+    with the first of ``encodings`` the client accepts; with a response
+    cache the compressed bytes are stored under the ETag, so a hot
+    response is compressed once.
+    """
+
+    def __init__(self, encodings: tuple[str, ...] = (BROTLI, GZIP), min_size: int = 1024, level: int = 6):
+        # server preference order, codings that cannot be produced here are dropped
+        self.encodings = tuple(e for e in encodings if e == GZIP or (e == BROTLI and brotli is not None))
+        self.min_size = min_size
+        self.level = level
+
+        self.responses_total = 0
+        self.not_modified_total = 0
+        self.compressed_total = 0
+        self.encoded_cache_hits_total = 0
+        self.bytes_in_total = 0
+        self.bytes_out_total = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        :param settings: config.Settings
+        :return: ResponseEncoder
+        """
+        return cls(
+            encodings=tuple(settings.compression_encodings),
+            min_size=settings.compression_min_size,
+            level=settings.compression_level,
+        )
+
+    def negotiate(self, accept_encoding: str | None) -> str | None:
+        """
+        :return: content coding to use, None for the identity
+        """
+        if not accept_encoding or not self.encodings:
+            return None
+        accepted = parse_accept_encoding(accept_encoding)
+        best, best_q = None, 0.0
+        for encoding in self.encodings:
+            q = accepted.get(encoding, accepted.get('*', 0.0))
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    async def _encode(self, body: bytes, digest: str, encoding: str, cache: ResponseCache | None) -> bytes:
+        if cache is not None:
+            stored = await cache.get_encoded(digest, encoding)
+            if stored is not None:
+                self.encoded_cache_hits_total += 1
+                return stored
+        if len(body) >= _THREAD_MIN_SIZE:
+            encoded = await asyncio.to_thread(_compress, body, encoding, self.level)
+        else:
+            encoded = _compress(body, encoding, self.level)
+        self.compressed_total += 1
+        if cache is not None:
+            await cache.set_encoded(digest, encoding, encoded)
+        return encoded
+
+    async def respond(self,
+                      request: Request,
+                      body: bytes,
+                      cache: ResponseCache | None = None,
+                      headers: dict | None = None) -> Response:
+        """
+        :param body: JSON response body
+        :param cache: response cache of the tenant, None when caching is disabled
+        :param headers: further response headers, e.g. X-Cache
+        """
+        self.responses_total += 1
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        encoding = self.negotiate(request.headers.get('accept-encoding')) if len(body) >= self.min_size else None
+        headers = {
+            **(headers or {}),
+            'ETag': f'"{digest}-{encoding}"' if encoding else f'"{digest}"',
+            'Vary': 'Accept-Encoding',
+        }
+
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match and matches(if_none_match, digest):
+            self.not_modified_total += 1
+            return Response(status_code=304, headers=headers)
+
+        self.bytes_in_total += len(body)
+        if encoding is not None:
+            body = await self._encode(body, digest, encoding, cache)
+            headers['Content-Encoding'] = encoding
+        self.bytes_out_total += len(body)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        return {
+            'encodings': list(self.encodings),
+            'min_size': self.min_size,
+            'level': self.level,
+            'responses_total': self.responses_total,
+            'not_modified_total': self.not_modified_total,
+            'compressed_total': self.compressed_total,
+            'encoded_cache_hits_total': self.encoded_cache_hits_total,
+            # bytes_out / bytes_in of the bodies sent, 1.0 means nothing was saved
+            'compression_ratio': self.bytes_out_total / self.bytes_in_total if self.bytes_in_total else 1.0,
+        }
@@ -0,0 +1,75 @@
+"""
+Full exports that walk every page of a RetailCRM list endpoint
+"""
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable
+
+import httpx
+
+from api.base_api import json_codec
+from api.base_api.exceptions import UpstreamUnavailableError
+from api.base_api.response import Response
+from api.retail_api.pagination import encode_cursor
+
+# largest page RetailCRM serves for /customers and /orders
+EXPORT_PAGE_SIZE = 100
+
+
+class ExportError(Exception):
+    def __init__(self, page: int, response: Response):
+        super().__init__(f"Page {page} failed with status {response.get_status_code()}")
+        self.page = page
+        self.response = response
+
+
+async def iter_pages(fetch_page: Callable[[int], Awaitable[Response]],
+                     first: Response,
+                     start_page: int,
+                     prefetch: int) -> AsyncIterator[tuple[int, Response]]:
+    """
+    Yield ``(page, response)`` in page order starting with the already fetched
+    ``first`` page, keeping up to ``prefetch`` following pages in flight.
+    At most ``prefetch + 1`` pages are held in memory.
+    """
+    # the next page must always be in flight
+    prefetch = max(1, prefetch)
+    total_pages = (first.get_value('pagination') or {}).get('totalPageCount', start_page)
+    yield start_page, first
+
+    window: dict[int, asyncio.Task] = {}
+    next_page = start_page + 1
+    try:
+        for page in range(start_page + 1, total_pages + 1):
+            while next_page <= total_pages and len(window) < prefetch:
+                window[next_page] = asyncio.create_task(fetch_page(next_page))
+                next_page += 1
+            response = await window.pop(page)
+            if not response.is_successful():
+                raise ExportError(page, response)
+            yield page, response
+    finally:
+        for task in window.values():
+            task.cancel()
+
+
+async def stream_ndjson(pages: AsyncIterator[tuple[int, Response]], key: str, start_page: int) -> AsyncIterator[bytes]:
+    """
+    One NDJSON line per record. After each page a ``{"@cursor": ...}`` line
+    marks where an interrupted export can be resumed; a failing page ends
+    the stream with an ``{"@error": ..., "@cursor": ...}`` line. Records are
+    parsed one at a time, so a page is never fully built in memory.
+    """
+    resume_page = start_page
+    try:
+        async for page, response in pages:
+            for record in response.iter_items(key):
+                yield json_codec.dumps(record) + b'\n'
+            resume_page = page + 1
+            yield json_codec.dumps({'@cursor': encode_cursor({'page': resume_page})}) + b'\n'
+    except ExportError as e:
+        error = e.response.get_response()
+    except (UpstreamUnavailableError, httpx.HTTPError) as e:
+        error = str(e)
+    else:
+        return
+    yield json_codec.dumps({'@error': error, '@cursor': encode_cursor({'page': resume_page})}) + b'\n'
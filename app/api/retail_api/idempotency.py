@@ -0,0 +1,158 @@
+"""
+Idempotency keys for the create routes
+"""
+import hashlib
+import time
+from typing import Awaitable, Callable
+
+from api.base_api import json_codec
+from api.base_api.cache import CacheBackend, MemoryCacheBackend, RedisCacheBackend
+from api.base_api.response import Response
+from api.base_api.single_flight import SingleFlight
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+# 4xx answers that depend on timing rather than on the request: timeout, conflict, throttling
+_TRANSIENT_STATUSES = frozenset({408, 409, 429})
+
+
+def is_final(status_code: int) -> bool:
+    """
+    :return: True when the same request would get the same answer again
+    """
+    return status_code < 500 and status_code not in _TRANSIENT_STATUSES
+
+
+class IdempotencyKeyReused(Exception):
+    """
+    The key was already used for a request with a different body.
+    """
+
+    def __init__(self, key: str):
+        super().__init__(f"Idempotency key {key!r} was already used with a different request body")
+        self.key = key
+
+
+def fingerprint(payload) -> str:
+    """
+    :param payload: JSON-serializable request body
+    :return: hex digest identifying the body
+    """
+    return hashlib.sha256(json_codec.dumps(payload)).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Remembers the RetailCRM response of each keyed create call for ``ttl``
+    seconds, so a retried request is answered without calling RetailCRM
+    again. Concurrent requests with the same key share one upstream call.
+
+    Only final outcomes are stored: 2xx and deterministic 4xx answers.
+    After a 5xx, a 408, 409 or 429, or a network error the client may
+    retry with the same key and the call is made again. Keys the client
+    did not choose, such as an order externalId, are called with
+    ``successful_only`` so a rejected body can be corrected and resent.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float = 86400.0, namespace: str = 'idempotency'):
+        self.backend = backend
+        self.ttl = ttl
+        self.namespace = namespace
+        self.flight = SingleFlight()
+        # body fingerprint of each key whose call is in flight in this worker
+        self._in_flight: dict[str, str] = {}
+        self.replayed_total = 0
+
+    @classmethod
+    def from_settings(cls, settings, namespace: str = 'idempotency'):
+        """
+        :param settings: config.Settings
+        :param namespace: key prefix, one per tenant
+        :return: IdempotencyStore or None when idempotency keys are disabled
+        """
+        if not settings.idempotency_enabled:
+            return None
+        if settings.cache_backend == 'redis':
+            backend = RedisCacheBackend.from_url(settings.cache_redis_url)
+        else:
+            backend = MemoryCacheBackend(max_entries=settings.idempotency_max_entries)
+        return cls(backend, ttl=settings.idempotency_ttl, namespace=namespace)
+
+    def _key(self, scope: str, key: str) -> str:
+        return f"{self.namespace}:{scope}:{key}"
+
+    async def _load(self, storage_key: str, key: str, body_fingerprint: str) -> Response | None:
+        stored = await self.backend.get(storage_key)
+        if stored is None:
+            return None
+        header, _, raw = stored.partition(b'\n')
+        entry = json_codec.loads(header)
+        if entry['fingerprint'] != body_fingerprint:
+            raise IdempotencyKeyReused(key)
+        return Response(entry['status'], raw=raw)
+
+    async def _call_and_store(self, storage_key: str, body_fingerprint: str,
+                              call: Callable[[], Awaitable[Response]], successful_only: bool) -> Response:
+        try:
+            response = await call()
+            status = response.get_status_code()
+            if (200 <= status < 300) if successful_only else is_final(status):
+                header = json_codec.dumps({
+                    'status': response.get_status_code(),
+                    'fingerprint': body_fingerprint,
+                    'created': time.time(),
+                })
+                await self.backend.set(storage_key, header + b'\n' + response.get_raw(), self.ttl)
+            return response
+        finally:
+            self._in_flight.pop(storage_key, None)
+
+    async def execute(self, scope: str, key: str, body_fingerprint: str,
+                      call: Callable[[], Awaitable[Response]],
+                      successful_only: bool = False) -> tuple[Response, bool]:
+        """
+        :param scope: separates keys of different routes
+        :param key: client supplied idempotency key
+        :param body_fingerprint: fingerprint() of the request body
+        :param call: makes the RetailCRM call
+        :param successful_only: store 2xx answers only
+        :return: (response, replayed) — replayed is True when the response is
+                 the one of an earlier or concurrent request with the same key
+        """
+        storage_key = self._key(scope, key)
+
+        in_flight = self._in_flight.get(storage_key)
+        if in_flight is not None and in_flight != body_fingerprint:
+            raise IdempotencyKeyReused(key)
+
+        if in_flight is None:
+            stored = await self._load(storage_key, key, body_fingerprint)
+            if stored is not None:
+                self.replayed_total += 1
+                return stored, True
+            # the load awaited, another request may have started meanwhile
+            in_flight = self._in_flight.get(storage_key)
+            if in_flight is not None and in_flight != body_fingerprint:
+                raise IdempotencyKeyReused(key)
+            if in_flight is None:
+                self._in_flight[storage_key] = body_fingerprint
+
+        response = await self.flight.do(
+            storage_key,
+            lambda: self._call_and_store(storage_key, body_fingerprint, call, successful_only)
+        )
+        replayed = in_flight is not None
+        if replayed:
+            self.replayed_total += 1
+        return response, replayed
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._in_flight),
+            'replayed_total': self.replayed_total,
+            'coalesced_total': self.flight.coalesced_total,
+        }
+
+    async def close(self) -> None:
+        await self.backend.close()
@@ -0,0 +1,104 @@
+"""
+Customer overview assembled from concurrent RetailCRM lookups
+"""
+import asyncio
+
+import httpx
+
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+from api.base_api.exceptions import UpstreamUnavailableError
+from api.retail_api.pagination import UPSTREAM_PAGE_SIZE, PageFetchError, fetch_window
+
+CUSTOMER = 'customer'
+ORDERS = 'orders'
+
+
+class PartError(Exception):
+    def __init__(self, status: int, detail):
+        super().__init__(f"Failed with status {status}")
+        self.status = status
+        self.detail = detail
+
+
+def _error(e: Exception) -> dict:
+    if isinstance(e, PartError):
+        return {'status': e.status, 'detail': e.detail}
+    if isinstance(e, PageFetchError):
+        return {'status': e.response.get_status_code(), 'detail': e.response.get_response()}
+    # UpstreamUnavailableError and transport errors
+    return {'status': 503, 'detail': str(e)}
+
+
+def _payments(orders: list[dict]) -> list[dict]:
+    """
+    RetailCRM returns payments inside their order, keyed by payment id.
+    """
+    payments = []
+    for order in orders:
+        for payment in (order.get('payments') or {}).values():
+            payments.append({**payment, 'order': {'id': order.get('id'), 'externalId': order.get('externalId')}})
+    return payments
+
+
+async def customer_overview(client: ApiClientRetailCRM,
+                            customer_id: str,
+                            site: str,
+                            id_type: str = 'id',
+                            max_orders: int = 500,
+                            concurrency: int = 4) -> dict:
+    """
+    The customer, their orders and the payments of those orders in one
+    document. The customer and the first order page are requested at the
+    same time, the remaining order pages all at once after that, so the
+    call takes about as long as the slowest lookup rather than their sum.
+    A part that fails is left empty and described under ``errors``.
+
+    :param max_orders: orders collected at most, newest first
+    :return: dict
+    """
+    async def customer():
+        resp = await client.get_customer(customer_id, site=site, id_type=id_type)
+        if not resp.is_successful():
+            raise PartError(resp.get_status_code(), resp.get_response())
+        return resp.get_value('customer')
+
+    async def fetch_page(page: int):
+        return await client.get_orders_by_customer(
+            customer_id, site=site, limit=UPSTREAM_PAGE_SIZE, page=page, id_type=id_type,
+        )
+
+    async def orders():
+        first, total = await fetch_window(fetch_page, 'orders', 0, min(max_orders, UPSTREAM_PAGE_SIZE))
+        if total is None or total <= len(first) or len(first) >= max_orders:
+            return first, total
+        rest, _ = await fetch_window(
+            fetch_page, 'orders', len(first), max_orders - len(first), total=total, concurrency=concurrency,
+        )
+        return first + rest, total
+
+    results = await asyncio.gather(customer(), orders(), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException) and not isinstance(
+                result, (PartError, PageFetchError, UpstreamUnavailableError, httpx.HTTPError)):
+            raise result
+
+    customer_result, orders_result = results
+    errors = {}
+    if isinstance(customer_result, BaseException):
+        errors[CUSTOMER] = _error(customer_result)
+        customer_result = None
+    if isinstance(orders_result, BaseException):
+        errors[ORDERS] = _error(orders_result)
+        order_list, total = [], None
+    else:
+        order_list, total = orders_result
+
+    return {
+        'success': not errors,
+        'customer': customer_result,
+        'orders': order_list,
+        'payments': _payments(order_list),
+        'ordersTotalCount': total,
+        'ordersTruncated': total is not None and total > len(order_list),
+        'errors': errors,
+    }
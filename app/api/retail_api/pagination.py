@@ -0,0 +1,163 @@
+"""
+Opaque cursors and page assembly for paged routes
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from api.base_api.response import Response
+
+# largest page RetailCRM serves for list endpoints
+UPSTREAM_PAGE_SIZE = 100
+
+
+def encode_cursor(position: dict) -> str:
+    raw = json.dumps(position, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    :raise ValueError: the cursor was not produced by encode_cursor()
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(position, dict):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return position
+
+
+def filters_fingerprint(filters: dict) -> str:
+    """
+    Short digest binding a cursor to the filters of the request that made it
+    """
+    return hashlib.sha256(json.dumps(filters, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class PageFetchError(Exception):
+    def __init__(self, page: int, response: Response):
+        super().__init__(f"Page {page} failed with status {response.get_status_code()}")
+        self.page = page
+        self.response = response
+
+
+class TotalCountCache:
+    """
+    Remembers how many records a filtered list has, so paging does not
+    count them again on every request. Counts are approximate by nature:
+    they are at most ``ttl`` seconds old.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[float, int]] = OrderedDict()
+        self.hits_total = 0
+        self.misses_total = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        :param settings: config.Settings
+        :return: TotalCountCache
+        """
+        return cls(ttl=settings.pagination_total_ttl, max_entries=settings.pagination_total_max_entries)
+
+    def get(self, key: tuple) -> int | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses_total += 1
+            return None
+        self.hits_total += 1
+        return entry[1]
+
+    def set(self, key: tuple, total: int) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, total)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'hits_total': self.hits_total,
+            'misses_total': self.misses_total,
+        }
+
+
+async def fetch_window(fetch_page: Callable[[int], Awaitable[Response]],
+                       key: str,
+                       offset: int,
+                       size: int,
+                       total: int | None = None,
+                       concurrency: int = 4,
+                       page_size: int = UPSTREAM_PAGE_SIZE) -> tuple[list[dict], int | None]:
+    """
+    Records ``offset`` to ``offset + size`` of a list, cut out of the
+    upstream pages of ``page_size`` that cover them. The pages are fetched
+    concurrently, at most ``concurrency`` at a time; a deep window costs
+    the same as the first one.
+
+    :param total: known record count, pages past it are not fetched
+    :return: (records, totalCount reported by the first page or None)
+    :raise PageFetchError: an upstream page was not successful
+    """
+    first_page = offset // page_size + 1
+    last_page = (offset + size - 1) // page_size + 1
+    if total is not None:
+        last_page = min(last_page, math.ceil(total / page_size))
+    if last_page < first_page:
+        return [], total
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(page: int) -> Response:
+        async with semaphore:
+            response = await fetch_page(page)
+        if not response.is_successful():
+            raise PageFetchError(page, response)
+        return response
+
+    responses = await asyncio.gather(*(fetch(page) for page in range(first_page, last_page + 1)))
+    records = [record for response in responses for record in response.get_value(key) or []]
+    start = offset - (first_page - 1) * page_size
+    reported = (responses[0].get_value('pagination') or {}).get('totalCount')
+    return records[start:start + size], reported
+
+
+async def fetch_after(fetch_page: Callable[[int], Awaitable[Response]],
+                      key: str,
+                      offset: int,
+                      last_id: int | None,
+                      size: int,
+                      total: int | None = None,
+                      concurrency: int = 4) -> tuple[list[dict], int, int | None]:
+    """
+    The ``size`` records following a cursor. The window starts one record
+    early: if that record is not the one the cursor ended on, records were
+    added or removed ahead of it, and the window is realigned on
+    ``last_id`` so no record is repeated.
+
+    :return: (records, offset of the first record, totalCount reported upstream)
+    """
+    if not offset or last_id is None:
+        records, reported = await fetch_window(fetch_page, key, offset, size, total, concurrency)
+        return records, offset, reported
+
+    records, reported = await fetch_window(fetch_page, key, offset - 1, size + 1, total, concurrency)
+    ids = [record.get('id') for record in records]
+    skip = ids.index(last_id) + 1 if last_id in ids else 1
+    records, start = records[skip:], offset - 1 + skip
+    if skip > 1 and len(records) < size:
+        # the realigned window ends early, fill it up
+        more, _ = await fetch_window(fetch_page, key, start + len(records), size - len(records), reported, concurrency)
+        records += more
+    return records, start, reported
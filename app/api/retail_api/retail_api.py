@@ -1,21 +1,264 @@
+import asyncio
+import math
+import re
 from typing import Optional, Dict, Any, List
-
-from fastapi import APIRouter, Query, Depends, HTTPException, Request
-from pydantic import BaseModel, Field
-
-from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+from urllib.parse import parse_qsl
+
+from fastapi import APIRouter, Query, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi_pagination.cursor import CursorPage
+from fastapi_pagination.customization import CustomizedPage, UseCursorEncoding, UseName, UseParamsFields
+from pydantic import BaseModel, Field, ValidationError
+
+from api.base_api import json_codec
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM, UPLOAD_LIMIT
+from api.base_api.response import Response as CrmResponse
+from api.jobs import queue as job_queue
+from api.jobs.worker import JobRunner
+from api.replica.store import CUSTOMERS, ORDERS, ReplicaStore
+from api.retail_api.catalog import DICTIONARIES, Catalog
+from api.retail_api.conditional import ResponseEncoder
+from api.retail_api.export import EXPORT_PAGE_SIZE, iter_pages, stream_ndjson
+from api.retail_api.idempotency import (
+    IDEMPOTENCY_HEADER, REPLAYED_HEADER, IdempotencyKeyReused, IdempotencyStore, fingerprint,
+)
+from api.retail_api.overview import CUSTOMER, customer_overview
+from api.retail_api.pagination import (
+    UPSTREAM_PAGE_SIZE, PageFetchError, TotalCountCache, decode_cursor, encode_cursor, fetch_after, fetch_window,
+    filters_fingerprint,
+)
+from api.retail_api.tenants import Tenant
+from api.retail_api.webhooks import WEBHOOK_SECRET_HEADER, WebhookEvent, WebhookProcessor, verify_secret
+from api.retail_api.bulk import (
+    DuplexStreamingResponse, iter_csv_rows, iter_lines, iter_ndjson_rows, stream_batches,
+)
 from config import settings
+from observability import tracing
 
 retail_router = APIRouter()
 
+# X-Cache value of responses answered from the local replica
+REPLICA = 'REPLICA'
+
+# page sizes RetailCRM accepts for list endpoints
+UPSTREAM_LIMITS = (20, 50, 100)
+
+
+def get_tenant(request: Request) -> Tenant:
+    return request.app.state.tenants.get(getattr(request.state, 'tenant', None))
+
+
+def get_site_code(tenant: Tenant = Depends(get_tenant)) -> str:
+    return tenant.site_code
+
+
+def get_crm_client(tenant: Tenant = Depends(get_tenant)) -> ApiClientRetailCRM:
+    return tenant.client
+
+
+def get_replica(request: Request, tenant: Tenant = Depends(get_tenant)) -> Optional[ReplicaStore]:
+    # the replica mirrors the default account only
+    return request.app.state.replica if tenant.is_default else None
+
+
+def get_idempotency(tenant: Tenant = Depends(get_tenant)) -> Optional[IdempotencyStore]:
+    return tenant.idempotency
+
+
+def get_jobs(request: Request) -> Optional[JobRunner]:
+    return request.app.state.jobs
+
+
+def get_webhooks(tenant: Tenant = Depends(get_tenant)) -> Optional[WebhookProcessor]:
+    return tenant.webhooks
+
+
+def get_page_totals(request: Request) -> TotalCountCache:
+    return request.app.state.page_totals
+
 
-def get_crm_client() -> ApiClientRetailCRM:
-    return ApiClientRetailCRM(
-        crm_base_url=settings.base_url,
-        crm_api_key=settings.api_key,
+def get_encoder(request: Request) -> ResponseEncoder:
+    return request.app.state.encoder
+
+
+def get_admission(request: Request):
+    return request.app.state.admission
+
+
+def get_catalog(tenant: Tenant = Depends(get_tenant)) -> Optional[Catalog]:
+    return tenant.catalog
+
+
+def _fresh_replica(replica: Optional[ReplicaStore], entity: str) -> bool:
+    return replica is not None and replica.is_fresh(entity, settings.replica_max_staleness)
+
+
+def _replica_customer(customer_id: int, customer: Dict[str, Any], site_code: str) -> Dict[str, Any]:
+    """
+    Replica row for a customer we just created, until the history feed
+    brings the full record.
+    """
+    replica_customer = {'id': customer_id, 'site': site_code, **customer}
+    phone = replica_customer.pop('phone', None)
+    if phone:
+        replica_customer['phones'] = [{'number': phone}]
+    return replica_customer
+
+
+def _customer_filters(name: Optional[str], email: Optional[str],
+                      created_from: Optional[str], created_to: Optional[str]) -> Dict[str, Any]:
+    filters: Dict[str, Any] = {}
+    if name:
+        filters['name'] = name
+    if email:
+        filters['email'] = email
+    if created_from:
+        filters['dateFrom'] = created_from
+    if created_to:
+        filters['dateTo'] = created_to
+    return filters
+
+
+def _upstream_customer_filters(filters: Dict[str, Any], phone: Optional[str]) -> Dict[str, Any]:
+    if phone and 'name' not in filters:
+        # RetailCRM matches phone numbers through filter[name]
+        return {**filters, 'name': phone}
+    return filters
+
+
+def _encode_page_cursor(params, position: Optional[dict]) -> Optional[str]:
+    return encode_cursor(position) if position else None
+
+
+def _decode_page_cursor(params, cursor: Optional[str]) -> Optional[dict]:
+    if not cursor:
+        return None
+    try:
+        position = decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    offset, last_id, filter_key = position.get('o'), position.get('id'), position.get('f')
+    if type(offset) is not int or offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if last_id is not None and type(last_id) is not int:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(filter_key, str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return position
+
+
+CustomerCursorPage = CustomizedPage[
+    CursorPage[Dict[str, Any]],
+    UseName("CustomerCursorPage"),
+    UseParamsFields(size=Query(50, ge=1, le=settings.pagination_max_size, description="Page size")),
+    UseCursorEncoding(encoder=_encode_page_cursor, decoder=_decode_page_cursor),
+]
+
+
+def _cursor_page(cursor: Optional[str]) -> int:
+    if cursor is None:
+        return 1
+    try:
+        page = int(decode_cursor(cursor)['page'])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if page < 1:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return page
+
+
+async def _export(fetch_page, key: str, cursor: Optional[str]) -> StreamingResponse:
+    start_page = _cursor_page(cursor)
+    first = await fetch_page(start_page)
+    if not first.is_successful():
+        raise HTTPException(status_code=first.get_status_code(), detail=first.get_response())
+
+    pagination = first.get_value('pagination') or {}
+    pages = iter_pages(fetch_page, first, start_page, prefetch=settings.export_prefetch_pages)
+    return StreamingResponse(
+        stream_ndjson(pages, key, start_page),
+        media_type="application/x-ndjson",
+        headers={
+            "X-Total-Count": str(pagination.get('totalCount', '')),
+            "X-Total-Pages": str(pagination.get('totalPageCount', '')),
+        },
     )
 
 
+def _json_response(body: Any, cache_status: Optional[str] = None) -> Response:
+    headers = {'X-Cache': cache_status} if cache_status is not None else None
+    return Response(content=json_codec.dumps(body), media_type="application/json", headers=headers)
+
+
+def _upstream_response(resp, replayed: bool = False) -> Response:
+    """
+    Pass the upstream JSON bytes through without decoding and re-encoding them.
+    """
+    headers = {}
+    if resp.cache_status is not None:
+        headers['X-Cache'] = resp.cache_status
+    if replayed:
+        headers[REPLAYED_HEADER] = 'true'
+    return Response(content=resp.get_raw(), media_type="application/json", headers=headers or None)
+
+
+async def _encoded_response(request: Request, encoder: ResponseEncoder, tenant: Tenant,
+                            body: bytes, cache_status: Optional[str] = None) -> Response:
+    """
+    Like _json_response(), with an ETag, 304 for a matching If-None-Match and compression.
+    """
+    headers = {'X-Cache': cache_status} if cache_status is not None else None
+    return await encoder.respond(request, body, cache=tenant.cache, headers=headers)
+
+
+def _raise_for_upstream(resp, replayed: bool = False) -> None:
+    if not resp.is_successful():
+        raise HTTPException(
+            status_code=resp.get_status_code(),
+            detail=resp.get_response(),
+            headers={REPLAYED_HEADER: 'true'} if replayed else None,
+        )
+
+
+async def _idempotent(store: Optional[IdempotencyStore], scope: str, key: Optional[str], payload, call,
+                      successful_only: bool = False):
+    """
+    Make the RetailCRM call once per idempotency key.
+
+    :param successful_only: remember 2xx answers only, for keys the client did not choose
+    :return: (Response, replayed)
+    """
+    if store is None or not key:
+        return await call(), False
+    try:
+        return await store.execute(scope, key, fingerprint(payload), call, successful_only=successful_only)
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def _prefers_async(prefer: Optional[str]) -> bool:
+    """
+    RFC 7240 ``Prefer: respond-async``
+    """
+    return bool(prefer) and any(token.strip().lower() == 'respond-async' for token in re.split('[,;]', prefer))
+
+
+async def _enqueue(jobs: JobRunner, kind: str, payload: Dict[str, Any], site: Optional[str],
+                   tenant: Tenant) -> CrmResponse:
+    job_id = await jobs.submit(kind, payload, site, tenant=None if tenant.is_default else tenant.name)
+    return CrmResponse(202, {'success': True, 'jobId': job_id, 'status': job_queue.QUEUED})
+
+
+def _accepted_response(request: Request, resp, replayed: bool) -> Response:
+    headers = {
+        'Location': str(request.url_for('get_job', job_id=resp.get_response()['jobId'])),
+        'Preference-Applied': 'respond-async',
+    }
+    if replayed:
+        headers[REPLAYED_HEADER] = 'true'
+    return Response(content=resp.get_raw(), status_code=202, media_type="application/json", headers=headers)
+
+
 class FilterParams(BaseModel):
     name: Optional[str]
     email: Optional[str]
@@ -41,6 +284,40 @@ class CreateOrderRequest(BaseModel):
     site: Optional[str] = None
 
 
+def _build_order_payload(body: CreateOrderRequest) -> Dict[str, Any]:
+    order_payload: Dict[str, Any] = {}
+
+    if body.customerId is not None:
+        order_payload["customer"] = {"id": body.customerId}
+    elif body.customerExternalId:
+        order_payload["customer"] = {"externalId": body.customerExternalId}
+    elif body.customerBrowserId:
+        order_payload["customer"] = {"browserId": body.customerBrowserId}
+
+    order_payload["externalId"] = body.externalId
+
+    order_payload["items"] = []
+    for item in body.items:
+        item_payload = {"quantity": item.quantity}
+        offer = {}
+        if item.offerId:
+            offer["id"] = item.offerId
+        if item.offerExternalId:
+            offer["externalId"] = item.offerExternalId
+        if item.offerXmlId:
+            offer["xmlId"] = item.offerXmlId
+        if offer:
+            item_payload["offer"] = offer
+        order_payload["items"].append(item_payload)
+
+    return order_payload
+
+
+class BatchCreateOrderRequest(BaseModel):
+    orders: List[CreateOrderRequest] = Field(..., min_length=1, max_length=settings.orders_batch_max_items)
+    site: Optional[str] = Field(None, description="Shop code for orders without their own site")
+
+
 class CreateCustomerRequest(BaseModel):
     firstName: str = Field(..., description="Имя клиента")
     lastName: Optional[str] = Field(None, description="Фамилия клиента")
@@ -57,41 +334,215 @@ class CreatePaymentRequest(BaseModel):
 
 @retail_router.get("/customers", summary="Get list of customers with filters")
 async def list_customers(
+        request: Request,
         name: Optional[str] = Query(None),
         email: Optional[str] = Query(None),
+        phone: Optional[str] = Query(None),
         createdAtFrom: Optional[str] = Query(None),
         createdAtTo: Optional[str] = Query(None),
-        limit: int = Query(20, ge=1),
+        limit: int = Query(20, ge=1, le=settings.pagination_max_size),
         page: int = Query(1, ge=1),
+        tenant: Tenant = Depends(get_tenant),
+        client: ApiClientRetailCRM = Depends(get_crm_client),
+        replica: Optional[ReplicaStore] = Depends(get_replica),
+        totals: TotalCountCache = Depends(get_page_totals),
+        encoder: ResponseEncoder = Depends(get_encoder)
+):
+    filters = _customer_filters(name, email, createdAtFrom, createdAtTo)
+
+    if _fresh_replica(replica, CUSTOMERS):
+        customers = replica.list_customers({**filters, 'phone': phone}, limit=limit, page=page)
+        return await _encoded_response(request, encoder, tenant, json_codec.dumps(customers), REPLICA)
+
+    filters = _upstream_customer_filters(filters, phone)
+    if limit in UPSTREAM_LIMITS:
+        resp = await client.get_customers(limit=limit, page=page, filters=filters)
+        if not resp.is_successful():
+            raise HTTPException(status_code=resp.get_status_code(), detail=resp.get_response())
+        return await _encoded_response(request, encoder, tenant, resp.get_raw(), resp.cache_status)
+
+    # any other size is cut out of the 100-record upstream pages around it
+    async def fetch_page(upstream_page: int):
+        return await client.get_customers(limit=UPSTREAM_PAGE_SIZE, page=upstream_page, filters=filters)
+
+    total_key = (tenant.name, 'customers', filters_fingerprint(filters))
+    try:
+        customers, total = await fetch_window(
+            fetch_page, 'customers', (page - 1) * limit, limit,
+            total=totals.get(total_key), concurrency=settings.pagination_concurrency,
+        )
+    except PageFetchError as e:
+        raise HTTPException(status_code=e.response.get_status_code(), detail=e.response.get_response())
+    if total is None:
+        total = (page - 1) * limit + len(customers)
+    else:
+        totals.set(total_key, total)
+    return await _encoded_response(request, encoder, tenant, json_codec.dumps({
+        'success': True,
+        'pagination': {
+            'limit': limit,
+            'totalCount': total,
+            'currentPage': page,
+            'totalPageCount': max(1, math.ceil(total / limit)),
+        },
+        'customers': customers,
+    }))
+
+
+@retail_router.get(
+    "/customers/paged",
+    response_model=CustomerCursorPage,
+    summary="Page through customers with a cursor",
+    description="Returns `size` customers (up to the configured maximum) and a `next_page` cursor. Pages "
+                "larger than RetailCRM's 100 are assembled from several upstream pages fetched concurrently; "
+                "with a fresh local replica pages are read from it. A cursor is only valid with the filters "
+                "it was issued for.",
+)
+async def page_customers(
+        response: Response,
+        name: Optional[str] = Query(None),
+        email: Optional[str] = Query(None),
+        phone: Optional[str] = Query(None),
+        createdAtFrom: Optional[str] = Query(None),
+        createdAtTo: Optional[str] = Query(None),
+        params: CustomerCursorPage.__params_type__ = Depends(),
+        tenant: Tenant = Depends(get_tenant),
+        client: ApiClientRetailCRM = Depends(get_crm_client),
+        replica: Optional[ReplicaStore] = Depends(get_replica),
+        totals: TotalCountCache = Depends(get_page_totals)
+):
+    filters = _customer_filters(name, email, createdAtFrom, createdAtTo)
+    filter_key = filters_fingerprint({**filters, 'phone': phone})
+    raw = params.to_raw_params()
+    # o: offset of the page, id: last customer before it, f: filters it belongs to
+    position = raw.cursor or {'o': 0, 'id': None, 'f': filter_key}
+    if position.get('f') != filter_key:
+        raise HTTPException(status_code=400, detail="Cursor was issued for different filters")
+
+    total_key = (tenant.name, 'customers', filter_key)
+    total = totals.get(total_key)
+    if _fresh_replica(replica, CUSTOMERS):
+        replica_filters = {**filters, 'phone': phone}
+        if total is None:
+            total = replica.count_customers(replica_filters)
+            totals.set(total_key, total)
+        customers = replica.customers_before(replica_filters, position.get('id'), raw.size)
+        offset = position['o']
+        response.headers['X-Cache'] = REPLICA
+    else:
+        upstream_filters = _upstream_customer_filters(filters, phone)
+
+        async def fetch_page(page: int):
+            return await client.get_customers(limit=UPSTREAM_PAGE_SIZE, page=page, filters=upstream_filters)
+
+        try:
+            customers, offset, reported = await fetch_after(
+                fetch_page, 'customers', position['o'], position.get('id'), raw.size,
+                total=total, concurrency=settings.pagination_concurrency,
+            )
+        except PageFetchError as e:
+            raise HTTPException(status_code=e.response.get_status_code(), detail=e.response.get_response())
+        if reported is not None:
+            total = reported
+            totals.set(total_key, total)
+
+    next_offset = offset + len(customers)
+    has_next = next_offset < total if total is not None else len(customers) == raw.size
+    next_position = None
+    if customers and has_next:
+        next_position = {'o': next_offset, 'id': customers[-1].get('id'), 'f': filter_key}
+    return CustomerCursorPage.create(customers, params, current=position, next_=next_position, total=total)
+
+
+@retail_router.get(
+    "/customers/export",
+    summary="Export all customers as NDJSON",
+    description="Streams every customer matching the filters, one JSON object per line. After each page a "
+                "`{\"@cursor\": ...}` line is written; pass it as `cursor` to resume an interrupted export.",
+)
+async def export_customers(
+        name: Optional[str] = Query(None),
+        email: Optional[str] = Query(None),
+        createdAtFrom: Optional[str] = Query(None),
+        createdAtTo: Optional[str] = Query(None),
+        cursor: Optional[str] = Query(None),
         client: ApiClientRetailCRM = Depends(get_crm_client)
 ):
-    filters: Dict[str, Any] = {}
-    if name:
-        filters['name'] = name
-    if email:
-        filters['email'] = email
-    if createdAtFrom:
-        filters['dateFrom'] = createdAtFrom
-    if createdAtTo:
-        filters['dateTo'] = createdAtTo
+    filters = _customer_filters(name, email, createdAtFrom, createdAtTo)
 
-    resp = await client.get_customers(limit=limit, page=page, filters=filters)
-    if not resp.is_successful():
-        raise HTTPException(status_code=resp.get_status_code(), detail=resp.get_response())
-    return resp.get_response()
+    async def fetch_page(page: int):
+        return await client.get_customers(limit=EXPORT_PAGE_SIZE, page=page, filters=filters, use_cache=False)
+
+    return await _export(fetch_page, 'customers', cursor)
 
 
 @retail_router.post("/customers", summary="Create a new customer")
 async def create_customer(
         body: CreateCustomerRequest,
-        client: ApiClientRetailCRM = Depends(get_crm_client)
+        idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER, max_length=255),
+        client: ApiClientRetailCRM = Depends(get_crm_client),
+        replica: Optional[ReplicaStore] = Depends(get_replica),
+        idempotency: Optional[IdempotencyStore] = Depends(get_idempotency),
+        default_site: str = Depends(get_site_code)
 ):
     cust_data = body.model_dump(exclude={"site"}, exclude_none=True)
-    site_code = body.site or settings.site_code
-    resp = await client.create_customer(customer=cust_data, site=site_code)
-    if not resp.is_successful():
-        raise HTTPException(status_code=resp.get_status_code(), detail=resp.get_response())
-    return resp.get_response()
+    site_code = body.site or default_site
+    resp, replayed = await _idempotent(
+        idempotency, "customers", idempotency_key, [cust_data, site_code],
+        lambda: client.create_customer(customer=cust_data, site=site_code),
+    )
+    _raise_for_upstream(resp, replayed)
+    if replica is not None and not replayed and resp.get_response().get('id') is not None:
+        with replica.transaction():
+            replica.upsert_customers([_replica_customer(resp.get_response()['id'], cust_data, site_code)])
+    return _upstream_response(resp, replayed)
+
+
+@retail_router.post(
+    "/customers/batch",
+    summary="Import customers from an NDJSON or CSV stream",
+    description="The body is NDJSON (one CreateCustomerRequest per line) or CSV with a header line "
+                "(`Content-Type: text/csv`). Rows are uploaded through /customers/upload while the body "
+                "is still being read, and one NDJSON result line per row is streamed back.",
+)
+async def import_customers(
+        request: Request,
+        site: Optional[str] = Query(None, description="Shop code for rows without their own site"),
+        client: ApiClientRetailCRM = Depends(get_crm_client),
+        default_site: str = Depends(get_site_code)
+):
+    lines = iter_lines(request.stream(), max_length=settings.bulk_max_line_bytes)
+    if request.headers.get('content-type', '').startswith('text/csv'):
+        raw_rows = iter_csv_rows(lines)
+    else:
+        raw_rows = iter_ndjson_rows(lines)
+
+    async def validated_rows():
+        async for row, value, error in raw_rows:
+            if error is not None:
+                yield row, None, None, error
+                continue
+            try:
+                customer = CreateCustomerRequest(**value)
+            except ValidationError as e:
+                yield row, None, None, e.errors(include_url=False, include_context=False)
+                continue
+            site_code = customer.site or site or default_site
+            yield row, site_code, customer.model_dump(exclude={"site"}, exclude_none=True), None
+
+    async def upload(site_code: str, customers: List[Dict[str, Any]]):
+        return await client.upload_customers(customers, site=site_code, concurrency=1)
+
+    async def results():
+        async for result in stream_batches(
+                validated_rows(),
+                upload,
+                batch_size=UPLOAD_LIMIT,
+                concurrency=settings.crm_upload_concurrency,
+        ):
+            yield json_codec.dumps(result) + b"\n"
+
+    return DuplexStreamingResponse(results(), media_type="application/x-ndjson")
 
 
 @retail_router.get("/customers/{customer_id}", summary="Get a customer by ID")
@@ -99,72 +550,312 @@ async def retrieve_customer(
         customer_id: str,
         by: str = Query('id', alias='by'),
         site: Optional[str] = Query(None),
-        client: ApiClientRetailCRM = Depends(get_crm_client)
+        client: ApiClientRetailCRM = Depends(get_crm_client),
+        replica: Optional[ReplicaStore] = Depends(get_replica),
+        default_site: str = Depends(get_site_code)
 ):
-    site_code = site or settings.site_code
+    site_code = site or default_site
+    if _fresh_replica(replica, CUSTOMERS):
+        body = replica.get_customer(customer_id, site=site_code, id_type=by)
+        if body is not None:
+            return _json_response(body, REPLICA)
+
     resp = await client.get_customer(customer_id=customer_id, site=site_code, id_type=by)
     if not resp.is_successful():
         raise HTTPException(status_code=resp.get_status_code(), detail=resp.get_response())
-    return resp.get_response()
+    return _upstream_response(resp)
+
+
+@retail_router.get(
+    "/customers/{customer_id}/overview",
+    summary="Customer with their orders and payments",
+    description="Fetches the customer and all order pages concurrently and merges them into one document. "
+                "A part that could not be fetched is left empty and reported under `errors`; `success` is "
+                "false then. Payments are taken from the orders. At most OVERVIEW_MAX_ORDERS orders, newest "
+                "first, are included.",
+)
+async def get_customer_overview(
+        customer_id: str,
+        by: str = Query('id', alias='by', pattern='^(id|externalId)$'),
+        site: Optional[str] = Query(None),
+        client: ApiClientRetailCRM = Depends(get_crm_client),
+        default_site: str = Depends(get_site_code)
+):
+    overview = await customer_overview(
+        client, customer_id, site=site or default_site, id_type=by,
+        max_orders=settings.overview_max_orders, concurrency=settings.pagination_concurrency,
+    )
+    errors = overview['errors']
+    if errors.get(CUSTOMER, {}).get('status') == 404:
+        raise HTTPException(status_code=404, detail=errors[CUSTOMER]['detail'])
+    if len(errors) == 2:
+        # nothing could be fetched
+        raise HTTPException(status_code=502, detail=errors)
+    return _json_response(overview)
 
 
 @retail_router.post("/orders", summary="Create a new order with customer, items and externalId")
 async def create_order(
+    request: Request,
     body: CreateOrderRequest,
-    client: ApiClientRetailCRM = Depends(get_crm_client)
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER, max_length=255),
+    prefer: Optional[str] = Header(None, description="respond-async queues the order and answers 202"),
+    client: ApiClientRetailCRM = Depends(get_crm_client),
+    idempotency: Optional[IdempotencyStore] = Depends(get_idempotency),
+    jobs: Optional[JobRunner] = Depends(get_jobs),
+    tenant: Tenant = Depends(get_tenant),
+    catalog: Optional[Catalog] = Depends(get_catalog)
 ):
-    order_payload: Dict[str, Any] = {}
+    with tracing.span("build_order_payload", **{'order.items': len(body.items)}):
+        order_payload = _build_order_payload(body)
+
+    site_code = body.site or tenant.site_code
+    if catalog is not None:
+        errors = await catalog.validate_order(order_payload, site=site_code)
+        if errors:
+            raise HTTPException(status_code=422, detail=errors)
+    # an order externalId is unique in RetailCRM, so it doubles as the key;
+    # rejections are not remembered under it, so a corrected order can be resent
+    key = idempotency_key or (body.externalId and f"externalId:{body.externalId}")
+    implicit_key = not idempotency_key
+    if jobs is not None and _prefers_async(prefer):
+        resp, replayed = await _idempotent(
+            idempotency, "orders:async", key, [order_payload, site_code],
+            lambda: _enqueue(jobs, job_queue.ORDER, order_payload, site_code, tenant),
+            successful_only=implicit_key,
+        )
+        return _accepted_response(request, resp, replayed)
+
+    resp, replayed = await _idempotent(
+        idempotency, "orders", key, [order_payload, site_code],
+        lambda: client.order_create(order=order_payload, site=site_code),
+        successful_only=implicit_key,
+    )
+    _raise_for_upstream(resp, replayed)
+    return _upstream_response(resp, replayed)
 
-    if body.customerId is not None:
-        order_payload["customer"] = {"id": body.customerId}
-    elif body.customerExternalId:
-        order_payload["customer"] = {"externalId": body.customerExternalId}
-    elif body.customerBrowserId:
-        order_payload["customer"] = {"browserId": body.customerBrowserId}
 
-    order_payload["externalId"] = body.externalId
+@retail_router.post("/orders/batch", summary="Create many orders through /orders/upload")
+async def create_orders_batch(
+    body: BatchCreateOrderRequest,
+    client: ApiClientRetailCRM = Depends(get_crm_client),
+    default_site: str = Depends(get_site_code),
+    catalog: Optional[Catalog] = Depends(get_catalog)
+):
+    results: List[Dict[str, Any]] = [{} for _ in body.orders]
+    payloads = [_build_order_payload(order) for order in body.orders]
+    sites = [order.site or body.site or default_site for order in body.orders]
+    validations = [None] * len(payloads)
+    if catalog is not None:
+        validations = await asyncio.gather(*(
+            catalog.validate_order(payload, site=site_code) for payload, site_code in zip(payloads, sites)
+        ))
+    by_site: Dict[str, List[int]] = {}
+    for index, (site_code, errors) in enumerate(zip(sites, validations)):
+        if errors:
+            # rejected locally, the rest of the batch is still uploaded
+            results[index] = {"index": index, "success": False, "error": "Invalid order", "errors": errors}
+            continue
+        by_site.setdefault(site_code, []).append(index)
+
+    async def upload_site(site_code: str, indexes: List[int]):
+        return indexes, await client.upload_orders(
+            [payloads[i] for i in indexes],
+            site=site_code,
+            concurrency=settings.crm_upload_concurrency,
+        )
+
+    for indexes, site_results in await asyncio.gather(*(upload_site(*group) for group in by_site.items())):
+        for index, result in zip(indexes, site_results):
+            results[index] = {"index": index, **result}
+
+    failed = sum(1 for result in results if not result["success"])
+    return {
+        "success": failed == 0,
+        "total": len(results),
+        "uploaded": len(results) - failed,
+        "failed": failed,
+        "results": results,
+    }
+
+
+@retail_router.get(
+    "/orders/export",
+    summary="Export all orders as NDJSON",
+    description="Streams every order matching the filters, one JSON object per line, "
+                "resumable through `cursor` like /customers/export.",
+)
+async def export_orders(
+    customerId: Optional[int] = Query(None),
+    status: Optional[List[str]] = Query(None),
+    createdAtFrom: Optional[str] = Query(None),
+    createdAtTo: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None),
+    client: ApiClientRetailCRM = Depends(get_crm_client)
+):
+    filters: Dict[str, Any] = {}
+    if customerId is not None:
+        filters['customerId'] = customerId
+    if status:
+        filters['extendedStatus'] = status
+    if createdAtFrom:
+        filters['createdAtFrom'] = createdAtFrom
+    if createdAtTo:
+        filters['createdAtTo'] = createdAtTo
 
-    order_payload["items"] = []
-    for item in body.items:
-        item_payload = {"quantity": item.quantity}
-        offer = {}
-        if item.offerId:
-            offer["id"] = item.offerId
-        if item.offerExternalId:
-            offer["externalId"] = item.offerExternalId
-        if item.offerXmlId:
-            offer["xmlId"] = item.offerXmlId
-        if offer:
-            item_payload["offer"] = offer
-        order_payload["items"].append(item_payload)
+    async def fetch_page(page: int):
+        return await client.get_orders(filters=filters, limit=EXPORT_PAGE_SIZE, page=page, use_cache=False)
 
-    site_code = body.site or settings.site_code
-    resp = await client.order_create(order=order_payload, site=site_code)
-    if not resp.is_successful():
-        raise HTTPException(status_code=resp.get_status_code(), detail=resp.get_response())
-    return resp.get_response()
+    return await _export(fetch_page, 'orders', cursor)
 
 
 @retail_router.get("/orders/{customer_id}", summary="Get order by customer ID")
 async def get_order(
+    request: Request,
     customer_id: int,
     by: str = Query('id', alias='by'),
     site: Optional[str] = Query(None),
-    client: ApiClientRetailCRM = Depends(get_crm_client)
+    client: ApiClientRetailCRM = Depends(get_crm_client),
+    replica: Optional[ReplicaStore] = Depends(get_replica),
+    tenant: Tenant = Depends(get_tenant),
+    encoder: ResponseEncoder = Depends(get_encoder)
 ):
-    site_code = site or settings.site_code
+    site_code = site or tenant.site_code
+    if _fresh_replica(replica, ORDERS):
+        orders = replica.orders_by_customer(customer_id, site=site_code, limit=20, page=1)
+        return await _encoded_response(request, encoder, tenant, json_codec.dumps(orders), REPLICA)
+
     resp = await client.get_orders_by_customer(customer_id=customer_id, site=site_code)
     if not resp.is_successful():
         raise HTTPException(status_code=resp.get_status_code(), detail=resp.get_response())
-    return resp.get_response()
+    return await _encoded_response(request, encoder, tenant, resp.get_raw(), resp.cache_status)
 
 
 @retail_router.post("/orders/payments", summary="Create and attach payment to order")
 async def create_payment(
+        request: Request,
         body: CreatePaymentRequest,
-        client: ApiClientRetailCRM = Depends(get_crm_client)
+        idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER, max_length=255),
+        prefer: Optional[str] = Header(None, description="respond-async queues the payment and answers 202"),
+        client: ApiClientRetailCRM = Depends(get_crm_client),
+        idempotency: Optional[IdempotencyStore] = Depends(get_idempotency),
+        jobs: Optional[JobRunner] = Depends(get_jobs),
+        tenant: Tenant = Depends(get_tenant),
+        catalog: Optional[Catalog] = Depends(get_catalog)
 ):
-    resp = await client.order_payment_create(payment=body.payment, site=body.site)
-    if not resp.is_successful():
-        raise HTTPException(status_code=resp.get_status_code(), detail=resp.get_response())
-    return resp.get_response()
+    if catalog is not None:
+        errors = await catalog.validate_payment(body.payment, site=body.site)
+        if errors:
+            raise HTTPException(status_code=422, detail=errors)
+    if jobs is not None and _prefers_async(prefer):
+        resp, replayed = await _idempotent(
+            idempotency, "payments:async", idempotency_key, body.model_dump(),
+            lambda: _enqueue(jobs, job_queue.PAYMENT, body.payment, body.site, tenant),
+        )
+        return _accepted_response(request, resp, replayed)
+
+    resp, replayed = await _idempotent(
+        idempotency, "payments", idempotency_key, body.model_dump(),
+        lambda: client.order_payment_create(payment=body.payment, site=body.site),
+    )
+    _raise_for_upstream(resp, replayed)
+    return _upstream_response(resp, replayed)
+
+
+@retail_router.get("/jobs/{job_id}", summary="Status of a queued order or payment")
+async def get_job(
+        job_id: str,
+        jobs: Optional[JobRunner] = Depends(get_jobs),
+        tenant: Tenant = Depends(get_tenant)
+):
+    job = await asyncio.to_thread(jobs.queue.get, job_id) if jobs is not None else None
+    if job is None or job['tenant'] != (None if tenant.is_default else tenant.name):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+async def _webhook_event(request: Request) -> WebhookEvent:
+    """
+    Triggers send their parameters as a JSON body, a form body or in the query string.
+    """
+    fields = {key: value for key, value in request.query_params.items() if key != 'secret'}
+    body = await request.body()
+    if body:
+        try:
+            if request.headers.get('content-type', '').startswith('application/json'):
+                fields.update(json_codec.loads(body))
+            else:
+                fields.update(parse_qsl(body.decode()))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Malformed webhook body")
+    try:
+        return WebhookEvent.model_validate(fields)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+
+
+@retail_router.post(
+    "/webhooks/retailcrm",
+    status_code=202,
+    summary="Change notification from a RetailCRM trigger",
+    description="Refreshes the cached customer and order lookups of the changed entity. The shared secret "
+                f"goes in the {WEBHOOK_SECRET_HEADER} header or the ``secret`` query parameter.",
+)
+async def retailcrm_webhook(
+        request: Request,
+        secret_header: Optional[str] = Header(None, alias=WEBHOOK_SECRET_HEADER),
+        secret: Optional[str] = Query(None),
+        webhooks: Optional[WebhookProcessor] = Depends(get_webhooks)
+):
+    if webhooks is None:
+        raise HTTPException(status_code=404, detail="Webhooks are not configured")
+    if not verify_secret(webhooks.secret, secret_header or secret):
+        raise HTTPException(status_code=403, detail="Invalid webhook secret")
+    webhooks.submit(await _webhook_event(request))
+    return {"success": True}
+
+
+@retail_router.get(
+    "/reference/{dictionary}",
+    summary="Reference dictionary from the local catalog",
+    description=f"One of {', '.join(DICTIONARIES)}, entries by code as RetailCRM returns them.",
+)
+async def get_reference(
+        dictionary: str,
+        catalog: Optional[Catalog] = Depends(get_catalog)
+):
+    if dictionary not in DICTIONARIES:
+        raise HTTPException(status_code=404, detail="Unknown dictionary")
+    entries = catalog.reference(dictionary) if catalog is not None else None
+    if entries is None:
+        raise HTTPException(status_code=503, detail="Catalog is not loaded")
+    return {"success": True, DICTIONARIES[dictionary]: entries}
+
+
+@retail_router.get("/client/stats", summary="Usage stats of the tenant's RetailCRM client")
+async def client_stats(
+        tenant: Tenant = Depends(get_tenant),
+        client: ApiClientRetailCRM = Depends(get_crm_client),
+        idempotency: Optional[IdempotencyStore] = Depends(get_idempotency),
+        jobs: Optional[JobRunner] = Depends(get_jobs),
+        webhooks: Optional[WebhookProcessor] = Depends(get_webhooks),
+        totals: TotalCountCache = Depends(get_page_totals),
+        catalog: Optional[Catalog] = Depends(get_catalog),
+        encoder: ResponseEncoder = Depends(get_encoder),
+        admission=Depends(get_admission)
+):
+    return {
+        "tenant": tenant.name,
+        "pool": client.pool_stats(),
+        "coalescing": client.coalescing_stats(),
+        "batching": client.batching_stats(),
+        "rate_limit": client.rate_limit_stats(),
+        "resilience": client.resilience_stats(),
+        "idempotency": {'enabled': True, **idempotency.stats()} if idempotency is not None else {'enabled': False},
+        "jobs": {'enabled': True, **jobs.stats()} if jobs is not None else {'enabled': False},
+        "webhooks": {'enabled': True, **webhooks.stats()} if webhooks is not None else {'enabled': False},
+        "page_totals": totals.stats(),
+        "catalog": {'enabled': True, **catalog.stats()} if catalog is not None else {'enabled': False},
+        "encoding": encoder.stats(),
+        "admission": {'enabled': True, **admission.stats()} if admission is not None else {'enabled': False},
+    }
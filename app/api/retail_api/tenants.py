@@ -0,0 +1,146 @@
+"""
+Several RetailCRM accounts served by one deployment
+"""
+import re
+
+from api.base_api import json_codec
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+from api.base_api.cache import ResponseCache
+from api.retail_api.catalog import Catalog
+from api.retail_api.idempotency import IdempotencyStore
+from api.retail_api.webhooks import WebhookProcessor
+
+# /t/{tenant}/... selects a tenant by path
+_TENANT_PATH = re.compile(r'/t/([A-Za-z0-9_-]+)(?=/|$)')
+
+
+class Tenant:
+    """
+    Everything bound to one RetailCRM account: a pooled client with its own
+    rate-limit budget, and cache and idempotency entries kept apart from
+    the other accounts.
+    """
+
+    def __init__(self, name: str, settings, is_default: bool = False):
+        self.name = name
+        self.settings = settings
+        self.is_default = is_default
+        # the default tenant keeps the namespaces of a single-account deployment
+        suffix = '' if is_default else f":{name}"
+        self.cache = ResponseCache.from_settings(settings, namespace=f"retailcrm{suffix}")
+        self.client = ApiClientRetailCRM.from_settings(settings, cache=self.cache, name=name)
+        self.idempotency = IdempotencyStore.from_settings(settings, namespace=f"idempotency{suffix}")
+        self.webhooks = WebhookProcessor.from_settings(self.client, settings)
+        self.catalog = Catalog.from_settings(self.client, settings)
+
+    @property
+    def site_code(self) -> str:
+        return self.settings.site_code
+
+    async def close(self) -> None:
+        if self.webhooks is not None:
+            await self.webhooks.close()
+        await self.client.close_client()
+        if self.cache is not None:
+            await self.cache.close()
+        if self.idempotency is not None:
+            await self.idempotency.close()
+
+
+class TenantRegistry:
+    """
+    The default tenant comes from the top-level settings, the others from
+    ``settings.tenants``; their unset fields fall back to the top-level ones.
+    """
+
+    def __init__(self, tenants: dict[str, Tenant], default: str):
+        self.tenants = tenants
+        self.default_name = default
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        :param settings: config.Settings
+        :return: TenantRegistry
+        """
+        tenants = {settings.default_tenant: Tenant(settings.default_tenant, settings, is_default=True)}
+        for name, config in settings.tenants.items():
+            if name == settings.default_tenant:
+                raise ValueError(f"Tenant {name!r} clashes with the default tenant")
+            overrides = config.model_dump(exclude_none=True)
+            tenants[name] = Tenant(name, settings.model_copy(update=overrides))
+        return cls(tenants, settings.default_tenant)
+
+    @property
+    def default(self) -> Tenant:
+        return self.tenants[self.default_name]
+
+    def get(self, name: str | None) -> Tenant | None:
+        """
+        :param name: tenant name, None for the default tenant
+        """
+        if name is None:
+            return self.default
+        return self.tenants.get(name)
+
+    def names(self) -> list[str]:
+        return list(self.tenants)
+
+    def catalogs(self) -> list[Catalog]:
+        return [tenant.catalog for tenant in self.tenants.values() if tenant.catalog is not None]
+
+    def tenant_clients(self) -> dict[str, ApiClientRetailCRM]:
+        """
+        :return: clients of the tenants other than the default one, by name
+        """
+        return {name: tenant.client for name, tenant in self.tenants.items() if not tenant.is_default}
+
+    async def close(self) -> None:
+        for tenant in self.tenants.values():
+            await tenant.close()
+
+
+class TenantMiddleware:
+    """
+    Picks the tenant of a request from a ``/t/{tenant}`` path prefix or from
+    ``header``, and stores its name in ``request.state.tenant``. The prefix
+    is moved into ``root_path``, so routes match as without it and
+    generated URLs keep it.
+    """
+
+    def __init__(self, app, header: str = 'X-Tenant'):
+        self.app = app
+        self.header = header.lower().encode('latin-1')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        registry: TenantRegistry = scope['app'].state.tenants
+        root_path = scope.get('root_path', '')
+        path = scope['path']
+        relative = path[len(root_path):] if root_path and path.startswith(root_path) else path
+        match = _TENANT_PATH.match(relative)
+        if match is not None:
+            name = match.group(1)
+            scope['root_path'] = root_path + match.group(0)
+        else:
+            name = next((value.decode('latin-1') for key, value in scope['headers'] if key == self.header), None)
+
+        tenant = registry.get(name)
+        if tenant is None:
+            await _not_found(send, name)
+            return
+        scope.setdefault('state', {})['tenant'] = tenant.name
+        await self.app(scope, receive, send)
+
+
+async def _not_found(send, name: str) -> None:
+    body = json_codec.dumps({'detail': f"Unknown tenant {name!r}"})
+    await send({
+        'type': 'http.response.start',
+        'status': 404,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,148 @@
+"""
+RetailCRM trigger callbacks that keep the response cache fresh
+"""
+import asyncio
+import hmac
+import logging
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_SECRET_HEADER = 'X-Webhook-Secret'
+
+CUSTOMER = 'customer'
+ORDER = 'order'
+
+
+class WebhookEvent(BaseModel):
+    """
+    What a trigger sends, e.g. ``entity=order&id={{ order.id }}&customerId={{ order.customer.id }}``
+    """
+    entity: Literal['customer', 'order']
+    id: Optional[int] = None
+    externalId: Optional[str] = None
+    customerId: Optional[int] = None
+    customerExternalId: Optional[str] = None
+    site: Optional[str] = None
+
+
+def verify_secret(expected: str, provided: str | None) -> bool:
+    """
+    Constant-time comparison of the shared secret
+    """
+    if not provided:
+        return False
+    return hmac.compare_digest(expected.encode(), provided.encode())
+
+
+class WebhookProcessor:
+    """
+    Turns change notifications into cache invalidations and refetches.
+
+    The first event for an entity opens a ``debounce`` window; events for
+    the same entity arriving within it are folded into that one update, so
+    a burst of callbacks costs a single refetch.
+    """
+
+    def __init__(self,
+                 client: ApiClientRetailCRM,
+                 secret: str,
+                 site_code: str,
+                 debounce: float = 1.0,
+                 refresh: bool = True):
+        self.client = client
+        self.secret = secret
+        self.site_code = site_code
+        self.debounce = debounce
+        self.refresh = refresh
+        self._pending: dict[tuple, asyncio.Task] = {}
+
+        self.received_total = 0
+        self.coalesced_total = 0
+        self.applied_total = 0
+        self.failed_total = 0
+
+    @classmethod
+    def from_settings(cls, client: ApiClientRetailCRM, settings):
+        """
+        :param client: ApiClientRetailCRM
+        :param settings: config.Settings
+        :return: WebhookProcessor or None when no secret is configured
+        :raise ValueError: the cache is per process and there are several workers
+        """
+        if not settings.webhook_secret:
+            return None
+        if settings.cache_backend == 'memory' and settings.workers > 1:
+            # a callback reaches one worker, the others would keep serving the stale entries
+            raise ValueError("Webhooks with several workers require cache_backend=redis")
+        return cls(
+            client,
+            secret=settings.webhook_secret,
+            site_code=settings.site_code,
+            debounce=settings.webhook_debounce,
+            refresh=settings.webhook_refresh,
+        )
+
+    def submit(self, event: WebhookEvent) -> None:
+        self.received_total += 1
+        site = event.site or self.site_code
+        if event.entity == CUSTOMER:
+            self._schedule((CUSTOMER, event.id, event.externalId, site))
+            return
+        self._schedule((ORDER, event.customerId, site))
+        if event.customerId is not None or event.customerExternalId:
+            # order totals are part of the customer record
+            self._schedule((CUSTOMER, event.customerId, event.customerExternalId, site))
+
+    def _schedule(self, key: tuple) -> None:
+        if key in self._pending:
+            self.coalesced_total += 1
+            return
+        self._pending[key] = asyncio.create_task(self._flush(key))
+
+    async def _flush(self, key: tuple) -> None:
+        await asyncio.sleep(self.debounce)
+        # events from now on describe newer changes and open a new window
+        self._pending.pop(key, None)
+        try:
+            await self._apply(key)
+            self.applied_total += 1
+        except Exception as e:
+            self.failed_total += 1
+            logger.error(f"Applying webhook for {key[0]} failed: {e}")
+
+    async def _apply(self, key: tuple) -> None:
+        if key[0] == CUSTOMER:
+            _, customer_id, external_id, site = key
+            await self.client.invalidate_customer(customer_id, external_id)
+            if not self.refresh:
+                return
+            if customer_id is not None:
+                await self.client.get_customer(customer_id, site=site, id_type='id')
+            elif external_id:
+                await self.client.get_customer(external_id, site=site, id_type='externalId')
+        else:
+            _, customer_id, site = key
+            await self.client.invalidate_customer_orders(customer_id)
+            if self.refresh and customer_id is not None:
+                await self.client.get_orders_by_customer(customer_id=customer_id, site=site)
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._pending),
+            'received_total': self.received_total,
+            'coalesced_total': self.coalesced_total,
+            'applied_total': self.applied_total,
+            'failed_total': self.failed_total,
+        }
+
+    async def close(self) -> None:
+        tasks = list(self._pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._pending.clear()
@@ -1,7 +1,7 @@
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
-from config.components import ComponentsConfig
+from config.components import ComponentsConfig, TenantConfig
 from config.constants import ENV_FILE_PATH
 from config.envs.development import DevelopmentConfig
 
@@ -24,6 +24,99 @@ class Settings(BaseSettings):
     base_url:  str = Field(..., env="BASE_URL")
     site_code: str = Field(..., env="SITE_CODE")
 
+    # further RetailCRM accounts, e.g. TENANTS='{"shop2": {"api_key": "...", "base_url": "...", "site_code": "..."}}'
+    tenants: dict[str, TenantConfig]   = {}
+    default_tenant: str                = "default"
+    tenant_header: str                 = "X-Tenant"
+
+    crm_max_connections: int           = 100
+    crm_max_keepalive_connections: int = 20
+    crm_keepalive_expiry: float        = 30.0
+    crm_connect_timeout: float         = 5.0
+    crm_read_timeout: float            = 30.0
+    crm_write_timeout: float           = 30.0
+    crm_pool_timeout: float            = 5.0
+    crm_http2: bool                    = False
+    json_backend: str                  = "auto"  # auto | orjson | stdlib
+    crm_coalesce_gets: bool            = True
+
+    crm_rate_limit: float              = 10.0  # requests/s per API key, 0 disables limiting
+    crm_rate_burst: int                = 10
+    crm_rate_limits: dict[str, float]  = {"list": 5.0, "lookup": 10.0, "write": 10.0}
+    crm_concurrency_initial: int       = 20
+    crm_concurrency_min: int           = 2
+    crm_concurrency_max: int           = 100
+    crm_latency_target: float          = 2.0
+    crm_queue_max: int                 = 1000
+    crm_queue_max_wait: float          = 5.0
+
+    crm_retry_attempts: int            = Field(3, ge=1)
+    crm_retry_base_delay: float        = 0.2
+    crm_retry_max_delay: float         = 5.0
+    crm_retry_max_retry_after: float   = 10.0
+    crm_breaker_failure_threshold: int = 5
+    crm_breaker_reset_timeout: float   = 30.0
+    crm_upload_concurrency: int        = 4
+    crm_orders_batch_window: float     = 0.0  # seconds order lookups are collected into one call, 0 disables
+    crm_orders_batch_size: int         = 50
+    orders_batch_max_items: int        = 5000
+    bulk_max_line_bytes: int           = 1048576  # longer import rows fail without being buffered
+    export_prefetch_pages: int         = Field(4, ge=1)
+    pagination_max_size: int           = 1000  # records per cursor page
+    pagination_concurrency: int        = 4  # upstream pages fetched at once for one page
+    pagination_total_ttl: float        = 60.0
+    pagination_total_max_entries: int  = 10000
+    overview_max_orders: int           = 500
+    compression_encodings: list[str]   = ["br", "gzip"]  # preference order, [] disables compression
+    compression_min_size: int          = 1024  # bytes, smaller bodies are sent uncompressed
+    compression_level: int             = 6  # gzip level 1-9, brotli quality 0-11
+
+    admission_enabled: bool            = True
+    admission_max_concurrency: int     = 200  # requests served at once per worker
+    admission_class_limits: dict[str, int] = {"checkout": 200, "write": 100, "read": 150, "bulk": 50}
+    admission_queue_max: int           = 500
+    admission_queue_timeouts: dict[str, float] = {"checkout": 10.0, "write": 5.0, "read": 2.0, "bulk": 0.5}
+
+    catalog_enabled: bool              = False  # check order offers and payment codes against a local copy
+    catalog_refresh_interval: float    = 600.0
+    catalog_lookup_limit: int          = 10  # RetailCRM lookups per payload for values missing from the copy
+    catalog_missing_ttl: float         = 60.0  # seconds values RetailCRM does not know are remembered
+
+    replica_enabled: bool              = False
+    replica_path: str                  = "replica.sqlite3"
+    replica_sync_interval: float       = 10.0
+    replica_max_staleness: float       = 60.0
+    replica_phone_country_code: str    = "7"
+
+    jobs_enabled: bool                 = False
+    jobs_path: str                     = "jobs.sqlite3"
+    jobs_workers: int                  = 2
+    jobs_batch_size: int               = 50
+    jobs_poll_interval: float          = 0.5
+    jobs_max_attempts: int             = 5
+    jobs_retry_base_delay: float       = 1.0
+    jobs_retry_max_delay: float        = 60.0
+    jobs_lease_timeout: float          = 60.0
+
+    webhook_secret: str | None         = None  # unset disables the webhook endpoint
+    webhook_debounce: float            = 1.0
+    webhook_refresh: bool              = True
+
+    idempotency_enabled: bool          = True
+    idempotency_ttl: float             = 86400.0
+    idempotency_max_entries: int       = 100000
+
+    tracing_enabled: bool              = False
+    tracing_exporter: str              = "otlp-file"  # otlp-file | memory
+    tracing_file_path: str             = "traces.jsonl"
+    tracing_sample_ratio: float        = 0.1
+
+    cache_backend: str                 = "memory"  # memory | redis | none
+    cache_ttl: float                   = 30.0
+    cache_stale_ttl: float             = 300.0
+    cache_max_entries: int             = 10000
+    cache_redis_url: str               = "redis://localhost:6379/0"
+
     model_config = SettingsConfigDict(
         env_file=str(ENV_FILE_PATH),
         env_file_encoding="utf-8",
@@ -1,4 +1,4 @@
-from pydantic import Field
+from pydantic import BaseModel, ConfigDict, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from config.constants import ENV_FILE_PATH
 
@@ -12,4 +12,26 @@ class ComponentsConfig(BaseSettings):
         env_file_encoding='utf-8',
     )
 
-__all__ = ["ComponentsConfig"]
\ No newline at end of file
+
+class TenantConfig(BaseModel):
+    """
+    One RetailCRM account served next to the default one. Unset optional
+    fields fall back to the top-level settings.
+    """
+    api_key:    str
+    base_url:   str
+    site_code:  str
+
+    crm_max_connections: int | None           = None
+    crm_max_keepalive_connections: int | None = None
+    crm_rate_limit: float | None              = None
+    crm_rate_burst: int | None                = None
+    crm_rate_limits: dict[str, float] | None  = None
+    crm_concurrency_max: int | None           = None
+    webhook_secret: str | None                = None
+    catalog_enabled: bool | None              = None
+
+    model_config = ConfigDict(extra='forbid')
+
+
+__all__ = ["ComponentsConfig", "TenantConfig"]
\ No newline at end of file
@@ -1,8 +1,10 @@
 from config import settings
+from observability import metrics
 import uvicorn
 
 
 def main():
+    metrics.reset_multiprocess_dir()
     uvicorn.run(
         app="server.server:app",
         host=settings.app_host,
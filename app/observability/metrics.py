@@ -0,0 +1,249 @@
+"""
+Prometheus metrics for inbound routes and outbound RetailCRM calls
+
+With several uvicorn workers set ``PROMETHEUS_MULTIPROC_DIR`` to an empty
+writable directory: every worker then writes its samples to mmap files
+there and /metrics aggregates all of them.
+"""
+import os
+import shutil
+import time
+from functools import lru_cache
+
+from fastapi import APIRouter, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+UNMATCHED_ROUTE = '<unmatched>'
+DEFAULT_TENANT = 'default'
+
+# path segments of RetailCRM endpoints that are not ids
+_ENDPOINT_ACTIONS = frozenset({
+    'create', 'edit', 'upload', 'history', 'combine', 'payments', 'delete',
+    'fix-external-ids', 'notes', 'links', 'statuses', 'corporate', 'customers', 'orders',
+    'offers', 'sites', 'payment-types', 'payment-statuses', 'order-types',
+})
+
+HTTP_REQUESTS = Counter(
+    'retailapi_http_requests_total',
+    'Requests served, by tenant, route and status class',
+    ['tenant', 'method', 'route', 'status_class'],
+)
+HTTP_LATENCY = Histogram(
+    'retailapi_http_request_duration_seconds',
+    'Time to serve a request, including streaming the body',
+    ['tenant', 'method', 'route'],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    'retailapi_http_requests_in_flight',
+    'Requests being served',
+    multiprocess_mode='livesum',
+)
+UPSTREAM_REQUESTS = Counter(
+    'retailapi_upstream_requests_total',
+    'Calls made to RetailCRM, by tenant, endpoint and status class',
+    ['tenant', 'method', 'endpoint', 'status_class'],
+)
+UPSTREAM_LATENCY = Histogram(
+    'retailapi_upstream_request_duration_seconds',
+    'Time RetailCRM took to answer a call',
+    ['tenant', 'method', 'endpoint'],
+    buckets=LATENCY_BUCKETS,
+)
+BATCH_SIZE = Histogram(
+    'retailapi_batch_size',
+    'Distinct keys per batched upstream call',
+    ['loader'],
+    buckets=(1, 2, 5, 10, 20, 50, 100),
+)
+BATCH_FILL = Histogram(
+    'retailapi_batch_fill_ratio',
+    'Batch size as a share of the largest batch allowed',
+    ['loader'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1.0),
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    'retailapi_upstream_requests_in_flight',
+    'Calls to RetailCRM waiting for an answer',
+    multiprocess_mode='livesum',
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    'retailapi_admission_in_flight',
+    'Admitted requests being served, by route class',
+    ['route_class'],
+    multiprocess_mode='livesum',
+)
+ADMISSION_QUEUED = Gauge(
+    'retailapi_admission_queued',
+    'Requests waiting for admission, by route class',
+    ['route_class'],
+    multiprocess_mode='livesum',
+)
+ADMISSION_QUEUE_TIME = Histogram(
+    'retailapi_admission_queue_seconds',
+    'Time a request waited for admission, by route class',
+    ['route_class'],
+    buckets=LATENCY_BUCKETS,
+)
+ADMISSION_SHED = Counter(
+    'retailapi_admission_shed_total',
+    'Requests answered with 503 instead of being served, by route class and reason',
+    ['route_class', 'reason'],
+)
+
+
+class _Children:
+    """
+    Caches labelled children; ``metric.labels()`` is the costly part of an observation.
+    """
+
+    def __init__(self, metric):
+        self.metric = metric
+        self._children = {}
+
+    def __call__(self, *labels):
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children[labels] = self.metric.labels(*labels)
+        return child
+
+
+_http_requests = _Children(HTTP_REQUESTS)
+_http_latency = _Children(HTTP_LATENCY)
+_upstream_requests = _Children(UPSTREAM_REQUESTS)
+_upstream_latency = _Children(UPSTREAM_LATENCY)
+_batch_size = _Children(BATCH_SIZE)
+_batch_fill = _Children(BATCH_FILL)
+_admission_queue_time = _Children(ADMISSION_QUEUE_TIME)
+_admission_shed = _Children(ADMISSION_SHED)
+
+
+def status_class(status_code: int | None) -> str:
+    """
+    :return: '2xx', '4xx', ... or 'error' when no response was received
+    """
+    if status_code is None:
+        return 'error'
+    return f"{status_code // 100}xx"
+
+
+@lru_cache(maxsize=1024)
+def endpoint_label(endpoint: str) -> str:
+    """
+    ``/customers/123`` -> ``/customers/{id}``, so ids do not become labels
+    """
+    segments = endpoint.strip('/').split('/')
+    templated = [segments[0]] + [s if s in _ENDPOINT_ACTIONS else '{id}' for s in segments[1:]]
+    return '/' + '/'.join(templated)
+
+
+def observe_request(tenant: str, method: str, route: str, status_code: int | None, duration: float) -> None:
+    _http_requests(tenant, method, route, status_class(status_code)).inc()
+    _http_latency(tenant, method, route).observe(duration)
+
+
+def observe_upstream(tenant: str, method: str, endpoint: str, status_code: int | None, duration: float) -> None:
+    label = endpoint_label(endpoint)
+    _upstream_requests(tenant, method, label, status_class(status_code)).inc()
+    _upstream_latency(tenant, method, label).observe(duration)
+
+
+def observe_batch(loader: str, size: int, capacity: int) -> None:
+    _batch_size(loader).observe(size)
+    _batch_fill(loader).observe(size / capacity)
+
+
+def observe_admission(route_class: str, queue_time: float) -> None:
+    _admission_queue_time(route_class).observe(queue_time)
+
+
+def observe_shed(route_class: str, reason: str) -> None:
+    _admission_shed(route_class, reason).inc()
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware, so streaming responses pass through untouched
+    and are timed until their last chunk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get('route')
+            observe_request(
+                scope.get('state', {}).get('tenant', DEFAULT_TENANT),
+                scope['method'],
+                getattr(route, 'path', UNMATCHED_ROUTE),
+                status_code,
+                time.perf_counter() - started,
+            )
+
+
+def render() -> bytes:
+    """
+    :return: metrics in the Prometheus text format, summed over all workers
+    """
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def reset_multiprocess_dir() -> None:
+    """
+    Remove samples left by previous runs; call once before the workers start.
+    """
+    if not MULTIPROC_DIR:
+        return
+    shutil.rmtree(MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+
+def mark_process_dead() -> None:
+    """
+    Drop the live gauges of this worker when it shuts down.
+    """
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+def get_metrics() -> Response:
+    return Response(render(), media_type=CONTENT_TYPE_LATEST)
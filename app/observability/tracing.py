@@ -0,0 +1,189 @@
+"""
+OpenTelemetry tracing of inbound routes and outbound RetailCRM calls
+
+Tracing is off until configure() is called from the lifespan; until then
+every helper here is a no-op. Incoming W3C ``traceparent`` headers are
+continued and outgoing RetailCRM calls carry one.
+"""
+import base64
+import threading
+from contextlib import nullcontext
+from typing import Sequence
+
+from google.protobuf.json_format import MessageToDict
+from opentelemetry.context import Context
+from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    SimpleSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind, Status, StatusCode, Tracer
+from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+from api.base_api import json_codec
+
+SERVICE_NAME = 'retailapi'
+
+_propagator = TraceContextTextMapPropagator()
+_provider: TracerProvider | None = None
+_tracer: Tracer | None = None
+_memory_exporter: InMemorySpanExporter | None = None
+
+
+class OTLPJsonFileExporter(SpanExporter):
+    """
+    Appends one OTLP/JSON ``ExportTraceServiceRequest`` per batch to a file,
+    the format read by the OpenTelemetry Collector ``otlpjsonfile`` receiver.
+    """
+
+    _ID_FIELDS = ('traceId', 'spanId', 'parentSpanId')
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _hex_ids(cls, span: dict) -> None:
+        # protobuf JSON encodes bytes as base64, OTLP/JSON wants hex ids
+        for item in [span, *span.get('links', [])]:
+            for field in cls._ID_FIELDS:
+                if item.get(field):
+                    item[field] = base64.b64decode(item[field]).hex()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        request = MessageToDict(encode_spans(spans))
+        for resource_spans in request.get('resourceSpans', []):
+            for scope_spans in resource_spans.get('scopeSpans', []):
+                for span in scope_spans.get('spans', []):
+                    self._hex_ids(span)
+        line = json_codec.dumps(request) + b'\n'
+        with self._lock, open(self.path, 'ab') as f:
+            f.write(line)
+        return SpanExportResult.SUCCESS
+
+
+def configure(settings) -> TracerProvider | None:
+    """
+    Start tracing as configured; call once per worker.
+
+    :param settings: config.Settings
+    :return: TracerProvider or None when tracing is disabled
+    """
+    global _provider, _tracer, _memory_exporter
+    if not settings.tracing_enabled:
+        return None
+
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(settings.tracing_sample_ratio)),
+    )
+    if settings.tracing_exporter == 'memory':
+        _memory_exporter = InMemorySpanExporter()
+        provider.add_span_processor(SimpleSpanProcessor(_memory_exporter))
+    elif settings.tracing_exporter == 'otlp-file':
+        provider.add_span_processor(BatchSpanProcessor(OTLPJsonFileExporter(settings.tracing_file_path)))
+    else:
+        raise ValueError(f"Unknown tracing exporter: {settings.tracing_exporter}")
+
+    _provider = provider
+    _tracer = provider.get_tracer(SERVICE_NAME)
+    return provider
+
+
+def shutdown() -> None:
+    """
+    Flush pending spans and turn tracing off.
+    """
+    global _provider, _tracer, _memory_exporter
+    if _provider is not None:
+        _provider.shutdown()
+    _provider = None
+    _tracer = None
+    _memory_exporter = None
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def finished_spans() -> list[ReadableSpan]:
+    """
+    :return: spans kept by the 'memory' exporter
+    """
+    if _memory_exporter is None:
+        return []
+    return list(_memory_exporter.get_finished_spans())
+
+
+def span(name: str, kind: SpanKind = SpanKind.INTERNAL, **attributes):
+    """
+    Child span of the current one, or a no-op context when tracing is off
+    """
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.start_as_current_span(name, kind=kind, attributes=attributes)
+
+
+def inject(headers: dict) -> dict:
+    """
+    :return: copy of ``headers`` with the W3C ``traceparent`` of the current span
+    """
+    if _tracer is None:
+        return headers
+    headers = dict(headers)
+    _propagator.inject(headers)
+    return headers
+
+
+def _extract(scope) -> Context:
+    carrier = {key.decode('latin-1'): value.decode('latin-1') for key, value in scope['headers']}
+    return _propagator.extract(carrier)
+
+
+class TracingMiddleware:
+    """
+    Server span per request, named after the route template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or _tracer is None:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        method = scope['method']
+        with _tracer.start_as_current_span(
+            method,
+            context=_extract(scope),
+            kind=SpanKind.SERVER,
+            attributes={'http.request.method': method, 'url.path': scope['path']},
+        ) as current:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = scope.get('route')
+                if route is not None:
+                    current.update_name(f"{method} {route.path}")
+                    current.set_attribute('http.route', route.path)
+                current.set_attribute('http.response.status_code', status_code)
+                tenant = scope.get('state', {}).get('tenant')
+                if tenant is not None:
+                    current.set_attribute('retailcrm.tenant', tenant)
+                if status_code >= 500:
+                    current.set_status(Status(StatusCode.ERROR))
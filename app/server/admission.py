@@ -0,0 +1,271 @@
+"""
+Admission control for the RetailCRM routes: per route class concurrency
+limits, a bounded priority queue, and 503 for the work that is shed
+"""
+import asyncio
+import math
+import re
+import time
+from collections import deque
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse
+
+from observability import metrics
+
+# route classes, highest priority first
+CHECKOUT = 'checkout'
+WRITE = 'write'
+READ = 'read'
+BULK = 'bulk'
+ROUTE_CLASSES = (CHECKOUT, WRITE, READ, BULK)
+
+# queue full: the request could not queue; evicted: a higher-priority one took its place;
+# timeout: it waited longer than its class allows
+QUEUE_FULL = 'queue_full'
+EVICTED = 'evicted'
+TIMEOUT = 'timeout'
+
+# /t/{tenant} prefix, admission happens before TenantMiddleware strips it
+_TENANT_PREFIX = re.compile(r'^/t/[A-Za-z0-9_-]+(?=/)')
+_CHECKOUT_PATHS = ('/orders', '/orders/payments')
+_BULK_WRITE_PATHS = ('/orders/batch', '/customers/batch')
+_BULK_PATHS = re.compile(r'^/(customers|customers/paged|customers/export|orders/export|customers/[^/]+/overview)/?$')
+# a customer list filtered by one of these, a page of at most _LOOKUP_MAX_LIMIT, is a lookup checkout depends on
+_LOOKUP_FILTERS = ('email', 'phone', 'externalId')
+_LOOKUP_MAX_LIMIT = 20
+
+
+def _is_lookup(query_string: str) -> bool:
+    params = parse_qs(query_string)
+    try:
+        limit = int(params.get('limit', ['20'])[0])
+    except ValueError:
+        return False
+    return limit <= _LOOKUP_MAX_LIMIT and any(params.get(name) for name in _LOOKUP_FILTERS)
+
+
+def classify_request(method: str, path: str, query_string: str = '') -> str:
+    """
+    :param path: path below the API prefix, e.g. ``/orders/payments``
+    :param query_string: e.g. ``email=a%40b.io``
+    :return: route class, one of ROUTE_CLASSES
+    """
+    if method != 'GET':
+        if method == 'POST' and path.rstrip('/') in _BULK_WRITE_PATHS:
+            return BULK
+        return CHECKOUT if method == 'POST' and path.rstrip('/') in _CHECKOUT_PATHS else WRITE
+    if path.rstrip('/') == '/customers' and _is_lookup(query_string):
+        return READ
+    if _BULK_PATHS.match(path):
+        return BULK
+    return READ
+
+
+class Overloaded(Exception):
+    def __init__(self, route_class: str, reason: str, retry_after: float):
+        super().__init__(f"Too many {route_class} requests ({reason}), retry later")
+        self.route_class = route_class
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    At most ``max_concurrency`` requests are served at once, and at most
+    ``limits[route_class]`` of one class. Requests over the limits wait
+    in one queue of ``queue_max`` shared by all classes; freed slots go
+    to the highest-priority waiter whose class has room. A request that
+    finds the queue full takes the place of the newest lower-priority
+    waiter, or is rejected. Waiters give up after ``timeouts[route_class]``
+    seconds, so low-priority work is shed early while checkouts wait
+    longest.
+    """
+
+    def __init__(self,
+                 max_concurrency: int = 200,
+                 limits: dict[str, int] | None = None,
+                 queue_max: int = 500,
+                 timeouts: dict[str, float] | None = None):
+        self.max_concurrency = max_concurrency
+        self.limits = {route_class: max_concurrency for route_class in ROUTE_CLASSES} | (limits or {})
+        self.queue_max = queue_max
+        self.timeouts = {route_class: 1.0 for route_class in ROUTE_CLASSES} | (timeouts or {})
+        self.in_flight = {route_class: 0 for route_class in ROUTE_CLASSES}
+        self._waiters: dict[str, deque[asyncio.Future]] = {route_class: deque() for route_class in ROUTE_CLASSES}
+        # moving average of the time requests hold a slot, for Retry-After
+        self._service_time = 0.1
+
+        self.admitted_total = {route_class: 0 for route_class in ROUTE_CLASSES}
+        self.shed_total = {route_class: 0 for route_class in ROUTE_CLASSES}
+        self.queue_time_total = {route_class: 0.0 for route_class in ROUTE_CLASSES}
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        :param settings: config.Settings
+        :return: AdmissionController or None when disabled
+        """
+        if not settings.admission_enabled:
+            return None
+        return cls(
+            max_concurrency=settings.admission_max_concurrency,
+            limits=settings.admission_class_limits,
+            queue_max=settings.admission_queue_max,
+            timeouts=settings.admission_queue_timeouts,
+        )
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def _has_room(self, route_class: str) -> bool:
+        return (sum(self.in_flight.values()) < self.max_concurrency
+                and self.in_flight[route_class] < self.limits[route_class])
+
+    def _retry_after(self) -> float:
+        # time for the slots to turn over once per queued request, at least a second
+        return min(60.0, max(1.0, self._service_time * (self.queued + 1) / self.max_concurrency))
+
+    def _shed(self, route_class: str, reason: str) -> Overloaded:
+        self.shed_total[route_class] += 1
+        metrics.observe_shed(route_class, reason)
+        return Overloaded(route_class, reason, self._retry_after())
+
+    def _evict_for(self, route_class: str) -> bool:
+        """
+        Make room in a full queue by shedding the newest waiter of the
+        lowest class below ``route_class``.
+        """
+        for lower in reversed(ROUTE_CLASSES[ROUTE_CLASSES.index(route_class) + 1:]):
+            waiters = self._waiters[lower]
+            while waiters:
+                future = waiters.pop()
+                if not future.done():
+                    future.set_exception(self._shed(lower, EVICTED))
+                    return True
+        return False
+
+    def _admit(self, route_class: str) -> None:
+        self.in_flight[route_class] += 1
+        self.admitted_total[route_class] += 1
+        metrics.ADMISSION_IN_FLIGHT.labels(route_class).inc()
+
+    async def acquire(self, route_class: str) -> None:
+        """
+        :raise Overloaded: the request is shed
+        """
+        # waiters of a higher class are only ever held back by their own class limit,
+        # so only waiters of the same class go first
+        if not self._waiters[route_class] and self._has_room(route_class):
+            self._admit(route_class)
+            metrics.observe_admission(route_class, 0.0)
+            return
+
+        if self.queued >= self.queue_max and not self._evict_for(route_class):
+            raise self._shed(route_class, QUEUE_FULL)
+
+        future = asyncio.get_running_loop().create_future()
+        waiters = self._waiters[route_class]
+        waiters.append(future)
+        queued_gauge = metrics.ADMISSION_QUEUED.labels(route_class)
+        queued_gauge.inc()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.timeouts[route_class])
+        except asyncio.TimeoutError:
+            raise self._shed(route_class, TIMEOUT)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._release_slot(route_class)
+            raise
+        finally:
+            queued_gauge.dec()
+            if future in waiters:
+                waiters.remove(future)
+            waited = time.perf_counter() - started
+            self.queue_time_total[route_class] += waited
+            metrics.observe_admission(route_class, waited)
+
+    def release(self, route_class: str, duration: float) -> None:
+        self._service_time += (duration - self._service_time) * 0.1
+        self._release_slot(route_class)
+
+    def _release_slot(self, route_class: str) -> None:
+        self.in_flight[route_class] -= 1
+        metrics.ADMISSION_IN_FLIGHT.labels(route_class).dec()
+        # hand freed slots to waiters, highest class first
+        for waiting_class in ROUTE_CLASSES:
+            waiters = self._waiters[waiting_class]
+            while waiters and self._has_room(waiting_class):
+                future = waiters.popleft()
+                if not future.done():
+                    self._admit(waiting_class)
+                    future.set_result(None)
+            if sum(self.in_flight.values()) >= self.max_concurrency:
+                return
+
+    def stats(self) -> dict:
+        return {
+            'max_concurrency': self.max_concurrency,
+            'queue_max': self.queue_max,
+            'classes': {
+                route_class: {
+                    'limit': self.limits[route_class],
+                    'queue_timeout': self.timeouts[route_class],
+                    'in_flight': self.in_flight[route_class],
+                    'queued': len(self._waiters[route_class]),
+                    'admitted_total': self.admitted_total[route_class],
+                    'shed_total': self.shed_total[route_class],
+                    'queue_time_total': self.queue_time_total[route_class],
+                }
+                for route_class in ROUTE_CLASSES
+            },
+        }
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware applying ``app.state.admission`` to the requests
+    under ``prefix``; other paths such as /metrics are never held back.
+    A slot is held until the response body is sent, streaming included.
+    """
+
+    def __init__(self, app, prefix: str = '/api/retailCRM'):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        admission: AdmissionController | None = getattr(scope['app'].state, 'admission', None)
+        if scope['type'] != 'http' or admission is None:
+            await self.app(scope, receive, send)
+            return
+
+        root_path = scope.get('root_path', '')
+        path = scope['path']
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        path = _TENANT_PREFIX.sub('', path, count=1)
+        if not path.startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        route_class = classify_request(
+            scope['method'], path[len(self.prefix):], scope.get('query_string', b'').decode('latin-1'),
+        )
+        try:
+            await admission.acquire(route_class)
+        except Overloaded as e:
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": str(e)},
+                headers={'Retry-After': str(math.ceil(e.retry_after))},
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release(route_class, time.perf_counter() - started)
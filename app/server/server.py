@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
@@ -7,9 +8,19 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi_pagination import add_pagination
 
 from config import settings
-from server.utils.exception_handler import validation_exception_handler
-
+from api.base_api.exceptions import UpstreamUnavailableError
+from api.jobs.worker import JobRunner
+from api.replica.store import ReplicaStore
+from api.replica.sync import HistorySync
+from server.admission import AdmissionController, AdmissionMiddleware
+from server.utils.exception_handler import validation_exception_handler, upstream_unavailable_handler
+
+from api.base_api import json_codec
+from api.retail_api.conditional import ResponseEncoder
+from api.retail_api.pagination import TotalCountCache
 from api.retail_api.retail_api import retail_router
+from api.retail_api.tenants import TenantMiddleware, TenantRegistry
+from observability import metrics, tracing
 
 
 def _init_router(app: FastAPI) -> None:
@@ -18,9 +29,14 @@ def _init_router(app: FastAPI) -> None:
         prefix="/api/retailCRM",
         tags=["RetailCRM"]
     )
+    app.include_router(metrics.metrics_router)
 
 
 def _init_middleware(app: FastAPI) -> None:
+    app.add_middleware(TenantMiddleware, header=settings.tenant_header)
+    # inside CORS, so shed 503s carry CORS headers and preflights are never shed;
+    # inside metrics, so they are counted
+    app.add_middleware(AdmissionMiddleware, prefix="/api/retailCRM")
     app.add_middleware(
         CORSMiddleware,
         allow_origins=settings.cors_origins,
@@ -28,6 +44,8 @@ def _init_middleware(app: FastAPI) -> None:
         allow_methods=settings.cors_allow_methods,
         allow_headers=settings.cors_allow_headers,
     )
+    app.add_middleware(tracing.TracingMiddleware)
+    app.add_middleware(metrics.MetricsMiddleware)
 
 
 def _init_exception_handlers(app: FastAPI) -> None:
@@ -35,6 +53,10 @@ def _init_exception_handlers(app: FastAPI) -> None:
         RequestValidationError,
         validation_exception_handler,
     )
+    app.add_exception_handler(
+        UpstreamUnavailableError,
+        upstream_unavailable_handler,
+    )
 
 
 def _init_pagination(app: FastAPI) -> None:
@@ -45,10 +67,49 @@ def _init_pagination(app: FastAPI) -> None:
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     _init_router(app)
     _init_pagination(app)
-    yield
+    tracing.configure(settings)
+    app.state.tenants = TenantRegistry.from_settings(settings)
+    default = app.state.tenants.default
+    app.state.crm_cache = default.cache
+    app.state.crm_client = default.client
+    app.state.idempotency = default.idempotency
+    app.state.webhooks = default.webhooks
+    app.state.page_totals = TotalCountCache.from_settings(settings)
+    app.state.encoder = ResponseEncoder.from_settings(settings)
+    app.state.admission = AdmissionController.from_settings(settings)
+    background: list[asyncio.Task] = [
+        asyncio.create_task(catalog.run()) for catalog in app.state.tenants.catalogs()
+    ]
+
+    app.state.jobs = JobRunner.from_settings(
+        app.state.crm_client, settings, tenant_clients=app.state.tenants.tenant_clients()
+    )
+    if app.state.jobs is not None:
+        background.extend(app.state.jobs.start())
+
+    app.state.replica = None
+    if settings.replica_enabled:
+        app.state.replica = ReplicaStore(settings.replica_path, phone_country_code=settings.replica_phone_country_code)
+        sync = HistorySync(app.state.crm_client, app.state.replica, interval=settings.replica_sync_interval)
+        background.append(asyncio.create_task(sync.run()))
+
+    try:
+        yield
+    finally:
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        if app.state.replica is not None:
+            app.state.replica.close()
+        if app.state.jobs is not None:
+            app.state.jobs.close()
+        await app.state.tenants.close()
+        tracing.shutdown()
+        metrics.mark_process_dead()
 
 
 def create_app() -> FastAPI:
+    json_codec.use_backend(settings.json_backend)
     app = FastAPI(
         title="Hide",
         description="Hide API",
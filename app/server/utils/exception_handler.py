@@ -1,7 +1,10 @@
+import math
+
 from fastapi.exceptions import RequestValidationError
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 
+from api.base_api.exceptions import UpstreamUnavailableError
 from server.utils.i18n import translate_error
 
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -16,4 +19,16 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     return JSONResponse(
         status_code=422,
         content={"detail": translated_errors}
-    )
\ No newline at end of file
+    )
+
+
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailableError):
+    headers = {}
+    if exc.retry_after is not None:
+        headers['Retry-After'] = str(max(1, math.ceil(exc.retry_after)))
+
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers=headers,
+    )
@@ -0,0 +1,76 @@
+"""
+Micro-benchmark of Response parsing strategies on a /customers page.
+
+    PYTHONPATH=app python benchmarks/bench_response.py [--records 100] [--rounds 200]
+
+Compares a full parse (get_response) with the incremental accessor
+(iter_items) for time and peak allocated memory (tracemalloc), and reports
+the per-instance size of a Response.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from api.base_api.response import Response
+
+
+def make_page(records: int) -> bytes:
+    customers = [{
+        "id": i,
+        "externalId": f"ext-{i}",
+        "firstName": "Ivan",
+        "lastName": f"Petrov {i}",
+        "email": f"ivan{i}@example.com",
+        "phones": [{"number": f"+7900{i:07d}"}],
+        "address": {"city": "Moscow", "text": "Tverskaya st. 1"},
+        "customFields": {"segment": "b2c", "tags": ["vip", "newsletter"]},
+        "createdAt": "2024-01-01 12:00:00",
+    } for i in range(records)]
+    return json.dumps({
+        "success": True,
+        "pagination": {"limit": records, "totalCount": records, "currentPage": 1, "totalPageCount": 1},
+        "customers": customers,
+    }).encode()
+
+
+def full_parse(raw: bytes) -> int:
+    return sum(1 for _ in Response(200, raw=raw).get_response()["customers"])
+
+
+def incremental(raw: bytes) -> int:
+    return sum(1 for _ in Response(200, raw=raw).iter_items("customers"))
+
+
+def measure(fn, raw: bytes, rounds: int) -> dict:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(raw)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    fn(raw)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'us_per_page': round(elapsed / rounds * 1e6, 1), 'peak_kib': round(peak / 1024, 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    raw = make_page(args.records)
+    result = {
+        'page_bytes': len(raw),
+        'response_instance_bytes': sys.getsizeof(Response(200, raw=raw)),
+        'full_parse': measure(full_parse, raw, args.rounds),
+        'iter_items': measure(incremental, raw, args.rounds),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
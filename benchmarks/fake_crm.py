@@ -0,0 +1,269 @@
+"""
+Local RetailCRM simulator for benchmarks.
+
+    python benchmarks/fake_crm.py --port 9100 --latency 0.05 --jitter 0.02 --error-rate 0.01 --rate-limit 10
+
+Serves the /api/v5 endpoints used by ApiClientRetailCRM over a generated
+data set, with configurable latency, error rate and a per-API-key rate
+limit answered like RetailCRM does (503 + Retry-After). Call counters are
+available at GET /_stats and are cleared by POST /_reset.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+API = '/api/v5'
+ORDERS_PER_CUSTOMER = 3
+
+
+class Simulator:
+    def __init__(self,
+                 customers: int = 1000,
+                 latency: float = 0.05,
+                 jitter: float = 0.0,
+                 error_rate: float = 0.0,
+                 rate_limit: float = 0.0,
+                 burst: int = 10,
+                 seed: int = 1):
+        self.customers = customers
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.random = random.Random(seed)
+        self.buckets: dict[str, tuple[float, float]] = {}
+        self.next_id = customers * ORDERS_PER_CUSTOMER + 1
+        self.reset()
+
+    def reset(self) -> None:
+        self.calls: Counter = Counter()
+        self.errors = 0
+        self.rate_limited = 0
+
+    def stats(self) -> dict:
+        return {
+            'total': sum(self.calls.values()),
+            'calls': dict(self.calls),
+            'errors': self.errors,
+            'rate_limited': self.rate_limited,
+        }
+
+    @staticmethod
+    def customer(i: int) -> dict:
+        return {
+            'id': i,
+            'externalId': f'ext-{i}',
+            'firstName': 'Ivan',
+            'lastName': f'Petrov {i}',
+            'email': f'ivan{i}@example.com',
+            'phones': [{'number': f'+7900{i:07d}'}],
+            'createdAt': '2024-01-01 12:00:00',
+            'site': 'bench',
+        }
+
+    @staticmethod
+    def order(i: int) -> dict:
+        customer_id = (i - 1) // ORDERS_PER_CUSTOMER + 1
+        return {
+            'id': i,
+            'externalId': f'order-{i}',
+            'customer': {'id': customer_id},
+            'items': [{'quantity': 1, 'offer': {'id': 100 + i % 50}, 'initialPrice': 990}],
+            'totalSumm': 990,
+            'createdAt': '2024-01-02 12:00:00',
+            'site': 'bench',
+        }
+
+    def _take_token(self, api_key: str) -> bool:
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(api_key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate_limit)
+        if tokens < 1:
+            self.buckets[api_key] = (tokens, now)
+            return False
+        self.buckets[api_key] = (tokens - 1, now)
+        return True
+
+    async def admit(self, request: Request, name: str) -> JSONResponse | None:
+        """
+        :return: an error response, or None when the call goes through
+        """
+        self.calls[name] += 1
+        if not self._take_token(request.headers.get('X-API-KEY', '')):
+            self.rate_limited += 1
+            return JSONResponse({'success': False, 'errorMsg': 'Limit of requests exceeded'},
+                                status_code=503, headers={'Retry-After': '1'})
+        delay = self.random.gauss(self.latency, self.jitter) if self.jitter else self.latency
+        await asyncio.sleep(max(delay, 0.0))
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            return JSONResponse({'success': False, 'errorMsg': 'Service temporarily unavailable'}, status_code=503)
+        return None
+
+    def allocate_id(self) -> int:
+        self.next_id += 1
+        return self.next_id
+
+
+def _page(request: Request) -> tuple[int, int]:
+    limit = int(request.query_params.get('limit', 20))
+    page = int(request.query_params.get('page', 1))
+    return max(limit, 1), max(page, 1)
+
+
+def _pagination(limit: int, page: int, total: int) -> dict:
+    return {
+        'limit': limit,
+        'totalCount': total,
+        'currentPage': page,
+        'totalPageCount': max((total + limit - 1) // limit, 1),
+    }
+
+
+async def _form(request: Request) -> dict:
+    body = (await request.body()).decode()
+    return {key: values[-1] for key, values in parse_qs(body).items()}
+
+
+def create_app(sim: Simulator) -> Starlette:
+    async def list_customers(request: Request):
+        if (error := await sim.admit(request, 'GET /customers')) is not None:
+            return error
+        limit, page = _page(request)
+        first = (page - 1) * limit + 1
+        ids = range(first, min(first + limit, sim.customers + 1))
+        return JSONResponse({
+            'success': True,
+            'pagination': _pagination(limit, page, sim.customers),
+            'customers': [sim.customer(i) for i in ids],
+        })
+
+    async def get_customer(request: Request):
+        if (error := await sim.admit(request, 'GET /customers/{id}')) is not None:
+            return error
+        raw = request.path_params['customer_id']
+        by = request.query_params.get('by', 'externalId')
+        customer_id = int(raw.removeprefix('ext-')) if by == 'externalId' and raw.startswith('ext-') else raw
+        try:
+            customer_id = int(customer_id)
+        except ValueError:
+            customer_id = 0
+        if not 1 <= customer_id <= sim.customers:
+            return JSONResponse({'success': False, 'errorMsg': 'Not found'}, status_code=404)
+        return JSONResponse({'success': True, 'customer': sim.customer(customer_id)})
+
+    async def list_orders(request: Request):
+        if (error := await sim.admit(request, 'GET /orders')) is not None:
+            return error
+        limit, page = _page(request)
+        params = request.query_params
+        customer_ids = [int(v) for v in params.getlist('filter[customerIds][]')]
+        if params.get('filter[customerId]'):
+            customer_ids.append(int(params['filter[customerId]']))
+        if customer_ids:
+            ids = [
+                (customer_id - 1) * ORDERS_PER_CUSTOMER + n + 1
+                for customer_id in customer_ids if 1 <= customer_id <= sim.customers
+                for n in range(ORDERS_PER_CUSTOMER)
+            ]
+        else:
+            ids = range(1, sim.customers * ORDERS_PER_CUSTOMER + 1)
+        total = len(ids)
+        selected = ids[(page - 1) * limit:page * limit]
+        return JSONResponse({
+            'success': True,
+            'pagination': _pagination(limit, page, total),
+            'orders': [sim.order(i) for i in selected],
+        })
+
+    async def create_customer(request: Request):
+        if (error := await sim.admit(request, 'POST /customers/create')) is not None:
+            return error
+        await _form(request)
+        return JSONResponse({'success': True, 'id': sim.allocate_id()}, status_code=201)
+
+    async def create_order(request: Request):
+        if (error := await sim.admit(request, 'POST /orders/create')) is not None:
+            return error
+        order = json.loads((await _form(request)).get('order', '{}'))
+        order_id = sim.allocate_id()
+        return JSONResponse({'success': True, 'id': order_id, 'order': {**order, 'id': order_id}}, status_code=201)
+
+    async def create_payment(request: Request):
+        if (error := await sim.admit(request, 'POST /orders/payments/create')) is not None:
+            return error
+        await _form(request)
+        return JSONResponse({'success': True, 'id': sim.allocate_id()}, status_code=201)
+
+    def upload(entity: str, field: str):
+        async def handler(request: Request):
+            if (error := await sim.admit(request, f'POST /{entity}/upload')) is not None:
+                return error
+            items = json.loads((await _form(request)).get(entity, '[]'))
+            uploaded = [{'id': sim.allocate_id(), 'externalId': item.get('externalId')} for item in items]
+            return JSONResponse({'success': True, field: uploaded}, status_code=201)
+        return handler
+
+    def history(entity: str):
+        async def handler(request: Request):
+            if (error := await sim.admit(request, f'GET /{entity}/history')) is not None:
+                return error
+            return JSONResponse({'success': True, 'history': [], 'pagination': _pagination(100, 1, 0)})
+        return handler
+
+    async def stats(request: Request):
+        return JSONResponse(sim.stats())
+
+    async def reset(request: Request):
+        sim.reset()
+        return JSONResponse({'success': True})
+
+    return Starlette(routes=[
+        Route(f'{API}/customers', list_customers),
+        Route(f'{API}/customers/create', create_customer, methods=['POST']),
+        Route(f'{API}/customers/upload', upload('customers', 'uploadedCustomers'), methods=['POST']),
+        Route(f'{API}/customers/history', history('customers')),
+        Route(f'{API}/customers/{{customer_id}}', get_customer),
+        Route(f'{API}/orders', list_orders),
+        Route(f'{API}/orders/create', create_order, methods=['POST']),
+        Route(f'{API}/orders/upload', upload('orders', 'uploadedOrders'), methods=['POST']),
+        Route(f'{API}/orders/payments/create', create_payment, methods=['POST']),
+        Route(f'{API}/orders/history', history('orders')),
+        Route('/_stats', stats),
+        Route('/_reset', reset, methods=['POST']),
+    ])
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help='mean seconds per call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='standard deviation of the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of calls answered with 503')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='calls/s per API key, 0 disables')
+    parser.add_argument('--burst', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    sim = Simulator(customers=args.customers, latency=args.latency, jitter=args.jitter,
+                    error_rate=args.error_rate, rate_limit=args.rate_limit, burst=args.burst)
+    uvicorn.run(create_app(sim), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
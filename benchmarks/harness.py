@@ -0,0 +1,280 @@
+"""
+Load test of the real app against the local RetailCRM simulator.
+
+    python benchmarks/harness.py --workers 4 --concurrency 32 --duration 10 --output baseline.json
+    python benchmarks/harness.py --workers 4 --concurrency 32 --duration 10 --baseline baseline.json
+
+Starts benchmarks/fake_crm.py and the app under uvicorn with several
+workers, runs every scenario for ``--duration`` seconds and prints one JSON
+document with RPS, latency percentiles and RetailCRM call counts per
+scenario. No baseline is shipped: numbers depend on the machine, so save
+one with ``--output`` first. With ``--baseline`` the run is compared against
+that saved result and the exit code is 1 when a metric regressed by more
+than ``--tolerance``.
+Extra app settings are passed as ``--env NAME=VALUE``.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+API = '/api/retailCRM'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+# -- scenarios: one request each, returning True on success --
+
+async def customer_lookup(client: httpx.AsyncClient, args) -> bool:
+    # a small hot set, like repeated checkout lookups
+    customer_id = random.randint(1, max(args.customers // 20, 1))
+    response = await client.get(f'{API}/customers/{customer_id}', params={'by': 'id'})
+    return response.status_code == 200
+
+
+async def list_pagination(client: httpx.AsyncClient, args) -> bool:
+    page = random.randint(1, max(args.customers // 20, 1))
+    response = await client.get(f'{API}/customers', params={'limit': 20, 'page': page})
+    return response.status_code == 200
+
+
+async def order_create_burst(client: httpx.AsyncClient, args) -> bool:
+    response = await client.post(f'{API}/orders', json={
+        'customerId': random.randint(1, args.customers),
+        'externalId': f'bench-{time.time_ns()}-{random.random()}',
+        'items': [{'quantity': 1, 'offerId': random.randint(1, 50)}],
+    })
+    return response.status_code in (200, 201)
+
+
+async def bulk_export(client: httpx.AsyncClient, args) -> bool:
+    ok = True
+    async with client.stream('GET', f'{API}/orders/export') as response:
+        async for line in response.aiter_lines():
+            if line.startswith('{"@error"'):
+                ok = False
+    return ok and response.status_code == 200
+
+
+SCENARIOS = {
+    'customer_lookup': customer_lookup,
+    'list_pagination': list_pagination,
+    'order_create_burst': order_create_burst,
+    'bulk_export': bulk_export,
+}
+
+
+async def run_scenario(name: str, app_url: str, crm_url: str, args) -> dict:
+    scenario = SCENARIOS[name]
+    latencies: list[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=120) as client, \
+            httpx.AsyncClient(base_url=crm_url) as crm:
+        await crm.post('/_reset')
+        deadline = time.perf_counter() + args.duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    ok = await scenario(client, args)
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                errors += not ok
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        upstream = (await crm.get('/_stats')).json()
+
+    latencies.sort()
+    requests = len(latencies)
+    return {
+        'requests': requests,
+        'errors': errors,
+        'rps': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'upstream_calls': upstream['total'],
+        'upstream_calls_per_request': round(upstream['total'] / requests, 3) if requests else 0.0,
+        'upstream_rate_limited': upstream['rate_limited'],
+        'upstream_errors': upstream['errors'],
+    }
+
+
+# metric -> True when higher is better
+COMPARED = {
+    'rps': True,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'upstream_calls_per_request': False,
+}
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list[str]:
+    """
+    :return: one line per metric that is more than ``tolerance`` worse than the baseline
+    """
+    regressions = []
+    for name, result in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{name}.{metric}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def wait_until_up(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up in {timeout}s")
+
+
+def start_processes(args) -> tuple[list[subprocess.Popen], str, str]:
+    crm_port, app_port = free_port(), free_port()
+    crm = subprocess.Popen([
+        sys.executable, str(ROOT / 'benchmarks' / 'fake_crm.py'),
+        '--port', str(crm_port),
+        '--customers', str(args.customers),
+        '--latency', str(args.latency),
+        '--jitter', str(args.jitter),
+        '--error-rate', str(args.error_rate),
+        '--rate-limit', str(args.rate_limit),
+    ])
+    crm_url = f'http://127.0.0.1:{crm_port}'
+
+    env = {
+        **os.environ,
+        'PYTHONPATH': str(ROOT / 'app'),
+        'APP_PORT': str(app_port),
+        'WORKERS': str(args.workers),
+        'API_KEY': 'bench',
+        'BASE_URL': crm_url,
+        'SITE_CODE': 'bench',
+        'RELOAD': 'false',
+    }
+    for item in args.env:
+        name, _, value = item.partition('=')
+        env[name] = value
+    app = subprocess.Popen([
+        sys.executable, '-m', 'uvicorn', 'server.server:app',
+        '--host', '127.0.0.1', '--port', str(app_port),
+        '--workers', str(args.workers), '--log-level', 'warning',
+    ], env=env, cwd=str(ROOT))
+    app_url = f'http://127.0.0.1:{app_port}'
+
+    processes = [crm, app]
+    try:
+        wait_until_up(crm_url + '/_stats')
+        wait_until_up(app_url + '/metrics')
+    except RuntimeError:
+        stop_processes(processes)
+        raise
+    return processes, app_url, crm_url
+
+
+def stop_processes(processes: list[subprocess.Popen]) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per scenario')
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0)
+    parser.add_argument('--env', action='append', default=[], help='app setting as NAME=VALUE')
+    parser.add_argument('--output', help='also write the result to this file')
+    parser.add_argument('--baseline', help='result file written earlier with --output to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    names = [name for name in args.scenarios.split(',') if name]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.baseline and not Path(args.baseline).is_file():
+        parser.error(f"baseline {args.baseline} not found, create it with --output first")
+
+    processes, app_url, crm_url = start_processes(args)
+    try:
+        scenarios = {name: asyncio.run(run_scenario(name, app_url, crm_url, args)) for name in names}
+    finally:
+        stop_processes(processes)
+
+    result = {
+        'meta': {
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'rate_limit': args.rate_limit,
+            'env': args.env,
+        },
+        'scenarios': scenarios,
+    }
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+
+    if args.baseline:
+        regressions = compare(json.loads(Path(args.baseline).read_text()), result, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
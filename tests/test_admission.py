@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from server.admission import (
+    BULK, CHECKOUT, EVICTED, QUEUE_FULL, READ, TIMEOUT, WRITE, AdmissionController, Overloaded, classify_request,
+)
+from server.server import app
+
+
+def test_requests_are_classified_by_method_and_path():
+    assert classify_request("POST", "/orders") == CHECKOUT
+    assert classify_request("POST", "/orders/payments") == CHECKOUT
+    assert classify_request("POST", "/orders/batch") == BULK
+    assert classify_request("POST", "/customers/batch/") == BULK
+    assert classify_request("POST", "/customers") == WRITE
+    assert classify_request("GET", "/customers") == BULK
+    assert classify_request("GET", "/customers", "email=ann%40example.com") == READ
+    assert classify_request("GET", "/customers", "phone=79123456789&limit=20") == READ
+    assert classify_request("GET", "/customers", "email=ann%40example.com&limit=100") == BULK
+    assert classify_request("GET", "/customers", "name=Ann&limit=5") == BULK
+    assert classify_request("GET", "/orders/export") == BULK
+    assert classify_request("GET", "/customers/7/overview") == BULK
+    assert classify_request("GET", "/customers/7") == READ
+
+
+def test_freed_slots_go_to_the_highest_class_first():
+    async def scenario():
+        admission = AdmissionController(max_concurrency=1, timeouts={BULK: 1.0, CHECKOUT: 1.0})
+        await admission.acquire(READ)
+        order = []
+
+        async def request(route_class):
+            await admission.acquire(route_class)
+            order.append(route_class)
+            admission.release(route_class, 0.01)
+
+        waiting = [asyncio.create_task(request(BULK)), asyncio.create_task(request(CHECKOUT))]
+        await asyncio.sleep(0)
+        assert admission.stats()["classes"][BULK]["queued"] == 1
+        admission.release(READ, 0.01)
+        await asyncio.gather(*waiting)
+        return order
+
+    assert asyncio.run(scenario()) == [CHECKOUT, BULK]
+
+
+def test_low_priority_waiters_are_shed_first():
+    async def scenario():
+        admission = AdmissionController(max_concurrency=1, queue_max=1, timeouts={BULK: 5.0})
+        await admission.acquire(WRITE)
+        bulk = asyncio.create_task(admission.acquire(BULK))
+        await asyncio.sleep(0)
+        checkout = asyncio.create_task(admission.acquire(CHECKOUT))
+        await asyncio.sleep(0)
+        (evicted,) = await asyncio.gather(bulk, return_exceptions=True)
+        with pytest.raises(Overloaded) as queue_full:
+            await admission.acquire(READ)
+        admission.release(WRITE, 0.01)
+        await checkout
+        return evicted, queue_full.value, admission.stats()
+
+    evicted, queue_full, stats = asyncio.run(scenario())
+    assert isinstance(evicted, Overloaded) and evicted.reason == EVICTED
+    # a read cannot take the place of the queued checkout
+    assert queue_full.reason == QUEUE_FULL
+    assert stats["classes"][CHECKOUT]["in_flight"] == 1
+    assert stats["classes"][BULK]["shed_total"] == 1
+
+
+def test_overloaded_routes_answer_503_and_metrics_stay_up():
+    with TestClient(app) as test_client:
+        admission = AdmissionController(max_concurrency=1, timeouts={BULK: 0.01})
+        app.state.admission = admission
+        test_client.portal.call(admission.acquire, READ)
+        before = REGISTRY.get_sample_value(
+            "retailapi_admission_shed_total", {"route_class": BULK, "reason": TIMEOUT}) or 0.0
+
+        shed = test_client.get("/api/retailCRM/customers", headers={"Origin": "https://shop.test"})
+        scraped = test_client.get("/metrics")
+        stats_blocked = admission.stats()["classes"][READ]["in_flight"]
+        admission.release(READ, 0.01)
+
+    assert shed.status_code == 503
+    assert int(shed.headers["Retry-After"]) >= 1
+    assert shed.headers["Access-Control-Allow-Origin"]
+    assert scraped.status_code == 200
+    assert stats_blocked == 1
+    assert REGISTRY.get_sample_value(
+        "retailapi_admission_shed_total", {"route_class": BULK, "reason": TIMEOUT}) == before + 1
@@ -0,0 +1,80 @@
+import asyncio
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+from api.base_api.batching import BatchLoader
+from api.base_api.cache import MemoryCacheBackend, ResponseCache
+
+
+def test_loads_within_the_window_share_one_batch():
+    batches = []
+
+    async def batch_fn(group, keys):
+        batches.append((group, keys))
+        return {key: key * 10 for key in keys}
+
+    async def scenario():
+        loader = BatchLoader(batch_fn, "test", window=0.01, max_batch=3)
+        results = await asyncio.gather(*(loader.load("g", key) for key in (1, 2, 2, 3, 4)))
+        await loader.close()
+        return results, loader.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results == [10, 20, 20, 30, 40]
+    # the third distinct key fills the first batch, the fourth waits for the window
+    assert batches == [("g", [1, 2, 3]), ("g", [4])]
+    assert stats["loads_total"] == 5 and stats["keys_total"] == 4
+    assert stats["fill_ratio"] == pytest.approx(4 / 6)
+
+
+def test_batch_failure_reaches_every_caller():
+    async def batch_fn(group, keys):
+        raise RuntimeError("upstream down")
+
+    async def scenario():
+        loader = BatchLoader(batch_fn, "test", window=0.001)
+        return await asyncio.gather(loader.load("g", 1), loader.load("g", 2), return_exceptions=True)
+
+    assert [str(e) for e in asyncio.run(scenario())] == ["upstream down", "upstream down"]
+
+
+def test_order_lookups_of_several_customers_become_one_call():
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url)
+        ids = [int(i) for i in request.url.params.get_list("filter[customerIds][]")]
+        orders = [{"id": 100 + i, "customer": {"id": i % 3 + 1}} for i in range(9) if i % 3 + 1 in ids]
+        return httpx.Response(200, json={
+            "success": True,
+            "orders": orders,
+            "pagination": {"limit": 100, "totalCount": len(orders), "currentPage": 1, "totalPageCount": 1},
+        })
+
+    async def scenario():
+        client = ApiClientRetailCRM(
+            "https://crm.test", "key", cache=ResponseCache(MemoryCacheBackend()),
+            orders_batch_window=0.01, transport=httpx.MockTransport(handler),
+        )
+        try:
+            first = await asyncio.gather(*(
+                client.get_orders_by_customer(customer_id, site="s", limit=2) for customer_id in (1, 2, 3)
+            ))
+            again = await client.get_orders_by_customer(2, site="s", limit=2)
+            return first, again
+        finally:
+            await client.close_client()
+
+    before = REGISTRY.get_sample_value("retailapi_batch_size_sum", {"loader": "orders_by_customer"}) or 0.0
+    (one, two, three), again = asyncio.run(scenario())
+
+    assert len(calls) == 1
+    assert sorted(calls[0].params.get_list("filter[customerIds][]")) == ["1", "2", "3"]
+    assert [o["id"] for o in two.get_response()["orders"]] == [101, 104]
+    assert two.get_response()["pagination"] == {"limit": 2, "totalCount": 3, "currentPage": 1, "totalPageCount": 2}
+    assert {o["customer"]["id"] for o in one.get_response()["orders"]} == {1}
+    assert again.cache_status == "HIT"
+    assert REGISTRY.get_sample_value("retailapi_batch_size_sum", {"loader": "orders_by_customer"}) == before + 3
@@ -0,0 +1,124 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+import httpx
+
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+
+
+def upload_handler(calls):
+    def handler(request: httpx.Request) -> httpx.Response:
+        orders = json.loads(parse_qs(request.content.decode())["orders"][0])
+        calls.append(len(orders))
+        uploaded = [{"id": i, "externalId": o["externalId"]} for i, o in enumerate(orders) if o["externalId"] != "BAD"]
+        if len(uploaded) < len(orders):
+            return httpx.Response(460, json={
+                "success": False,
+                "errorMsg": "Not all orders are uploaded",
+                "uploadedOrders": uploaded,
+                "errors": {"BAD": "Offer not found"},
+            })
+        return httpx.Response(201, json={"success": True, "uploadedOrders": uploaded})
+
+    return handler
+
+
+def test_upload_orders_chunks_and_reports_per_item():
+    calls = []
+    client = ApiClientRetailCRM(
+        crm_base_url="https://crm.test",
+        crm_api_key="key",
+        transport=httpx.MockTransport(upload_handler(calls)),
+    )
+    orders = [{"externalId": f"ORD-{i}"} for i in range(120)]
+    orders[70]["externalId"] = "BAD"
+
+    async def scenario():
+        try:
+            return await client.upload_orders(orders, site="s", concurrency=2)
+        finally:
+            await client.close_client()
+
+    results = asyncio.run(scenario())
+    assert sorted(calls) == [20, 50, 50]
+    assert len(results) == 120
+    assert results[70] == {"success": False, "error": "Offer not found", "errors": {"BAD": "Offer not found"}}
+    assert all(result["success"] for i, result in enumerate(results) if i != 70)
+    assert results[71]["externalId"] == "ORD-71"
+
+
+def test_iter_lines_joins_lines_split_across_chunks():
+    from api.retail_api.bulk import iter_lines
+
+    async def chunks():
+        for chunk in (b'{"a": 1}\n{"b"', b': 2}\r\n', b'{"c": 3}'):
+            yield chunk
+
+    async def scenario():
+        return [line async for line in iter_lines(chunks())]
+
+    assert asyncio.run(scenario()) == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+def test_overlong_line_fails_its_row_without_being_buffered():
+    from api.retail_api.bulk import iter_lines, iter_ndjson_rows
+
+    async def chunks():
+        yield b'{"a": 1}\n{"long": "'
+        for _ in range(100):
+            yield b"x" * 100
+        yield b'"}\n{"b": 2}\n{"short": "' + b"y" * 20
+        yield b'"}'
+
+    async def scenario():
+        return [row async for row in iter_ndjson_rows(iter_lines(chunks(), max_length=64))]
+
+    rows = asyncio.run(scenario())
+    assert [(row, value, error) for row, value, error in rows] == [
+        (1, {"a": 1}, None), (2, None, "Line too long"), (3, {"b": 2}, None), (4, {"short": "y" * 20}, None),
+    ]
+
+
+def test_undecodable_line_fails_only_its_row():
+    from api.retail_api.bulk import iter_csv_rows, iter_lines, iter_ndjson_rows
+
+    async def rows(parse, body):
+        async def chunks():
+            yield body
+
+        return [r async for r in parse(iter_lines(chunks()))]
+
+    ndjson = asyncio.run(rows(iter_ndjson_rows, b'{"a": 1}\n{"b": "\xff"}\n{"c": 3}\n'))
+    csv_rows = asyncio.run(rows(iter_csv_rows, b'name,email\nAnn,a@b.io\n\xffBob,b@b.io\nCy,c@b.io\n'))
+
+    assert [(row, value) for row, value, _ in ndjson] == [(1, {"a": 1}), (2, None), (3, {"c": 3})]
+    assert ndjson[1][2].startswith("Invalid UTF-8")
+    assert [(row, value) for row, value, _ in csv_rows] == [
+        (1, {"name": "Ann", "email": "a@b.io"}), (2, None), (3, {"name": "Cy", "email": "c@b.io"}),
+    ]
+
+
+def test_stream_batches_bounds_concurrency():
+    from api.retail_api.bulk import stream_batches
+
+    running = {"now": 0, "peak": 0}
+
+    async def upload(group, payloads):
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+        return [{"success": True} for _ in payloads]
+
+    async def rows():
+        for i in range(1, 26):
+            yield (i, "s", {"n": i}, None) if i != 5 else (i, None, None, "bad row")
+
+    async def scenario():
+        return [result async for result in stream_batches(rows(), upload, batch_size=4, concurrency=2)]
+
+    results = asyncio.run(scenario())
+    assert sorted(result["row"] for result in results) == list(range(1, 26))
+    assert running["peak"] == 2
+    assert {"row": 5, "success": False, "error": "bad row"} in results
@@ -0,0 +1,125 @@
+import asyncio
+import fnmatch
+
+import httpx
+
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+from api.base_api.cache import MemoryCacheBackend, RedisCacheBackend, ResponseCache
+
+
+class FakeRedis:
+    """Local stand-in for redis.asyncio.Redis"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, px=None):
+        self.data[key] = value
+
+    async def scan_iter(self, match):
+        pattern = match.replace('\\[', '[[]').replace('\\]', '[]]').replace('\\?', '[?]')
+        for key in list(self.data):
+            if fnmatch.fnmatchcase(key, pattern):
+                yield key
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+        return len(keys)
+
+    async def aclose(self):
+        pass
+
+
+def make_client(cache, calls):
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append((request.method, request.url.path))
+        if request.method == 'POST':
+            return httpx.Response(201, json={"success": True, "id": 10})
+        return httpx.Response(200, json={"success": True, "orders": [], "customer": {"id": 5}})
+
+    return ApiClientRetailCRM(
+        crm_base_url="https://crm.test",
+        crm_api_key="key",
+        cache=cache,
+        transport=httpx.MockTransport(handler),
+    )
+
+
+def test_memory_backend_evicts_least_recently_used():
+    async def scenario():
+        backend = MemoryCacheBackend(max_entries=2)
+        await backend.set("a", b"1", ttl=60)
+        await backend.set("b", b"2", ttl=60)
+        await backend.get("a")
+        await backend.set("c", b"3", ttl=60)
+        return await backend.get("a"), await backend.get("b"), await backend.get("c")
+
+    assert asyncio.run(scenario()) == (b"1", None, b"3")
+
+
+def test_memory_backend_expires_entries():
+    async def scenario():
+        backend = MemoryCacheBackend()
+        await backend.set("a", b"1", ttl=0)
+        return await backend.get("a")
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_customer_lookup_is_cached_and_marked():
+    calls = []
+
+    async def scenario():
+        client = make_client(ResponseCache(MemoryCacheBackend()), calls)
+        first = await client.get_customer(5, site="s", id_type="id")
+        second = await client.get_customer(5, site="s", id_type="id")
+        await client.close_client()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert first.cache_status == "MISS"
+    assert second.cache_status == "HIT"
+    assert second.get_response() == first.get_response()
+
+
+def test_order_create_invalidates_customer_orders():
+    for backend in (MemoryCacheBackend(), RedisCacheBackend(FakeRedis())):
+        calls = []
+
+        async def scenario():
+            client = make_client(ResponseCache(backend), calls)
+            await client.get_orders_by_customer(5, site="s")
+            await client.get_orders_by_customer(6, site="s")
+            await client.get_orders_by_customer("c-5", site="s", id_type="externalId")
+            await client.order_create({"customer": {"id": 5}, "items": []}, site="s")
+            await client.get_orders_by_customer(5, site="s")
+            await client.get_orders_by_customer(6, site="s")
+            await client.get_orders_by_customer("c-5", site="s", id_type="externalId")
+            await client.close_client()
+
+        asyncio.run(scenario())
+        gets = [call for call in calls if call[0] == 'GET']
+        assert len(gets) == 5
+
+
+def test_external_change_invalidates_only_that_customer():
+    calls = []
+
+    async def scenario():
+        client = make_client(ResponseCache(MemoryCacheBackend(), ttl=60), calls)
+        try:
+            await client.get_orders_by_customer(5, site="s")
+            await client.get_orders_by_customer(6, site="s")
+            await client.invalidate_customer_orders(5)
+            await client.get_orders_by_customer(5, site="s")
+            await client.get_orders_by_customer(6, site="s")
+        finally:
+            await client.close_client()
+
+    asyncio.run(scenario())
+    assert len(calls) == 3
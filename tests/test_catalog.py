@@ -0,0 +1,209 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+from api.base_api.response import Response
+from api.retail_api.catalog import Catalog
+from api.retail_api.retail_api import get_crm_client
+from server.server import app
+
+REFERENCES = {
+    "sites": {"sites": {"s": {"code": "s"}}},
+    "payment-types": {"paymentTypes": {"cash": {"code": "cash"}}},
+    "payment-statuses": {"paymentStatuses": {"paid": {"code": "paid"}}},
+    "statuses": {"statuses": {"new": {"code": "new"}}},
+    "order-types": {"orderTypes": {"eshop": {"code": "eshop"}}},
+}
+
+
+def crm_handler(offer_count=250, calls=None):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if calls is not None:
+            calls.append(request.url.path)
+        if request.url.path == "/api/v5/store/offers":
+            limit, page = int(request.url.params["limit"]), int(request.url.params["page"])
+            ids = range((page - 1) * limit + 1, min(page * limit, offer_count) + 1)
+            if "filter[ids][]" in request.url.params:
+                ids = [int(i) for i in request.url.params.get_list("filter[ids][]") if int(i) <= offer_count]
+            elif "filter[externalId]" in request.url.params:
+                ids = [i for i in range(1, offer_count + 1) if f"ext-{i}" == request.url.params["filter[externalId]"]]
+            return httpx.Response(200, json={
+                "success": True,
+                "offers": [{"id": i, "externalId": f"ext-{i}"} for i in ids],
+                "pagination": {"limit": limit, "currentPage": page, "totalCount": offer_count,
+                               "totalPageCount": -(-offer_count // limit)},
+            })
+        dictionary = request.url.path.rsplit("/", 1)[-1]
+        return httpx.Response(200, json={"success": True, **REFERENCES[dictionary]})
+    return handler
+
+
+def make_catalog(handler):
+    client = ApiClientRetailCRM("https://crm.test", "key", transport=httpx.MockTransport(handler))
+    return Catalog(client)
+
+
+def test_refresh_indexes_every_offer_page_and_dictionary():
+    calls = []
+    catalog = make_catalog(crm_handler(calls=calls))
+    order = {"items": [{"offer": {"id": 250}}, {"offer": {"externalId": "ext-1"}}, {"offer": {"id": 251}}]}
+
+    async def scenario():
+        try:
+            await catalog.refresh()
+            return (await catalog.validate_order(order, site="s"),
+                    await catalog.validate_payment({"type": "card", "status": "paid"}, site="s2"))
+        finally:
+            await catalog.client.close_client()
+
+    errors, payment_errors = asyncio.run(scenario())
+
+    # three pages, then one lookup of the offer missing from the snapshot
+    assert calls.count("/api/v5/store/offers") == 4
+    assert catalog.stats()["offers"] == 250
+    assert errors == [
+        {"loc": ["items", 2, "offer", "id"], "msg": "Unknown offer", "input": 251},
+    ]
+    assert [e["loc"] for e in payment_errors] == [["site"], ["payment", "type"]]
+    assert catalog.stats()["rejected_total"] == 2
+
+
+def test_payloads_pass_until_the_first_load():
+    def handler(request):
+        return httpx.Response(500, json={"success": False})
+
+    catalog = make_catalog(handler)
+    with pytest.raises(Exception):
+        asyncio.run(catalog.refresh())
+    assert not catalog.loaded
+    assert asyncio.run(catalog.validate_order({"items": [{"offer": {"id": 1}}]}, site="unknown")) == []
+
+
+def test_offers_created_after_the_snapshot_are_looked_up():
+    crm = {"offers": 10, "down": False}
+
+    def handler(request):
+        if crm["down"]:
+            return httpx.Response(503, json={"success": False})
+        return crm_handler(offer_count=crm["offers"])(request)
+
+    catalog = make_catalog(handler)
+
+    async def scenario():
+        try:
+            await catalog.refresh()
+            crm["offers"] = 20
+            new = await catalog.validate_order({"items": [{"offer": {"id": 15}}, {"offer": {"externalId": "ext-16"}}]})
+            missing = await catalog.validate_order({"items": [{"offer": {"id": 30}}]})
+            crm["down"] = True
+            unchecked = await catalog.validate_order({"items": [{"offer": {"id": 40}}]})
+            # found offers join the snapshot and missing ones are remembered, no further lookup
+            known = await catalog.validate_order({"items": [{"offer": {"id": 15}}]})
+            missing_again = await catalog.validate_order({"items": [{"offer": {"id": 30}}]})
+            return new, missing, unchecked, known, missing_again
+        finally:
+            await catalog.client.close_client()
+
+    new, missing, unchecked, known, missing_again = asyncio.run(scenario())
+    assert new == [] and unchecked == [] and known == []
+    assert [e["input"] for e in missing] == [30]
+    assert missing_again == missing
+    assert catalog.stats()["lookups_total"] == 4
+    assert catalog.stats()["missing_hits_total"] == 1
+
+
+def test_lookups_are_capped_per_order_and_codes_are_reloaded():
+    calls = []
+    references = {**REFERENCES}
+
+    def handler(request):
+        dictionary = request.url.path.rsplit("/", 1)[-1]
+        if dictionary in references:
+            calls.append(dictionary)
+            return httpx.Response(200, json={"success": True, **references[dictionary]})
+        calls.append("offers")
+        return crm_handler(offer_count=10)(request)
+
+    catalog = make_catalog(handler)
+    catalog.lookup_limit = 3
+    order = {"items": [{"offer": {"externalId": f"new-{i}"}} for i in range(8)]}
+
+    async def scenario():
+        try:
+            await catalog.refresh()
+            calls.clear()
+            capped = await catalog.validate_order(order)
+            references["payment-types"] = {"paymentTypes": {"cash": {"code": "cash"}, "card": {"code": "card"}}}
+            card = await catalog.validate_payment({"type": "card"})
+            bonus = await catalog.validate_payment({"type": "bonus"})
+            return capped, card, bonus
+        finally:
+            await catalog.client.close_client()
+
+    capped, card, bonus = asyncio.run(scenario())
+    # three externalIds looked up and rejected, the other five are left to RetailCRM
+    assert len(capped) == 3
+    assert catalog.stats()["lookups_skipped_total"] == 5
+    assert card == []
+    assert [e["loc"] for e in bonus] == [["payment", "type"]]
+    assert calls == ["offers"] * 3 + ["payment-types"] * 2
+
+
+class OrderClient:
+    def __init__(self):
+        self.created = []
+
+    async def order_create(self, order, site=None):
+        self.created.append(order)
+        return Response(201, {"success": True, "id": len(self.created)})
+
+    async def upload_orders(self, orders, site=None, concurrency=4):
+        self.created.extend(orders)
+        return [{"success": True, "id": i} for i, _ in enumerate(orders)]
+
+
+@pytest.fixture
+def catalog_client():
+    stub = OrderClient()
+    app.dependency_overrides[get_crm_client] = lambda: stub
+    try:
+        with TestClient(app) as test_client:
+            catalog = make_catalog(crm_handler(offer_count=10))
+            test_client.portal.call(catalog.refresh)
+            app.state.tenants.default.catalog = catalog
+            yield test_client, stub
+            test_client.portal.call(catalog.client.close_client)
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_invalid_orders_are_rejected_without_a_round_trip(catalog_client):
+    test_client, stub = catalog_client
+    bad = test_client.post("/api/retailCRM/orders", json={"items": [{"quantity": 1, "offerId": 99}], "site": "s"})
+    good = test_client.post("/api/retailCRM/orders", json={"items": [{"quantity": 1, "offerId": 9}], "site": "s"})
+    batch = test_client.post("/api/retailCRM/orders/batch", json={"site": "s", "orders": [
+        {"items": [{"quantity": 1, "offerExternalId": "ext-3"}]},
+        {"items": [{"quantity": 1, "offerExternalId": "ext-30"}]},
+    ]}).json()
+    payment = test_client.post("/api/retailCRM/orders/payments", json={
+        "payment": {"type": "bonus", "order": {"id": 1}}, "site": "s",
+    })
+
+    assert bad.status_code == 422
+    assert bad.json()["detail"][0]["loc"] == ["items", 0, "offer", "id"]
+    assert good.status_code == 200
+    assert [r["success"] for r in batch["results"]] == [True, False]
+    assert payment.status_code == 422
+    assert len(stub.created) == 2
+
+
+def test_reference_dictionaries_are_served_locally(catalog_client):
+    test_client, _ = catalog_client
+    assert test_client.get("/api/retailCRM/reference/payment-types").json() == {
+        "success": True, "paymentTypes": {"cash": {"code": "cash"}},
+    }
+    assert test_client.get("/api/retailCRM/reference/nope").status_code == 404
+    assert app.state.tenants.default.catalog.stats()["references"]["payment-types"] == 1
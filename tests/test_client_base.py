@@ -0,0 +1,124 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+import httpx
+from fastapi.testclient import TestClient
+
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+from config import settings
+from server.server import app
+
+
+def make_client(handler, **options) -> ApiClientRetailCRM:
+    return ApiClientRetailCRM(
+        crm_base_url="https://crm.test",
+        crm_api_key="key",
+        transport=httpx.MockTransport(handler),
+        **options
+    )
+
+
+def test_from_settings_applies_pool_limits():
+    client = ApiClientRetailCRM.from_settings(settings)
+    try:
+        assert client.limits.max_connections == settings.crm_max_connections
+        assert client.limits.max_keepalive_connections == settings.crm_max_keepalive_connections
+        assert client.timeout.connect == settings.crm_connect_timeout
+        stats = client.pool_stats()
+        assert stats["connections"] == 0
+        assert stats["in_flight"] == 0
+    finally:
+        asyncio.run(client.close_client())
+
+
+def test_requests_reuse_client_and_are_counted():
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request)
+        return httpx.Response(200, json={"success": True})
+
+    async def scenario():
+        client = make_client(handler)
+        try:
+            await client.get("/customers", params={"limit": 20})
+            await client.get("/customers", params={"limit": 20})
+            return client.pool_stats()
+        finally:
+            await client.close_client()
+
+    stats = asyncio.run(scenario())
+    assert len(seen) == 2
+    assert seen[0].headers["X-API-KEY"] == "key"
+    assert stats["requests_total"] == 2
+    assert stats["peak_in_flight"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_lifespan_owns_shared_client():
+    with TestClient(app) as test_client:
+        shared = app.state.crm_client
+        assert not shared.client.is_closed
+        response = test_client.get("/api/retailCRM/client/stats")
+        assert response.status_code == 200
+        assert "pool" in response.json()
+    assert shared.client.is_closed
+
+
+def test_identical_concurrent_gets_are_coalesced():
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"success": True})
+
+    async def scenario():
+        client = make_client(handler)
+        try:
+            gathered = asyncio.gather(
+                *(client.get("/customers/1", params={"by": "id"}) for _ in range(5)),
+                client.get("/customers", params={"filter[email]": "ann@example.com"}),
+            )
+            await asyncio.sleep(0.01)
+            during = client.coalescing_stats()
+            return await gathered, client.coalescing_stats(), during
+        finally:
+            await client.close_client()
+
+    responses, stats, during = asyncio.run(scenario())
+    assert len(calls) == 2
+    # per-key counts, without the query values of the keys
+    assert during["in_flight"] == 2
+    assert sorted(during["waiters"].values()) == [1, 5]
+    assert all(label.startswith("customers#") for label in during["waiters"])
+    assert "ann@example.com" not in str(during)
+    assert all(resp is responses[0] for resp in responses[:5])
+    assert stats["coalesced_total"] == 4
+    assert stats["in_flight"] == 0
+
+
+def test_writes_are_form_encoded_once_and_raw_body_is_kept():
+    seen = []
+    upstream_body = b'{"success":true,"id":7}'
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request)
+        return httpx.Response(201, content=upstream_body, headers={"Content-Type": "application/json"})
+
+    async def scenario():
+        client = make_client(handler)
+        try:
+            return await client.create_customer({"firstName": "Иван"}, site="s")
+        finally:
+            await client.close_client()
+
+    response = asyncio.run(scenario())
+    request = seen[0]
+    assert request.headers["Content-Type"] == "application/x-www-form-urlencoded"
+    form = parse_qs(request.content.decode())
+    assert json.loads(form["customer"][0]) == {"firstName": "Иван"}
+    assert form["site"] == ["s"]
+    assert response.get_raw() == upstream_body
+    assert response.get_response() == {"success": True, "id": 7}
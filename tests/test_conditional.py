@@ -0,0 +1,79 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from api.base_api.response import Response
+from api.retail_api.conditional import GZIP, ResponseEncoder, matches
+from api.retail_api.retail_api import get_crm_client
+from server.server import app
+
+URL = "/api/retailCRM/customers"
+
+
+class CustomerClient:
+    def __init__(self, count=200):
+        self.count = count
+
+    async def get_customers(self, limit=20, page=1, filters=None, use_cache=True):
+        return Response(200, {
+            "success": True,
+            "customers": [{"id": i, "email": f"customer{i}@example.com"} for i in range(self.count)],
+            "pagination": {"limit": limit, "currentPage": page, "totalCount": self.count, "totalPageCount": 1},
+        })
+
+
+@pytest.fixture
+def crm():
+    stub = CustomerClient()
+    app.dependency_overrides[get_crm_client] = lambda: stub
+    try:
+        with TestClient(app) as test_client:
+            yield test_client, stub
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_negotiation_follows_q_values_and_server_preference():
+    encoder = ResponseEncoder(encodings=(GZIP,))
+    assert encoder.negotiate("gzip;q=0.5, br") == GZIP
+    assert encoder.negotiate("gzip;q=0") is None
+    assert encoder.negotiate("*") == GZIP
+    assert encoder.negotiate(None) is None
+    assert ResponseEncoder(encodings=()).negotiate("gzip") is None
+
+    assert matches('W/"abc-gzip", "def"', "abc")
+    assert matches("*", "abc")
+    assert not matches('"abcd"', "abc")
+
+
+def test_unchanged_list_is_answered_with_304(crm):
+    test_client, _ = crm
+    first = test_client.get(URL, headers={"Accept-Encoding": "gzip"})
+    etag = first.headers["ETag"]
+    again = test_client.get(URL, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    identity = test_client.get(URL, headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+
+    assert first.status_code == 200
+    assert first.headers["Content-Encoding"] == "gzip"
+    assert etag.endswith('-gzip"')
+    assert len(first.json()["customers"]) == 200
+    assert again.status_code == 304 and again.content == b""
+    assert again.headers["ETag"] == etag
+    # the identity representation of the same body is not modified either
+    assert identity.status_code == 304
+    assert identity.headers["ETag"] == etag.replace("-gzip", "")
+
+
+def test_compressed_body_is_cached_and_small_bodies_are_sent_as_is(crm):
+    test_client, stub = crm
+    for _ in range(3):
+        assert test_client.get(URL, headers={"Accept-Encoding": "gzip"}).status_code == 200
+    stats = app.state.encoder.stats()
+
+    stub.count = 1
+    small = test_client.get(URL, headers={"Accept-Encoding": "gzip"})
+
+    assert stats["compressed_total"] == 1
+    assert stats["encoded_cache_hits_total"] == 2
+    assert stats["compression_ratio"] < 0.5
+    assert "Content-Encoding" not in small.headers
+    assert small.headers["ETag"]
@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+from api.base_api.response import Response
+from api.retail_api.pagination import decode_cursor, encode_cursor
+from api.retail_api.retail_api import get_crm_client
+from config import Settings, settings
+from server.server import app
+
+
+class PagedClient:
+    def __init__(self, total_pages=3, per_page=2, failing_page=None):
+        self.total_pages = total_pages
+        self.per_page = per_page
+        self.failing_page = failing_page
+        self.pages = []
+
+    async def get_orders(self, filters=None, limit=20, page=1, use_cache=True):
+        self.pages.append(page)
+        await asyncio.sleep(0.01 * (self.total_pages - page))
+        if page == self.failing_page:
+            return Response(503, {"errorMsg": "busy"})
+        first = (page - 1) * self.per_page
+        return Response(200, {
+            "orders": [{"id": first + i} for i in range(self.per_page)],
+            "pagination": {"currentPage": page, "totalPageCount": self.total_pages,
+                           "totalCount": self.total_pages * self.per_page},
+        })
+
+
+def export(stub, **params):
+    app.dependency_overrides[get_crm_client] = lambda: stub
+    try:
+        with TestClient(app) as test_client:
+            response = test_client.get("/api/retailCRM/orders/export", params=params)
+    finally:
+        app.dependency_overrides.clear()
+    return response, [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_cursor_roundtrip():
+    assert decode_cursor(encode_cursor({"page": 7})) == {"page": 7}
+
+
+def test_export_walks_all_pages_in_order():
+    response, lines = export(PagedClient())
+    assert response.headers["X-Total-Count"] == "6"
+    records = [line["id"] for line in lines if "id" in line]
+    assert records == [0, 1, 2, 3, 4, 5]
+    assert decode_cursor(lines[-1]["@cursor"]) == {"page": 4}
+
+
+def test_export_without_prefetch_still_walks_every_page(monkeypatch):
+    monkeypatch.setattr(settings, "export_prefetch_pages", 0)
+    response, lines = export(PagedClient())
+    assert [line["id"] for line in lines if "id" in line] == [0, 1, 2, 3, 4, 5]
+    with pytest.raises(ValidationError):
+        Settings(export_prefetch_pages=0)
+
+
+def test_export_resumes_from_cursor_and_reports_failures():
+    stub = PagedClient(total_pages=4, failing_page=3)
+    response, lines = export(stub, cursor=encode_cursor({"page": 2}))
+    assert [line["id"] for line in lines if "id" in line] == [2, 3]
+    assert lines[-1]["@error"] == {"errorMsg": "busy"}
+    assert decode_cursor(lines[-1]["@cursor"]) == {"page": 3}
+    assert 1 not in stub.pages
+
+
+def test_export_rejects_bad_cursor():
+    response, _ = export(PagedClient(), cursor="not-a-cursor")
+    assert response.status_code == 400
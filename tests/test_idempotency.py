@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.base_api.cache import MemoryCacheBackend
+from api.base_api.response import Response
+from api.retail_api.idempotency import IdempotencyStore, fingerprint
+from api.retail_api.retail_api import get_crm_client
+from server.server import app
+
+ORDER = {"externalId": None, "customerId": 1, "items": [{"quantity": 1, "offerId": 5}]}
+
+
+class CountingClient:
+    def __init__(self, status_code=201):
+        self.status_code = status_code
+        self.orders = 0
+        self.payments = 0
+
+    async def order_create(self, order, site=None):
+        self.orders += 1
+        return Response(self.status_code, {"success": self.status_code < 400, "id": self.orders})
+
+    async def order_payment_create(self, payment, site):
+        self.payments += 1
+        return Response(201, {"success": True, "id": self.payments})
+
+
+def post_all(stub, requests):
+    app.dependency_overrides[get_crm_client] = lambda: stub
+    try:
+        with TestClient(app) as test_client:
+            return [test_client.post(path, json=body, headers=headers) for path, body, headers in requests]
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_retry_with_same_key_replays_the_first_response():
+    stub = CountingClient()
+    payment = {"payment": {"order": {"id": 1}, "amount": 10}, "site": "s"}
+    first, retry, other_key = post_all(stub, [
+        ("/api/retailCRM/orders/payments", payment, {"Idempotency-Key": "pay-1"}),
+        ("/api/retailCRM/orders/payments", payment, {"Idempotency-Key": "pay-1"}),
+        ("/api/retailCRM/orders/payments", payment, {"Idempotency-Key": "pay-2"}),
+    ])
+    assert stub.payments == 2
+    assert retry.json() == first.json() == {"success": True, "id": 1}
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert other_key.json()["id"] == 2
+
+
+def test_key_reused_with_another_body_is_rejected():
+    stub = CountingClient()
+    first, reused = post_all(stub, [
+        ("/api/retailCRM/orders", ORDER, {"Idempotency-Key": "k"}),
+        ("/api/retailCRM/orders", {**ORDER, "customerId": 2}, {"Idempotency-Key": "k"}),
+    ])
+    assert first.status_code == 200
+    assert reused.status_code == 422
+    assert stub.orders == 1
+
+
+def test_order_external_id_is_the_automatic_key():
+    stub = CountingClient()
+    order = {**ORDER, "externalId": "A-1"}
+    responses = post_all(stub, [
+        ("/api/retailCRM/orders", order, {}),
+        ("/api/retailCRM/orders", order, {}),
+        ("/api/retailCRM/orders", ORDER, {}),
+        ("/api/retailCRM/orders", ORDER, {}),
+    ])
+    # orders without externalId or key are not deduplicated
+    assert stub.orders == 3
+    assert responses[1].headers["Idempotent-Replayed"] == "true"
+
+
+def test_rejected_order_can_be_corrected_under_the_same_external_id():
+    class RejectingClient(CountingClient):
+        async def order_create(self, order, site=None):
+            self.orders += 1
+            if order["customer"]["id"] == 1:
+                return Response(400, {"success": False, "errorMsg": "Offer not found"})
+            return Response(201, {"success": True, "id": self.orders})
+
+    stub = RejectingClient()
+    order = {**ORDER, "externalId": "A-1"}
+    rejected, corrected, retried, explicit, explicit_again = post_all(stub, [
+        ("/api/retailCRM/orders", order, {}),
+        ("/api/retailCRM/orders", {**order, "customerId": 2}, {}),
+        ("/api/retailCRM/orders", {**order, "customerId": 2}, {}),
+        ("/api/retailCRM/orders", order, {"Idempotency-Key": "k"}),
+        ("/api/retailCRM/orders", order, {"Idempotency-Key": "k"}),
+    ])
+    assert rejected.status_code == 400
+    assert corrected.status_code == 200 and "Idempotent-Replayed" not in corrected.headers
+    assert retried.headers["Idempotent-Replayed"] == "true"
+    # an explicit key still remembers the rejection
+    assert explicit_again.headers["Idempotent-Replayed"] == "true"
+    assert stub.orders == 3
+
+
+@pytest.mark.parametrize("status_code", [503, 429, 409, 408])
+def test_upstream_failures_are_not_remembered(status_code):
+    stub = CountingClient(status_code=status_code)
+    responses = post_all(stub, [
+        ("/api/retailCRM/orders", ORDER, {"Idempotency-Key": "k"}),
+        ("/api/retailCRM/orders", ORDER, {"Idempotency-Key": "k"}),
+    ])
+    assert [r.status_code for r in responses] == [status_code, status_code]
+    assert stub.orders == 2
+
+
+def test_concurrent_duplicates_share_one_call():
+    calls = 0
+
+    async def create():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return Response(201, {"id": calls})
+
+    async def scenario():
+        store = IdempotencyStore(MemoryCacheBackend())
+        fp = fingerprint({"a": 1})
+        results = await asyncio.gather(*(store.execute("orders", "k", fp, create) for _ in range(5)))
+        later = await store.execute("orders", "k", fp, create)
+        return results, later, store.stats()
+
+    results, later, stats = asyncio.run(scenario())
+    assert calls == 1
+    assert [replayed for _, replayed in results] == [False, True, True, True, True]
+    assert later[1] is True and later[0].get_response() == {"id": 1}
+    assert stats["coalesced_total"] == 4
+    assert stats["in_flight"] == 0
@@ -0,0 +1,177 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from api.base_api.response import Response
+from api.jobs.queue import FAILED, ORDER, PAYMENT, QUEUED, SUCCEEDED, UNKNOWN, JobQueue
+from api.jobs.worker import JobRunner
+from config import settings
+from server.server import app
+
+
+class QueueClient:
+    def __init__(self, create_statuses=(201,), saved=()):
+        self.create_statuses = list(create_statuses)
+        self.created = []
+        self.uploads = []
+        self.payments = []
+        self.payment_error = None
+        # externalIds of orders RetailCRM has, whatever create answered
+        self.saved = set(saved)
+        self.lookups = []
+
+    async def order_create(self, order, site=None):
+        self.created.append(order)
+        status = self.create_statuses.pop(0) if len(self.create_statuses) > 1 else self.create_statuses[0]
+        return Response(status, {"success": status < 400, "id": len(self.created)})
+
+    async def upload_orders(self, orders, site=None, chunk_size=50, concurrency=4):
+        self.uploads.append((site, orders))
+        return [
+            {"success": False, "error": "Offer not found", "errors": {}} if order["externalId"] == "BAD"
+            else {"success": True, "id": i, "externalId": order["externalId"]}
+            for i, order in enumerate(orders)
+        ]
+
+    async def get_orders(self, filters=None, limit=20, page=1, use_cache=True):
+        self.lookups.append(filters)
+        orders = [{"id": 900, "externalId": ext} for ext in filters["externalIds"] if ext in self.saved]
+        return Response(200, {"success": True, "orders": orders})
+
+    async def order_payment_create(self, payment, site):
+        self.payments.append(payment)
+        if self.payment_error is not None:
+            raise self.payment_error
+        return Response(201, {"success": True, "id": len(self.payments)})
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    yield queue
+    queue.close()
+
+
+def test_queued_orders_of_a_site_go_out_as_one_upload(queue):
+    client = QueueClient()
+    runner = JobRunner(client, queue)
+
+    async def scenario():
+        submitted = [await runner.submit(ORDER, {"externalId": ext}, site="a") for ext in ("A-1", "BAD", "A-2")]
+        submitted.append(await runner.submit(ORDER, {"externalId": "B-1"}, site="b"))
+        submitted.append(await runner.submit(PAYMENT, {"order": {"id": 1}, "amount": 5}, site="a"))
+        while await runner.process_once():
+            pass
+        return submitted
+
+    *ids, other, payment = asyncio.run(scenario())
+    assert client.uploads == [("a", [{"externalId": "A-1"}, {"externalId": "BAD"}, {"externalId": "A-2"}])]
+    assert len(client.created) == 1 and len(client.payments) == 1
+    assert [queue.get(i)["status"] for i in ids] == [SUCCEEDED, FAILED, SUCCEEDED]
+    assert queue.get(ids[1])["error"] == "Offer not found"
+    assert queue.get(other)["result"] == {"success": True, "id": 1}
+    assert queue.get(payment)["status"] == SUCCEEDED
+
+
+def test_transient_failures_are_retried_until_max_attempts(queue):
+    client = QueueClient(create_statuses=(503, 503, 503))
+    runner = JobRunner(client, queue, max_attempts=2)
+    job_id = asyncio.run(runner.submit(ORDER, {"externalId": "X"}))
+
+    asyncio.run(runner.process_once())
+    job = queue.get(job_id)
+    assert job["status"] == QUEUED and job["attempts"] == 1
+
+    queue.conn.execute("UPDATE jobs SET available_at = ?", (time.time(),))
+    asyncio.run(runner.process_once())
+    job = queue.get(job_id)
+    assert job["status"] == FAILED and job["attempts"] == 2
+    assert runner.stats()["retried_total"] == 1
+
+
+def test_expired_lease_makes_a_job_claimable_again(queue):
+    job_id = queue.enqueue(ORDER, {"externalId": "X"})
+    assert [job["id"] for job in queue.claim(ORDER, "dead-worker", 10, lease=-1)] == [job_id]
+    assert [(job["attempts"], job["lease_expired"]) for job in queue.claim(ORDER, "worker", 10, lease=60)] == [
+        (2, True),
+    ]
+    assert queue.claim(ORDER, "other", 10, lease=60) == []
+
+
+def test_jobs_of_a_dead_worker_are_reconciled_not_resent(queue):
+    client = QueueClient(saved={"SAVED"})
+    runner = JobRunner(client, queue)
+    ids = [queue.enqueue(ORDER, {"externalId": ext}, site="a") for ext in ("SAVED", "MISSING")]
+    ids += [queue.enqueue(ORDER, {"items": []}, site="a"), queue.enqueue(PAYMENT, {"amount": 5}, site="a")]
+    # the previous owner died while the jobs were running
+    queue.claim(ORDER, "dead-worker", 10, lease=-1)
+    queue.claim(PAYMENT, "dead-worker", 10, lease=-1)
+
+    asyncio.run(runner.process_once())
+    saved, missing, anonymous, payment = (queue.get(job_id) for job_id in ids)
+
+    assert client.created == [] and client.uploads == [] and client.payments == []
+    assert saved["status"] == SUCCEEDED
+    # confirmed absent, so it is sent again once due
+    assert missing["status"] == QUEUED
+    assert anonymous["status"] == UNKNOWN and payment["status"] == UNKNOWN
+
+
+def test_async_order_is_acknowledged_with_a_job(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "jobs_enabled", True)
+    monkeypatch.setattr(settings, "jobs_path", str(tmp_path / "jobs.sqlite3"))
+    client = QueueClient()
+    order = {"externalId": "A-1", "customerId": 1, "items": [{"quantity": 1, "offerId": 5}]}
+
+    with TestClient(app) as test_client:
+        app.state.jobs.client = client
+        accepted = test_client.post("/api/retailCRM/orders", json=order, headers={"Prefer": "respond-async"})
+        again = test_client.post("/api/retailCRM/orders", json=order, headers={"Prefer": "respond-async"})
+        job_url = accepted.headers["Location"]
+        for _ in range(100):
+            job = test_client.get(job_url).json()
+            if job["status"] == SUCCEEDED:
+                break
+            time.sleep(0.01)
+        missing = test_client.get("/api/retailCRM/jobs/unknown")
+
+    assert accepted.status_code == 202
+    assert accepted.headers["Preference-Applied"] == "respond-async"
+    assert again.json()["jobId"] == accepted.json()["jobId"]
+    assert job["status"] == SUCCEEDED
+    assert job["result"] == {"success": True, "id": 1}
+    assert len(client.created) == 1
+    assert missing.status_code == 404
+
+
+def test_writes_that_may_have_been_saved_are_not_blindly_resent(queue):
+    client = QueueClient(create_statuses=(504,), saved={"SAVED"})
+    client.payment_error = httpx.ReadTimeout("timed out")
+    runner = JobRunner(client, queue)
+    saved = asyncio.run(runner.submit(ORDER, {"externalId": "SAVED"}, site="a"))
+
+    async def run_one(kind, payload, site="a"):
+        job_id = await runner.submit(kind, payload, site=site)
+        await runner.process_once()
+        return queue.get(job_id)
+
+    async def scenario():
+        await runner.process_once()
+        return (
+            await run_one(ORDER, {"externalId": "MISSING"}),
+            await run_one(ORDER, {"items": []}),
+            await run_one(PAYMENT, {"order": {"id": 1}, "amount": 5}),
+        )
+
+    missing, anonymous, payment = asyncio.run(scenario())
+    assert queue.get(saved)["status"] == SUCCEEDED
+    assert queue.get(saved)["result"] == {"id": 900, "order": {"id": 900, "externalId": "SAVED"}}
+    assert client.lookups[0] == {"externalIds": ["SAVED"], "sites": ["a"]}
+    # not in RetailCRM after the 504, so it is safe to send again
+    assert missing["status"] == QUEUED
+    assert anonymous["status"] == UNKNOWN
+    assert payment["status"] == UNKNOWN and len(client.payments) == 1
+    assert runner.stats()["reconciled_total"] == 1
@@ -0,0 +1,71 @@
+import asyncio
+
+import httpx
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+from api.base_api.response import Response
+from api.retail_api.retail_api import get_crm_client
+from observability.metrics import endpoint_label
+from server.server import app
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class CustomerClient:
+    async def get_customer(self, customer_id, site, id_type="id"):
+        return Response(200, {"customer": {"id": customer_id}})
+
+
+def test_endpoint_label_hides_ids():
+    assert endpoint_label("/customers/123") == "/customers/{id}"
+    assert endpoint_label("/customers/history") == "/customers/history"
+    assert endpoint_label("/orders/payments/5/edit") == "/orders/payments/{id}/edit"
+    assert endpoint_label("/orders") == "/orders"
+
+
+def test_routes_are_counted_by_template_and_status_class():
+    route = "/api/retailCRM/customers/{customer_id}"
+    before = sample("retailapi_http_requests_total", tenant="default", method="GET", route=route, status_class="2xx")
+    app.dependency_overrides[get_crm_client] = lambda: CustomerClient()
+    try:
+        with TestClient(app) as test_client:
+            assert test_client.get("/api/retailCRM/customers/1").status_code == 200
+            assert test_client.get("/api/retailCRM/customers/2").status_code == 200
+            assert test_client.get("/nowhere").status_code == 404
+            exposition = test_client.get("/metrics")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert sample("retailapi_http_requests_total", tenant="default", method="GET", route=route, status_class="2xx") == before + 2
+    assert sample("retailapi_http_requests_total", tenant="default", method="GET", route="<unmatched>",
+                  status_class="4xx") >= 1
+    assert exposition.headers["content-type"].startswith("text/plain")
+    assert "retailapi_http_request_duration_seconds_bucket" in exposition.text
+    assert sample("retailapi_http_requests_in_flight") == 0
+
+
+def test_upstream_calls_are_timed_per_endpoint():
+    labels = {"tenant": "default", "method": "GET", "endpoint": "/customers/{id}"}
+    before = sample("retailapi_upstream_request_duration_seconds_count", **labels)
+    failed_before = sample("retailapi_upstream_requests_total", status_class="5xx", **labels)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        code = 500 if request.url.path.endswith("/2") else 200
+        return httpx.Response(code, json={"success": code == 200})
+
+    async def scenario():
+        client = ApiClientRetailCRM("https://crm.test", "key", transport=httpx.MockTransport(handler))
+        try:
+            await client.get_customer("1", site="s")
+            await client.get_customer("2", site="s")
+        finally:
+            await client.close_client()
+
+    asyncio.run(scenario())
+    assert sample("retailapi_upstream_request_duration_seconds_count", **labels) == before + 2
+    assert sample("retailapi_upstream_requests_total", status_class="5xx", **labels) == failed_before + 1
+    assert sample("retailapi_upstream_requests_in_flight") == 0
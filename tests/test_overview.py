@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+from api.base_api.exceptions import UpstreamBusyError
+from api.base_api.response import Response
+from api.retail_api.retail_api import get_crm_client
+from server.server import app
+
+URL = "/api/retailCRM/customers/{}/overview"
+DELAY = 0.1
+
+
+class AccountClient:
+    def __init__(self, order_count=250, failing_page=None, customer_status=200):
+        self.orders = [
+            {"id": i, "externalId": f"o-{i}", "payments": {str(i): {"id": i, "amount": 10}}}
+            for i in range(order_count, 0, -1)
+        ]
+        self.failing_page = failing_page
+        self.customer_status = customer_status
+        self.calls = []
+
+    async def get_customer(self, customer_id, site, id_type="externalId"):
+        self.calls.append(("customer", customer_id, id_type))
+        await asyncio.sleep(DELAY)
+        if self.customer_status != 200:
+            return Response(self.customer_status, {"success": False, "errorMsg": "Not found"})
+        return Response(200, {"success": True, "customer": {"id": 1, "externalId": "c-1"}})
+
+    async def get_orders_by_customer(self, customer_id, site=None, limit=20, page=1, id_type="id"):
+        self.calls.append(("orders", page, id_type))
+        await asyncio.sleep(DELAY)
+        if page == self.failing_page:
+            raise UpstreamBusyError("busy", retry_after=1)
+        first = (page - 1) * limit
+        return Response(200, {
+            "success": True,
+            "orders": self.orders[first:first + limit],
+            "pagination": {"totalCount": len(self.orders), "currentPage": page},
+        })
+
+
+def overview(stub, customer_id="1", **params):
+    app.dependency_overrides[get_crm_client] = lambda: stub
+    try:
+        with TestClient(app) as test_client:
+            started = time.perf_counter()
+            response = test_client.get(URL.format(customer_id), params=params)
+            return response, time.perf_counter() - started
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_parts_are_fetched_concurrently_and_merged():
+    stub = AccountClient()
+    response, elapsed = overview(stub)
+    body = response.json()
+
+    assert response.status_code == 200
+    assert body["success"] is True and body["errors"] == {}
+    assert body["customer"]["id"] == 1
+    assert [o["id"] for o in body["orders"]] == list(range(250, 0, -1))
+    assert body["payments"][0] == {"id": 250, "amount": 10, "order": {"id": 250, "externalId": "o-250"}}
+    assert body["ordersTotalCount"] == 250 and body["ordersTruncated"] is False
+    # customer and page 1 together, then pages 2 and 3 together
+    assert elapsed < DELAY * 3
+
+
+def test_failed_part_is_reported_next_to_the_others():
+    response, _ = overview(AccountClient(failing_page=2), customer_id="c-1", by="externalId")
+    body = response.json()
+    assert response.status_code == 200
+    assert body["success"] is False
+    assert body["customer"]["externalId"] == "c-1"
+    assert body["orders"] == []
+    assert body["errors"] == {"orders": {"status": 503, "detail": "busy"}}
+
+
+def test_unknown_customer_is_not_found():
+    response, _ = overview(AccountClient(order_count=0, customer_status=404), customer_id="9")
+    assert response.status_code == 404
@@ -0,0 +1,93 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from api.base_api.response import Response
+from api.retail_api.pagination import TotalCountCache, encode_cursor, fetch_after, fetch_window
+from api.retail_api.retail_api import get_crm_client
+from server.server import app
+
+URL = "/api/retailCRM/customers/paged"
+
+
+class CustomerList:
+    """Serves customers newest first in pages of ``limit``"""
+
+    def __init__(self, count=250):
+        self.ids = list(range(count, 0, -1))
+        self.pages = []
+
+    async def get_customers(self, limit=100, page=1, filters=None, use_cache=True):
+        self.pages.append(page)
+        first = (page - 1) * limit
+        return Response(200, {
+            "customers": [{"id": i} for i in self.ids[first:first + limit]],
+            "pagination": {"limit": limit, "currentPage": page, "totalCount": len(self.ids),
+                           "totalPageCount": -(-len(self.ids) // limit)},
+        })
+
+    async def fetch_page(self, page):
+        return await self.get_customers(page=page)
+
+
+def test_window_is_cut_from_the_covering_pages():
+    stub = CustomerList()
+    records, total = asyncio.run(fetch_window(stub.fetch_page, "customers", 180, 50))
+    assert [r["id"] for r in records] == list(range(70, 20, -1))
+    assert total == 250
+    assert sorted(stub.pages) == [2, 3]
+
+    stub.pages.clear()
+    assert asyncio.run(fetch_window(stub.fetch_page, "customers", 300, 50, total=250)) == ([], 250)
+    assert stub.pages == []
+
+
+def test_cursor_realigns_when_records_were_added_ahead_of_it():
+    stub = CustomerList(count=10)
+    stub.ids[:0] = [12, 11]
+    records, offset, _ = asyncio.run(fetch_after(stub.fetch_page, "customers", 3, 8, 3))
+    assert [r["id"] for r in records] == [7, 6, 5]
+    assert offset == 5
+
+
+def test_total_count_cache_expires():
+    totals = TotalCountCache(ttl=-1)
+    totals.set(("t", "customers", "f"), 5)
+    assert totals.get(("t", "customers", "f")) is None
+    totals = TotalCountCache(max_entries=1)
+    totals.set(("a",), 1)
+    totals.set(("b",), 2)
+    assert totals.get(("a",)) is None and totals.get(("b",)) == 2
+
+
+def test_cursor_pages_larger_than_upstream_pages():
+    stub = CustomerList()
+    app.dependency_overrides[get_crm_client] = lambda: stub
+    try:
+        with TestClient(app) as test_client:
+            pages, cursor = [], None
+            while True:
+                params = {"size": 120, **({"cursor": cursor} if cursor else {})}
+                body = test_client.get(URL, params=params).json()
+                pages.append([c["id"] for c in body["items"]])
+                cursor = body["next_page"]
+                if cursor is None:
+                    break
+            wrong_filters = test_client.get(URL, params={"email": "a@b.io", "cursor": body["current_page"]})
+            bad = test_client.get(URL, params={"cursor": "not-a-cursor"})
+            malformed = [
+                test_client.get(URL, params={"cursor": encode_cursor(position)}).status_code
+                for position in ({"o": 10, "id": "7", "f": ""}, {"o": 10, "id": 7, "f": ["x"]}, {"o": 10, "id": 7})
+            ]
+            large = test_client.get("/api/retailCRM/customers", params={"limit": 150, "page": 2}).json()
+    finally:
+        app.dependency_overrides.clear()
+
+    assert [len(page) for page in pages] == [120, 120, 10]
+    assert sum(pages, []) == list(range(250, 0, -1))
+    assert body["total"] == 250
+    assert wrong_filters.status_code == 400
+    assert bad.status_code == 400
+    assert malformed == [400, 400, 400]
+    assert [c["id"] for c in large["customers"]] == list(range(100, 0, -1))
+    assert large["pagination"] == {"limit": 150, "totalCount": 250, "currentPage": 2, "totalPageCount": 2}
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.base_api.exceptions import UpstreamBusyError
+from api.base_api.rate_limiter import (
+    LIST, LOOKUP, WRITE, AdaptiveConcurrencyLimiter, RateLimiter, classify_endpoint,
+)
+from api.retail_api.retail_api import get_crm_client
+from server.server import app
+
+
+def test_classify_endpoint():
+    assert classify_endpoint('GET', '/customers') == LIST
+    assert classify_endpoint('GET', '/orders/history') == LIST
+    assert classify_endpoint('GET', '/customers/42') == LOOKUP
+    assert classify_endpoint('POST', '/orders/create') == WRITE
+
+
+def test_rejects_when_wait_exceeds_budget():
+    async def scenario():
+        limiter = RateLimiter(rate=1, burst=1, max_wait=0.1)
+        async with limiter.acquire('GET', '/customers/1') as permit:
+            permit.status_code = 200
+        with pytest.raises(UpstreamBusyError) as exc:
+            async with limiter.acquire('GET', '/customers/1'):
+                pass
+        return limiter, exc.value
+
+    limiter, error = asyncio.run(scenario())
+    assert limiter.rejected_total == 1
+    assert error.retry_after > 0
+
+
+def test_class_budget_is_separate_from_lookups():
+    async def scenario():
+        limiter = RateLimiter(rate=100, burst=100, class_rates={LIST: 1}, max_wait=0)
+        async with limiter.acquire('GET', '/customers'):
+            pass
+        async with limiter.acquire('GET', '/customers/1'):
+            pass
+        with pytest.raises(UpstreamBusyError):
+            async with limiter.acquire('GET', '/customers'):
+                pass
+
+    asyncio.run(scenario())
+
+
+def test_concurrency_backs_off_on_overload_and_recovers():
+    limiter = AdaptiveConcurrencyLimiter(initial=10, minimum=2, maximum=20, latency_target=1.0)
+
+    async def scenario():
+        await limiter.acquire(timeout=1)
+        limiter.release(503, 0.01)
+        assert limiter.limit == pytest.approx(7)
+        for _ in range(10):
+            await limiter.acquire(timeout=1)
+            limiter.release(200, 0.01)
+
+    asyncio.run(scenario())
+    assert limiter.limit > 7
+    assert limiter.backoffs_total == 1
+    assert limiter.in_use == 0
+
+
+def test_concurrency_waiters_time_out():
+    limiter = AdaptiveConcurrencyLimiter(initial=1, minimum=1)
+
+    async def scenario():
+        await limiter.acquire(timeout=1)
+        with pytest.raises(UpstreamBusyError):
+            await limiter.acquire(timeout=0.01)
+
+    asyncio.run(scenario())
+    assert limiter.in_use == 1
+
+
+class BusyClient:
+    async def get_customer(self, customer_id, site, id_type='externalId'):
+        raise UpstreamBusyError("RetailCRM rate limit exceeded", retry_after=2.5)
+
+
+def test_busy_upstream_answers_503_with_retry_after():
+    app.dependency_overrides[get_crm_client] = lambda: BusyClient()
+    try:
+        with TestClient(app) as test_client:
+            response = test_client.get("/api/retailCRM/customers/1")
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
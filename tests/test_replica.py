@@ -0,0 +1,176 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.base_api.response import Response
+import sqlite3
+
+from api.replica.store import CUSTOMERS, ORDERS, ReplicaStore, normalize_phone
+from api.replica.sync import HistorySync, LeaseLost
+from api.retail_api.retail_api import get_crm_client
+from server.server import app
+
+
+class HistoryClient:
+    """Serves a fixed history feed and the entities it mentions"""
+
+    def __init__(self):
+        self.customers = {
+            1: {"id": 1, "externalId": "c-1", "site": "s", "firstName": "Ann", "email": "Ann@Example.com",
+                "phones": [{"number": "8 (912) 345-67-89"}], "createdAt": "2024-01-01 10:00:00"},
+            2: {"id": 2, "externalId": "c-2", "site": "s", "firstName": "Bob", "email": "bob@example.com",
+                "createdAt": "2024-02-01 10:00:00"},
+        }
+        self.orders = {10: {"id": 10, "site": "s", "customer": {"id": 1}}}
+        self.history = {
+            CUSTOMERS: [
+                {"id": 1, "customer": {"id": 1}, "created": True},
+                {"id": 2, "customer": {"id": 2}, "created": True},
+                {"id": 3, "customer": {"id": 3}, "created": True},
+                {"id": 4, "customer": {"id": 3}, "deleted": True},
+            ],
+            ORDERS: [{"id": 7, "order": {"id": 10}, "created": True}],
+        }
+
+    async def get_history(self, entity, since_id=None, limit=100):
+        records = [r for r in self.history[entity] if since_id is None or r["id"] > since_id]
+        return Response(200, {"history": records[:limit]})
+
+    async def get_customers(self, limit=100, page=1, filters=None, use_cache=True):
+        return Response(200, {"customers": [self.customers[i] for i in filters["ids"] if i in self.customers]})
+
+    async def get_orders(self, filters=None, limit=100, page=1, use_cache=True):
+        return Response(200, {"orders": [self.orders[i] for i in filters["ids"] if i in self.orders]})
+
+
+@pytest.fixture
+def synced_store(tmp_path):
+    store = ReplicaStore(str(tmp_path / "replica.sqlite3"))
+    asyncio.run(HistorySync(HistoryClient(), store).sync_once())
+    yield store
+    store.close()
+
+
+def test_sync_applies_history_and_persists_cursor(synced_store):
+    assert synced_store.since_id(CUSTOMERS) == 4
+    assert synced_store.since_id(ORDERS) == 7
+    assert synced_store.is_fresh(CUSTOMERS, max_age=60)
+    assert synced_store.get_customer(3, site=None, id_type="id") is None
+    assert synced_store.get_customer("c-2", site="s")["customer"]["firstName"] == "Bob"
+
+
+def test_sync_resumes_from_cursor(synced_store):
+    client = HistoryClient()
+    client.customers[1]["firstName"] = "Anna"
+    client.history[CUSTOMERS].append({"id": 5, "customer": {"id": 1}})
+    changes = asyncio.run(HistorySync(client, synced_store).sync_once())
+    assert changes == {CUSTOMERS: 1, ORDERS: 0}
+    assert synced_store.get_customer(1, site=None, id_type="id")["customer"]["firstName"] == "Anna"
+
+
+def test_list_filters(synced_store):
+    assert [c["id"] for c in synced_store.list_customers({}, limit=20, page=1)["customers"]] == [2, 1]
+    found = synced_store.list_customers({"email": "ann@"}, limit=20, page=1)
+    assert [c["id"] for c in found["customers"]] == [1]
+    found = synced_store.list_customers({"dateFrom": "2024-01-15", "dateTo": "2024-02-01"}, limit=20, page=1)
+    assert [c["id"] for c in found["customers"]] == [2]
+    assert found["pagination"]["totalCount"] == 1
+
+
+def test_keyset_reads_for_cursors(synced_store):
+    assert [c["id"] for c in synced_store.customers_before({}, None, 1)] == [2]
+    assert [c["id"] for c in synced_store.customers_before({}, 2, 5)] == [1]
+    assert synced_store.count_customers({"email": "bob@example.com"}) == 1
+
+
+def test_lease_is_exclusive(tmp_path):
+    store = ReplicaStore(str(tmp_path / "replica.sqlite3"))
+    assert store.try_acquire_lease("a", ttl=30)
+    assert not store.try_acquire_lease("b", ttl=30)
+    assert store.try_acquire_lease("a", ttl=30)
+    store.close()
+
+
+def test_sync_stops_when_the_lease_is_taken_over(tmp_path):
+    store = ReplicaStore(str(tmp_path / "replica.sqlite3"))
+    client = HistoryClient()
+    client.history[CUSTOMERS] = [{"id": i, "customer": {"id": 1 + i % 2}} for i in range(1, 251)]
+    sync = HistorySync(client, store)
+    pages = []
+    get_history = client.get_history
+
+    async def slow_history(entity, since_id=None, limit=100):
+        pages.append(since_id)
+        if len(pages) == 2:
+            # the lease expired during a long replay and another worker took it
+            store.set_meta("sync_lease", json.dumps({"owner": "other", "expires": time.time() + 30}))
+        return await get_history(entity, since_id, limit)
+
+    client.get_history = slow_history
+    with pytest.raises(LeaseLost):
+        asyncio.run(sync.sync_once())
+    # the first page was applied under the renewed lease, the second one not at all
+    assert pages == [None, 100]
+    assert store.since_id(CUSTOMERS) == 100
+    store.close()
+
+
+def test_routes_answer_from_fresh_replica(synced_store):
+    app.dependency_overrides[get_crm_client] = lambda: None
+    try:
+        with TestClient(app) as test_client:
+            app.state.replica = synced_store
+            customer = test_client.get("/api/retailCRM/customers/1", params={"by": "id"})
+            orders = test_client.get("/api/retailCRM/orders/1", params={"site": "s"})
+            app.state.replica = None
+    finally:
+        app.dependency_overrides.clear()
+    assert customer.headers["X-Cache"] == "REPLICA"
+    assert customer.json()["customer"]["id"] == 1
+    assert [o["id"] for o in orders.json()["orders"]] == [10]
+
+
+def test_normalize_phone():
+    assert normalize_phone("8 (912) 345-67-89") == "+79123456789"
+    assert normalize_phone("+7 912 345 67 89") == "+79123456789"
+    assert normalize_phone("9123456789") == "+79123456789"
+    assert normalize_phone("0049 30 1234567") == "+49301234567"
+    assert normalize_phone("n/a") is None
+
+
+def test_email_and_phone_lookups_use_indexes(synced_store):
+    found = synced_store.list_customers({"email": " ANN@example.com"}, limit=20, page=1)
+    assert [c["id"] for c in found["customers"]] == [1]
+    found = synced_store.list_customers({"phone": "+7 912 345-67-89"}, limit=20, page=1)
+    assert [c["id"] for c in found["customers"]] == [1]
+
+    plan = synced_store.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT data FROM customers WHERE email_norm = ?", ("x",)
+    ).fetchall()
+    assert "customers_email" in " ".join(row[-1] for row in plan)
+
+
+def test_indexes_follow_updates(synced_store):
+    with synced_store.transaction():
+        synced_store.upsert_customers([{"id": 1, "email": "new@example.com", "phones": []}])
+    assert synced_store.list_customers({"phone": "89123456789"}, limit=20, page=1)["customers"] == []
+    assert synced_store.list_customers({"email": "new@example.com"}, limit=20, page=1)["pagination"]["totalCount"] == 1
+
+
+def test_old_replica_file_is_migrated(tmp_path):
+    path = str(tmp_path / "old.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE customers (id INTEGER PRIMARY KEY, external_id TEXT, site TEXT, first_name TEXT, "
+        "last_name TEXT, email TEXT, created_at TEXT, data TEXT NOT NULL);"
+    )
+    conn.execute("INSERT INTO customers (id, email, data) VALUES (1, 'A@B.io', '{\"id\": 1, \"email\": \"A@B.io\"}')")
+    conn.commit()
+    conn.close()
+
+    store = ReplicaStore(path)
+    assert store.list_customers({"email": "a@b.io"}, limit=20, page=1)["pagination"]["totalCount"] == 1
+    store.close()
@@ -0,0 +1,132 @@
+import asyncio
+
+import httpx
+import pytest
+from pydantic import ValidationError
+
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+from api.base_api.cache import MemoryCacheBackend, ResponseCache
+from api.base_api.exceptions import CircuitOpenError
+from api.base_api.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, RetryPolicy, parse_retry_after
+from config import Settings
+
+
+def make_client(handler, **options) -> ApiClientRetailCRM:
+    options.setdefault('retry_policy', RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.01))
+    return ApiClientRetailCRM(
+        crm_base_url="https://crm.test",
+        crm_api_key="key",
+        transport=httpx.MockTransport(handler),
+        **options
+    )
+
+
+def run(client, coro_factory):
+    async def scenario():
+        try:
+            return await coro_factory()
+        finally:
+            await client.close_client()
+
+    return asyncio.run(scenario())
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_get_is_retried_until_success():
+    statuses = iter([503, 502, 200])
+
+    def handler(request):
+        return httpx.Response(next(statuses), json={"success": True})
+
+    client = make_client(handler)
+    response = run(client, lambda: client.get("/customers/1"))
+    assert response.get_status_code() == 200
+    assert client.retries_total == 2
+
+
+def test_get_is_sent_once_without_retries():
+    def handler(request):
+        return httpx.Response(200, json={"success": True})
+
+    client = make_client(handler, retry_policy=RetryPolicy(max_attempts=0))
+    response = run(client, lambda: client.get("/customers/1"))
+    assert response.get_status_code() == 200
+    with pytest.raises(ValidationError):
+        Settings(crm_retry_attempts=0)
+
+
+def test_long_retry_after_is_not_waited_for():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(429, headers={"Retry-After": "120"}, json={"success": False})
+
+    client = make_client(handler)
+    response = run(client, lambda: client.get("/customers/1"))
+    assert response.get_status_code() == 429
+    assert len(calls) == 1
+
+
+def test_post_is_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ConnectError("boom")
+
+    client = make_client(handler)
+    with pytest.raises(httpx.ConnectError):
+        run(client, lambda: client.post("/orders/create", json={}))
+    assert len(calls) == 1
+
+
+def test_breaker_opens_and_recovers(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker._opened_at -= 30
+    assert breaker.state == HALF_OPEN
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_open_breaker_serves_stale_cache():
+    up = {"value": True}
+
+    def handler(request):
+        if not up["value"]:
+            raise httpx.ConnectError("down")
+        return httpx.Response(200, json={"customer": {"id": 1}})
+
+    cache = ResponseCache(MemoryCacheBackend(), ttl=0, stale_ttl=60)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    client = make_client(handler, cache=cache, circuit_breaker=breaker)
+
+    async def scenario():
+        await client.get_customer(1, site="s", id_type="id")
+        up["value"] = False
+        first = await client.get_customer(1, site="s", id_type="id")
+        second = await client.get_customer(1, site="s", id_type="id")
+        return first, second
+
+    first, second = run(client, scenario)
+    assert breaker.state == OPEN
+    assert first.cache_status == second.cache_status == "STALE"
+    assert second.get_response() == {"customer": {"id": 1}}
+    assert client.fallbacks_total == 2
+    # the retry of the first failing call is short-circuited as well
+    assert breaker.short_circuited_total == 2
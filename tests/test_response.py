@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from api.base_api.response import Response
+
+PAGE = {
+    "success": True,
+    "customers": [{"id": 1, "tags": ["a", "]"], "note": "x\"}"}, {"id": 2, "nested": {"k": [1, {"z": None}]}}],
+    "pagination": {"limit": 20, "totalCount": 2, "currentPage": 1, "totalPageCount": 1},
+}
+
+
+@pytest.mark.parametrize("raw", [
+    json.dumps(PAGE).encode(),
+    json.dumps(PAGE, indent=2).encode(),
+    json.dumps(PAGE, ensure_ascii=False, separators=(",", ":")).encode(),
+])
+def test_lazy_accessors_match_full_parse(raw):
+    response = Response(200, raw=raw)
+    assert list(response.iter_items("customers")) == PAGE["customers"]
+    assert response.get_value("pagination") == PAGE["pagination"]
+    assert response.get_value("missing", 5) == 5
+    assert list(response.iter_items("orders")) == []
+    assert response.get_raw() is raw
+    assert response.get_response() == PAGE
+
+
+def test_body_is_parsed_once_and_cached():
+    response = Response(200, raw=b'{"customers": []}')
+    assert response.get_response() is response.get_response()
+    assert list(response.iter_items("customers")) == []
+
+
+def test_invalid_json_is_reported_lazily():
+    response = Response(502, raw=b"<html>Bad gateway</html>")
+    assert not response.is_successful()
+    assert response.get_error_msg().startswith("Invalid JSON response")
+    assert json.loads(response.get_raw())["errorMsg"].startswith("Invalid JSON response")
+
+
+def test_undecodable_body_takes_the_full_parse_path():
+    for accessor in (lambda r: r.get_value("success"), lambda r: list(r.iter_items("customers"))):
+        response = Response(502, raw=b'{"success": false, "errorMsg": "\xff"}')
+        assert accessor(response) in (None, [])
+        assert response.get_error_msg().startswith("Invalid JSON response")
+
+
+def test_constructed_body_is_encoded_on_demand():
+    response = Response(200, {"id": 3})
+    assert list(response.iter_items("id")) == []
+    assert json.loads(response.get_raw()) == {"id": 3}
+    assert not hasattr(response, "__dict__")
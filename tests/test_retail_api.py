@@ -1,3 +1,5 @@
+import json
+
 import pytest
 from fastapi.testclient import TestClient
 
@@ -10,6 +12,7 @@ class DummyResponse:
     def __init__(self, status_code: int, body: any):
         self._status_code = status_code
         self._body = body
+        self.cache_status = None
 
     def is_successful(self) -> bool:
         return True
@@ -20,9 +23,12 @@ class DummyResponse:
     def get_response(self) -> any:
         return self._body
 
+    def get_raw(self) -> bytes:
+        return json.dumps(self._body).encode()
+
 
 class StubClient:
-    async def get_customers(self, limit=20, page=1, filters=None):
+    async def get_customers(self, limit=20, page=1, filters=None, use_cache=True):
         return DummyResponse(200, {
             "customers": [{"id": 1}],
             "pagination": {"limit": limit, "currentPage": page, "totalPageCount": 1, "totalCount": 1}
@@ -34,7 +40,7 @@ class StubClient:
     async def get_customer(self, customer_id: str | int, site: str, id_type: str = 'externalId'):
         return DummyResponse(200, {"customer": {"id": int(customer_id)}})
 
-    async def get_orders(self, filters=None, limit=20, page=1):
+    async def get_orders(self, filters=None, limit=20, page=1, use_cache=True):
         return DummyResponse(200, {
             "orders": [{"id": 1}],
             "pagination": {"limit": limit, "currentPage": page, "totalPageCount": 1, "totalCount": 1}
@@ -52,6 +58,16 @@ class StubClient:
     async def order_payment_create(self, payment: dict, site: str):
         return DummyResponse(200, {"id": 789})
 
+    async def upload_customers(self, customers: list, site: str | None = None, chunk_size: int = 50, concurrency: int = 4):
+        return [{"success": True, "id": i, "site": site} for i, _ in enumerate(customers)]
+
+    async def upload_orders(self, orders: list, site: str | None = None, chunk_size: int = 50, concurrency: int = 4):
+        return [
+            {"success": False, "error": "bad offer"} if order["externalId"] == "BAD"
+            else {"success": True, "id": i, "externalId": order["externalId"]}
+            for i, order in enumerate(orders)
+        ]
+
 
 @pytest.fixture(autouse=True)
 def override_crm_client(monkeypatch):
@@ -109,3 +125,40 @@ def test_create_payment(client):
     response = client.post("/api/retailCRM/orders/payments", json=payload)
     assert response.status_code == 200
     assert response.json() == {"id": 789}
+
+
+def test_create_orders_batch(client):
+    payload = {"orders": [
+        {"externalId": "ORD-1", "items": [{"quantity": 1, "offerId": 10}]},
+        {"externalId": "BAD", "items": [{"quantity": 1, "offerId": 11}]},
+        {"externalId": "ORD-3", "items": [{"quantity": 1, "offerId": 12}], "site": "other"},
+    ]}
+    response = client.post("/api/retailCRM/orders/batch", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["uploaded"], data["failed"]) == (2, 1)
+    assert [result["index"] for result in data["results"]] == [0, 1, 2]
+    assert data["results"][1] == {"index": 1, "success": False, "error": "bad offer"}
+
+
+def test_import_customers_ndjson(client):
+    rows = [
+        {"firstName": "John", "email": "john@example.com", "phone": "123", "countryIso": "RU"},
+        {"firstName": "Jane"},
+        {"firstName": "Ann", "email": "ann@example.com", "phone": "456", "countryIso": "RU", "site": "other"},
+    ]
+    body = "\n".join(json.dumps(row) for row in rows) + "\n"
+    response = client.post("/api/retailCRM/customers/batch", content=body,
+                           headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    results = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda r: r["row"])
+    assert [r["success"] for r in results] == [True, False, True]
+    assert results[0]["site"] != "other" and results[2]["site"] == "other"
+
+
+def test_import_customers_csv(client):
+    body = "firstName,email,phone,countryIso\nJohn,john@example.com,123,RU\nJane,jane@example.com,456,RU\n"
+    response = client.post("/api/retailCRM/customers/batch", content=body, headers={"Content-Type": "text/csv"})
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["row"] for r in results] == [1, 2]
+    assert all(r["success"] for r in results)
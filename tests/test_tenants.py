@@ -0,0 +1,104 @@
+import asyncio
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from api.base_api.response import Response
+from api.jobs.queue import ORDER, SUCCEEDED, JobQueue
+from api.jobs.worker import JobRunner
+from config import TenantConfig, settings
+from server.server import app
+
+
+class SiteClient:
+    def __init__(self, name):
+        self.name = name
+        self.created = []
+
+    async def get_customer(self, customer_id, site, id_type="id"):
+        return Response(200, {"customer": {"id": customer_id, "tenant": self.name, "site": site}})
+
+    async def order_create(self, order, site=None):
+        self.created.append((site, order))
+        return Response(201, {"success": True, "id": len(self.created)})
+
+
+@pytest.fixture
+def tenants(monkeypatch):
+    monkeypatch.setattr(settings, "tenants", {
+        "shop2": TenantConfig(api_key="k2", base_url="http://shop2.test", site_code="s2", crm_rate_limit=2),
+    })
+    with TestClient(app) as test_client:
+        registry = app.state.tenants
+        for tenant in registry.tenants.values():
+            tenant.client.get_customer = SiteClient(tenant.name).get_customer
+        yield test_client, registry
+
+
+def test_tenant_is_selected_by_path_prefix_or_header(tenants):
+    test_client, registry = tenants
+    default = test_client.get("/api/retailCRM/customers/1").json()["customer"]
+    by_path = test_client.get("/t/shop2/api/retailCRM/customers/1").json()["customer"]
+    by_header = test_client.get("/api/retailCRM/customers/1", headers={"X-Tenant": "shop2"}).json()["customer"]
+    unknown = test_client.get("/t/nope/api/retailCRM/customers/1")
+
+    assert (default["tenant"], default["site"]) == ("default", settings.site_code)
+    assert by_path == by_header == {"id": "1", "tenant": "shop2", "site": "s2"}
+    assert unknown.status_code == 404
+    assert test_client.get("/t/shop2/api/retailCRM/client/stats").json()["tenant"] == "shop2"
+    assert REGISTRY.get_sample_value("retailapi_http_requests_total", {
+        "tenant": "shop2", "method": "GET", "route": "/api/retailCRM/customers/{customer_id}", "status_class": "2xx",
+    }) >= 2
+
+
+def test_tenants_get_their_own_client_settings(tenants):
+    _, registry = tenants
+    default, shop2 = registry.get(None), registry.get("shop2")
+    assert shop2.settings.base_url == "http://shop2.test"
+    assert shop2.settings.crm_rate_limit == 2
+    assert shop2.settings.crm_read_timeout == settings.crm_read_timeout
+    assert shop2.cache.namespace == "retailcrm:shop2"
+    assert default.cache.namespace == "retailcrm"
+    assert shop2.idempotency.namespace != default.idempotency.namespace
+
+
+def test_queued_jobs_go_to_their_tenant(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    default, shop2 = SiteClient("default"), SiteClient("shop2")
+    runner = JobRunner(default, queue, tenant_clients={"shop2": shop2})
+
+    async def scenario():
+        submitted = (
+            await runner.submit(ORDER, {"externalId": "A"}, site="s"),
+            await runner.submit(ORDER, {"externalId": "B"}, site="s", tenant="shop2"),
+        )
+        while await runner.process_once():
+            pass
+        return submitted
+
+    first, second = asyncio.run(scenario())
+    assert default.created == [("s", {"externalId": "A"})]
+    assert shop2.created == [("s", {"externalId": "B"})]
+    assert queue.get(first)["tenant"] is None
+    assert queue.get(second)["status"] == SUCCEEDED
+    queue.close()
+
+
+def test_queue_files_without_a_tenant_column_are_migrated(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, site TEXT, payload TEXT NOT NULL, "
+        "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL, "
+        "lease_owner TEXT, lease_expires REAL, result TEXT, error TEXT, created_at REAL NOT NULL, "
+        "updated_at REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO jobs VALUES ('old', 'order', 's', '{}', 'queued', 0, 0, NULL, NULL, NULL, NULL, 0, 0)")
+    conn.commit()
+    conn.close()
+
+    queue = JobQueue(path)
+    assert [job["tenant"] for job in queue.claim(ORDER, "worker", 10, lease=60)] == [None]
+    queue.close()
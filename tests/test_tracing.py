@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from api.base_api.api_client_retailcrm import ApiClientRetailCRM
+from api.retail_api.retail_api import get_crm_client
+from config import settings
+from observability import tracing
+from server.server import app
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT = f"00-{TRACE_ID}-00f067aa0ba902b7-01"
+
+
+@pytest.fixture
+def memory_tracing(monkeypatch):
+    monkeypatch.setattr(settings, "tracing_enabled", True)
+    monkeypatch.setattr(settings, "tracing_exporter", "memory")
+    monkeypatch.setattr(settings, "tracing_sample_ratio", 1.0)
+    yield
+    tracing.shutdown()
+
+
+def test_route_and_upstream_spans_share_the_incoming_trace(memory_tracing):
+    outgoing = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        outgoing.append(request.headers.get("traceparent"))
+        return httpx.Response(200, json={"success": True, "customer": {"id": 1}})
+
+    client = ApiClientRetailCRM("https://crm.test", "key", transport=httpx.MockTransport(handler))
+    app.dependency_overrides[get_crm_client] = lambda: client
+    try:
+        with TestClient(app) as test_client:
+            response = test_client.get("/api/retailCRM/customers/1", headers={"traceparent": PARENT})
+            spans = {span.name: span for span in tracing.finished_spans()}
+    finally:
+        app.dependency_overrides.clear()
+        asyncio.run(client.close_client())
+
+    assert response.status_code == 200
+    server = spans["GET /api/retailCRM/customers/{customer_id}"]
+    upstream = spans["GET /customers/{id}"]
+    assert format(server.context.trace_id, "032x") == TRACE_ID
+    assert upstream.parent.span_id == server.context.span_id
+    assert upstream.attributes["http.response.status_code"] == 200
+    assert upstream.attributes["http.response.body.size"] > 0
+    assert outgoing[0].split("-")[1] == TRACE_ID
+    assert outgoing[0].split("-")[2] == format(upstream.context.span_id, "016x")
+
+
+def test_no_spans_or_headers_when_disabled():
+    assert not tracing.enabled()
+    headers = {"X-API-KEY": "key"}
+    assert tracing.inject(headers) is headers
+    with tracing.span("noop") as span:
+        assert span is None
+
+
+def test_otlp_file_exporter_writes_hex_ids(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    provider = tracing.TracerProvider()
+    provider.add_span_processor(tracing.SimpleSpanProcessor(tracing.OTLPJsonFileExporter(str(path))))
+    tracer = provider.get_tracer("test")
+    with tracer.start_as_current_span("parent"):
+        with tracer.start_as_current_span("child"):
+            pass
+    provider.shutdown()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    spans = [span for line in lines for span in line["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+    child, parent = spans
+    assert child["name"] == "child"
+    assert child["parentSpanId"] == parent["spanId"]
+    assert len(child["traceId"]) == 32
+    int(child["traceId"], 16)
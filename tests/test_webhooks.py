@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.retail_api.webhooks import WebhookEvent, WebhookProcessor
+from config import settings
+from server.server import app
+
+URL = "/api/retailCRM/webhooks/retailcrm"
+
+
+class RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    async def invalidate_customer(self, customer_id=None, external_id=None):
+        self.calls.append(("invalidate_customer", customer_id, external_id))
+
+    async def invalidate_customer_orders(self, customer_id=None):
+        self.calls.append(("invalidate_orders", customer_id))
+
+    async def get_customer(self, customer_id, site, id_type="externalId"):
+        self.calls.append(("get_customer", customer_id, id_type))
+
+    async def get_orders_by_customer(self, customer_id, site=None, limit=20, page=1):
+        self.calls.append(("get_orders", customer_id))
+
+
+def test_burst_for_one_entity_costs_one_refetch():
+    client = RecordingClient()
+
+    async def scenario():
+        processor = WebhookProcessor(client, secret="s", site_code="site", debounce=0.05)
+        for _ in range(20):
+            processor.submit(WebhookEvent(entity="order", id=7, customerId=3))
+        await asyncio.sleep(0.1)
+        processor.submit(WebhookEvent(entity="customer", id=3))
+        await asyncio.sleep(0.1)
+        await processor.close()
+        return processor.stats()
+
+    stats = asyncio.run(scenario())
+    assert client.calls.count(("get_orders", 3)) == 1
+    assert client.calls.count(("get_customer", 3, "id")) == 2
+    assert stats["received_total"] == 21
+    assert stats["coalesced_total"] == 38
+    assert stats["pending"] == 0
+
+
+def test_per_process_cache_with_several_workers_is_refused(monkeypatch):
+    monkeypatch.setattr(settings, "webhook_secret", "top-secret")
+    monkeypatch.setattr(settings, "workers", 4)
+    with pytest.raises(ValueError):
+        WebhookProcessor.from_settings(RecordingClient(), settings)
+    monkeypatch.setattr(settings, "cache_backend", "redis")
+    assert WebhookProcessor.from_settings(RecordingClient(), settings) is not None
+
+
+@pytest.fixture
+def webhooks(monkeypatch):
+    monkeypatch.setattr(settings, "webhook_secret", "top-secret")
+    monkeypatch.setattr(settings, "webhook_debounce", 0.01)
+    client = RecordingClient()
+    with TestClient(app) as test_client:
+        app.state.webhooks.client = client
+        yield test_client, client
+
+
+def test_secret_is_required(webhooks):
+    test_client, client = webhooks
+    assert test_client.post(URL, json={"entity": "customer", "id": 1}).status_code == 403
+    assert test_client.post(URL, json={"entity": "customer", "id": 1},
+                            headers={"X-Webhook-Secret": "wrong"}).status_code == 403
+    assert client.calls == []
+
+
+def test_trigger_form_callback_refreshes_the_customer(webhooks):
+    test_client, client = webhooks
+    response = test_client.post(
+        URL + "?secret=top-secret",
+        content="entity=customer&externalId=ext-1",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    assert response.status_code == 202
+    assert test_client.post(URL, json={"entity": "nope"}, headers={"X-Webhook-Secret": "top-secret"}).status_code == 422
+    for _ in range(100):
+        if ("get_customer", "ext-1", "externalId") in client.calls:
+            break
+        time.sleep(0.01)
+    assert client.calls == [("invalidate_customer", None, "ext-1"), ("get_customer", "ext-1", "externalId")]
+
+
+def test_endpoint_is_hidden_without_a_secret():
+    with TestClient(app) as test_client:
+        assert test_client.post(URL, json={"entity": "customer", "id": 1}).status_code == 404